@@ -0,0 +1,56 @@
+#!/usr/bin/env python
+"""
+Compare request size and server-side decode time of the legacy
+comma-separated decimal pixel upload against the octet-stream encodings
+accepted by /json/dudles/updateBinary.
+
+Usage: python bench/pixel_upload.py [iterations]
+"""
+
+import os
+import sys
+import base64
+import random
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+from dudlr.utils import decode_pixel_data
+
+
+WIDTH, HEIGHT = 500, 250
+
+
+def canvas():
+    """
+    A white canvas with some black and grey scribbles on it.
+    """
+    rnd = random.Random(500)
+    pixels = [255] * (WIDTH * HEIGHT)
+    for i in range(40):
+        y = rnd.randrange(HEIGHT)
+        x = rnd.randrange(WIDTH - 100)
+        shade = rnd.choice((0, 127))
+        for dx in range(100):
+            pixels[y * WIDTH + x + dx] = shade
+    return pixels
+
+
+def main(iterations=20):
+    pixels = canvas()
+    raw = ''.join([ chr(p) for p in pixels ])
+    payloads = [
+        ('decimal', ','.join([ str(p) for p in pixels ])),
+        ('base64', base64.b64encode(raw)),
+        ('raw', raw),
+    ]
+    print '%-8s %10s %12s' % ('encoding', 'bytes', 'decode (ms)')
+    for encoding, payload in payloads:
+        assert decode_pixel_data(payload, encoding) == raw
+        t = timeit.Timer(lambda: decode_pixel_data(payload, encoding))
+        best = min(t.repeat(3, iterations)) / iterations
+        print '%-8s %10d %12.3f' % (encoding, len(payload), best * 1000)
+
+
+if __name__ == '__main__':
+    main(*[ int(a) for a in sys.argv[1:] ])
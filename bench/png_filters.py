@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+"""
+Compare PNG size and encoding time for each scanline filter strategy
+across the png test_suite patterns and a rendered dudle.
+
+Usage: python bench/png_filters.py [size]
+"""
+
+import os
+import sys
+import time
+from StringIO import StringIO
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+from dudlr.ext import png
+from dudlr import raster
+
+from stroke_codec import drawing
+
+
+STRATEGIES = [
+    ('none', png.FILTER_NONE),
+    ('sub', png.FILTER_SUB),
+    ('up', png.FILTER_UP),
+    ('average', png.FILTER_AVERAGE),
+    ('paeth', png.FILTER_PAETH),
+    ('adaptive', png.FILTER_ADAPTIVE),
+]
+
+
+def encode(width, height, pixels, filter_type):
+    fd = StringIO()
+    writer = png.Writer(width, height, greyscale=True,
+                        filter_type=filter_type)
+    writer.write_buffer(fd, pixels)
+    return fd.getvalue()
+
+
+def images(size):
+    for name in sorted(png.test_patterns):
+        yield name, size, size, png.test_pattern(size, size, 1, name)
+    canvas = raster.render(raster.strokes.decode(drawing()))
+    yield 'dudle', canvas.width, canvas.height, canvas.pixels
+
+
+def main(size=128):
+    numpy = png.numpy
+    modes = [('pure', None)]
+    if numpy is not None:
+        modes.append(('numpy', numpy))
+    header = '%-6s' % 'image'
+    for name, _ in STRATEGIES:
+        header += ' %9s' % name
+    print 'PNG size in bytes'
+    print header
+    totals = dict([ (name, 0) for name, _ in STRATEGIES ])
+    timings = {}
+    for image, width, height, pixels in images(size):
+        line = '%-6s' % image
+        for name, filter_type in STRATEGIES:
+            for mode, np in modes:
+                png.numpy = np
+                start = time.time()
+                out = encode(width, height, pixels, filter_type)
+                timings[(name, mode)] = (timings.get((name, mode), 0)
+                                         + time.time() - start)
+            png.numpy = numpy
+            totals[name] += len(out)
+            line += ' %9d' % len(out)
+        print line
+    line = '%-6s' % 'total'
+    for name, _ in STRATEGIES:
+        line += ' %9d' % totals[name]
+    print line
+    print
+    print 'Total encoding time in ms'
+    for mode, _ in modes:
+        line = '%-6s' % mode
+        for name, _ in STRATEGIES:
+            line += ' %9.1f' % (timings[(name, mode)] * 1000)
+        print line
+
+
+if __name__ == '__main__':
+    main(*[ int(a) for a in sys.argv[1:] ])
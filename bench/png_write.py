@@ -0,0 +1,74 @@
+#!/usr/bin/env python
+"""
+Compare encoding a 500x250 greyscale dudle with the scanline generator
+that core._pngData used to feed png.Writer.write against the buffer
+based png.Writer.write_buffer, with and without NumPy.
+
+Usage: python bench/png_write.py [iterations]
+"""
+
+import os
+import sys
+import random
+import timeit
+from StringIO import StringIO
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+from dudlr.ext import png
+
+
+WIDTH, HEIGHT = 500, 250
+
+
+def canvas():
+    rnd = random.Random(500)
+    pixels = [255] * (WIDTH * HEIGHT)
+    for i in range(40):
+        y = rnd.randrange(HEIGHT)
+        x = rnd.randrange(WIDTH - 100)
+        shade = rnd.choice((0, 127))
+        for dx in range(100):
+            pixels[y * WIDTH + x + dx] = shade
+    return ''.join([ chr(p) for p in pixels ])
+
+
+def scanline_generator(data):
+    fd = StringIO()
+    writer = png.Writer(WIDTH, HEIGHT, greyscale=True)
+    def scanlines():
+        for i in range(HEIGHT):
+            offset = i * WIDTH
+            yield [ ord(c) for c in data[offset:offset+WIDTH] ]
+    writer.write(fd, scanlines())
+    return fd.getvalue()
+
+
+def write_buffer(data):
+    fd = StringIO()
+    writer = png.Writer(WIDTH, HEIGHT, greyscale=True)
+    writer.write_buffer(fd, data, WIDTH)
+    return fd.getvalue()
+
+
+def main(iterations=20):
+    data = canvas()
+    numpy = png.numpy
+    cases = [('scanline generator', scanline_generator, numpy),
+             ('write_buffer (pure)', write_buffer, None)]
+    if numpy is not None:
+        cases.append(('write_buffer (numpy)', write_buffer, numpy))
+    expected = None
+    print '%-24s %10s %8s' % ('path', 'ms', 'bytes')
+    for name, f, np in cases:
+        png.numpy = np
+        out = f(data)
+        pixels = png.Reader(file=StringIO(out)).read()[2].tostring()
+        assert pixels == data
+        best = min(timeit.Timer(lambda: f(data)).repeat(3, iterations))
+        print '%-24s %10.2f %8d' % (name, best / iterations * 1000, len(out))
+    png.numpy = numpy
+
+
+if __name__ == '__main__':
+    main(*[ int(a) for a in sys.argv[1:] ])
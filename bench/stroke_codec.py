@@ -0,0 +1,74 @@
+#!/usr/bin/env python
+"""
+Compare the size of legacy text stroke data with the binary stroke format,
+plain and zlib-wrapped, and time the conversions.
+
+Usage: python bench/stroke_codec.py [strokes]
+"""
+
+import os
+import sys
+import math
+import base64
+import random
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+from dudlr import strokes
+
+
+def drawing(count=200):
+    """
+    Smooth, mouse-like strokes with the occasional fill, roughly what
+    DudlrStrokeRecorder produces for a busy dudle.
+    """
+    rnd = random.Random(250)
+    commands = []
+    for i in range(count):
+        x, y = rnd.randrange(500), rnd.randrange(250)
+        commands.append(('m', x, y))
+        if i % 10 == 0:
+            commands.append(('s', rnd.randrange(1, 5)))
+        angle = rnd.uniform(0, 2 * math.pi)
+        points = []
+        for j in range(rnd.randrange(20, 120)):
+            angle += rnd.uniform(-0.3, 0.3)
+            x = min(max(int(x + 3 * math.cos(angle)), 0), 500)
+            y = min(max(int(y + 3 * math.sin(angle)), 0), 250)
+            points.append((x, y))
+        commands.append(('l', points))
+        if i % 10 == 0:
+            commands.append(('f',))
+    return strokes.format_text(commands)
+
+
+def main(count=200):
+    text = drawing(count)
+    binary = strokes.to_binary(text)
+    packed = strokes.to_binary(text, compress=True)
+    assert strokes.to_text(binary) == text
+    assert strokes.to_text(packed) == text
+
+    print '%-28s %10s %8s' % ('representation', 'bytes', 'ratio')
+    for name, data in [
+            ('text (stored)', text),
+            ('text (json)', '"%s"' % text),
+            ('binary', binary),
+            ('binary+zlib (stored)', packed),
+            ('binary base64 (json)', base64.b64encode(binary))]:
+        print '%-28s %10d %8.1f' % (name, len(data),
+                                   len(text) / float(len(data)))
+
+    print
+    print '%-28s %10s' % ('conversion', 'ms')
+    for name, f in [
+            ('text -> binary+zlib', lambda: strokes.to_binary(text, True)),
+            ('binary+zlib -> binary', lambda: strokes.to_binary(packed)),
+            ('binary+zlib -> text', lambda: strokes.to_text(packed))]:
+        best = min(timeit.Timer(f).repeat(3, 5)) / 5
+        print '%-28s %10.2f' % (name, best * 1000)
+
+
+if __name__ == '__main__':
+    main(*[ int(a) for a in sys.argv[1:] ])
@@ -0,0 +1,145 @@
+#!/usr/bin/env python
+"""
+Compare the chained replace escape jinja2 falls back to without its C
+speedups against the current pure python one, on the values a dudle
+listing prints, along with markup_join, unicode_join and a full render
+of latest.html with a page of dudles.
+
+Usage: python bench/template_escape.py [iterations]
+"""
+
+import os
+import sys
+import datetime
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+import jinja2.runtime
+import jinja2.utils
+from itertools import chain, imap
+from jinja2 import Environment, FileSystemLoader
+from jinja2.utils import Markup, soft_unicode, concat
+from dudlr.utils import TEMPLATE_PATH
+
+
+def legacy_escape(s):
+    if hasattr(s, '__html__'):
+        return s.__html__()
+    return Markup(unicode(s)
+        .replace('&', '&amp;')
+        .replace('>', '&gt;')
+        .replace('<', '&lt;')
+        .replace("'", '&#39;')
+        .replace('"', '&#34;')
+    )
+
+
+def legacy_markup_join(seq):
+    buf = []
+    iterator = imap(soft_unicode, seq)
+    for arg in iterator:
+        buf.append(arg)
+        if hasattr(arg, '__html__'):
+            return Markup(u'').join(chain(buf, iterator))
+    return concat(buf)
+
+
+def legacy_unicode_join(seq):
+    return concat(imap(unicode, seq))
+
+
+IMPLEMENTATIONS = [
+    ('legacy', legacy_escape, legacy_markup_join, legacy_unicode_join),
+    ('current', jinja2.utils.escape, jinja2.runtime.markup_join,
+     jinja2.runtime.unicode_join),
+]
+
+# what latest.html prints: ids, page numbers, names, etags, dates
+VALUES = [
+    ('dudle id', 4829),
+    ('artist name', u'sketchy artist'),
+    ('name with <&>', u'Tom & Jerry <3'),
+    ('image etag', '9f86d081884c7d659a2feaa0c55ad015'),
+    ('created date', datetime.datetime(2009, 3, 14, 15, 9, 26)),
+    ('markup', Markup(u'<em>dudle</em>')),
+]
+
+JOINED = [u'/dudlr/', 4829, u'?page=', 2, u'&cursor=', 'ZGZqa2w']
+
+
+class Key(object):
+
+    def __init__(self, id):
+        self._id = id
+
+    def id(self):
+        return self._id
+
+
+class Artist(object):
+
+    def __init__(self, id, name):
+        self._key = Key(id)
+        self.name = name
+
+    def key(self):
+        return self._key
+
+
+class Dudle(object):
+
+    def __init__(self, id):
+        self.public = id % 7 != 0
+        self.rating = id * 37 % 100
+        self.anonymous = id % 5 == 0
+        self.image_etag = '%032x' % (id * 2654435761)
+        self.artist = Artist(id % 3 + 1, u'artist <%d>' % (id % 3))
+        self.created_date = datetime.datetime(2009, 3, 14, 15, id % 60)
+
+
+def listing():
+    ids = range(1000, 1005)
+    return dict(request={'path': '/'}, user=None, dudlr=None, artist=False,
+                dudle_ids=ids, dudles=dict((i, Dudle(i)) for i in ids),
+                cursor='ZGZqa2w', page=2, pages=9, inline_strokes=None)
+
+
+def best(func, number):
+    return min(timeit.repeat(func, number=number, repeat=3))
+
+
+def main():
+    number = len(sys.argv) > 1 and int(sys.argv[1]) or 100000
+    context = listing()
+    print '%-16s %12s %12s' % ('', 'legacy (us)', 'current (us)')
+
+    for label, value in VALUES:
+        times = [ best(lambda: impl[1](value), number) * 1e6 / number
+                  for impl in IMPLEMENTATIONS ]
+        print '%-16s %12.3f %12.3f' % ((label,) + tuple(times))
+
+    for label, index in (('markup_join', 2), ('unicode_join', 3)):
+        times = [ best(lambda: impl[index](JOINED), number) * 1e6 / number
+                  for impl in IMPLEMENTATIONS ]
+        print '%-16s %12.3f %12.3f' % ((label,) + tuple(times))
+
+    times = []
+    output = []
+    for impl in IMPLEMENTATIONS:
+        # compiled templates bind escape when they are executed
+        jinja2.utils.escape = jinja2.runtime.escape = impl[1]
+        env = Environment(loader=FileSystemLoader(TEMPLATE_PATH),
+                          autoescape=True, trim_blocks=True)
+        template = env.get_template('latest.html')
+        output.append(template.render(context))
+        renders = max(number // 100, 10)
+        times.append(best(lambda: template.render(context), renders) *
+                     1e6 / renders)
+    jinja2.utils.escape = jinja2.runtime.escape = IMPLEMENTATIONS[1][1]
+    print '%-16s %12.1f %12.1f' % (('latest.html',) + tuple(times))
+    assert output[0] == output[1], 'renders differ'
+
+
+if __name__ == '__main__':
+    main()
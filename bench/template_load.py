@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+"""
+Time cold get_template calls for every dudlr template: parsing and
+compiling the sources, unmarshalling bytecode from a warm bytecode cache,
+and importing the modules written by Environment.compile_templates.  Each
+round uses a fresh environment and forgets the imported modules, the way a
+new instance starts out.
+
+Usage: python bench/template_load.py [rounds]
+"""
+
+import os
+import sys
+import shutil
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+from jinja2 import Environment, FileSystemLoader, ModuleLoader, \
+     MemoryBytecodeCache
+from dudlr.utils import TEMPLATE_PATH
+
+
+PACKAGE = 'bench_compiled_templates'
+
+
+def environment(loader, **options):
+    return Environment(loader=loader, autoescape=True, trim_blocks=True,
+                       **options)
+
+
+def forget_modules():
+    for name in list(sys.modules):
+        if name == PACKAGE or name.startswith(PACKAGE + '.'):
+            del sys.modules[name]
+
+
+def load_all(env, names):
+    start = time.time()
+    for name in names:
+        env.get_template(name)
+    return time.time() - start
+
+
+def bench(label, make_env, names, rounds):
+    best = None
+    for i in range(rounds):
+        forget_modules()
+        elapsed = load_all(make_env(), names)
+        if best is None or elapsed < best:
+            best = elapsed
+    print '%-20s %8.2f ms  (%.2f ms per template)' % (
+        label, best * 1000, best * 1000 / len(names))
+    return best
+
+
+def main():
+    rounds = len(sys.argv) > 1 and int(sys.argv[1]) or 20
+    source = FileSystemLoader(TEMPLATE_PATH)
+    names = source.list_templates()
+
+    target = tempfile.mkdtemp()
+    sys.path.insert(0, target)
+    try:
+        environment(source).compile_templates(os.path.join(target, PACKAGE))
+        bcc = MemoryBytecodeCache()
+        load_all(environment(source, bytecode_cache=bcc), names)
+
+        print '%d templates, best of %d rounds' % (len(names), rounds)
+        parsed = bench('source', lambda: environment(source), names, rounds)
+        cached = bench('bytecode cache',
+                       lambda: environment(source, bytecode_cache=bcc),
+                       names, rounds)
+        # the first import writes the .pyc files, like the first request
+        # after a deployment
+        load_all(environment(ModuleLoader(PACKAGE)), names)
+        imported = bench('precompiled modules',
+                         lambda: environment(ModuleLoader(PACKAGE)),
+                         names, rounds)
+        print 'speedup: %.1fx bytecode cache, %.1fx precompiled' % (
+            parsed / cached, parsed / imported)
+    finally:
+        forget_modules()
+        shutil.rmtree(target)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,12 +1,14 @@
 from google.appengine.ext import webapp
 from google.appengine.ext.webapp.util import login_required, run_wsgi_app
 
+from dudlr import core
 from dudlr import views
 
 
 DEBUG = True
 
 def main():
+    core.reset_request_cache()
     app = webapp.WSGIApplication([
         ('/', views.ViewDudleHandler),
         ('/dudles/draw', views.DudlrDemoHandler),
@@ -19,8 +21,17 @@ def main():
         ('/json/dudles/save', views.DudleCreationHandler),
         ('/json/dudles/rate', views.RatingHandler),
         ('/json/dudles/update', views.DudleUpdateHandler),
+        ('/json/dudles/updateBinary', views.DudleBinaryUpdateHandler),
         ('/json/dudles/updateStrokes', views.DudleUpdateStrokesHandler),
-        ('/json/dudles/strokes', views.DudleStrokes)
+        ('/json/dudles/appendStrokes', views.DudleAppendStrokesHandler),
+        ('/json/dudles/finalizeStrokes', views.DudleFinalizeStrokesHandler),
+        ('/json/dudles/strokes', views.DudleStrokes),
+        ('/json/dudles/bulkStrokes', views.DudleBulkStrokes),
+        ('/admin/migrate/blobs', views.MigrateBlobsHandler),
+        ('/admin/migrate/ratings', views.MigrateRatingsHandler),
+        ('/admin/recount', views.RecountHandler),
+        ('/admin/rerank', views.RerankHandler),
+        ('/admin/tasks/flushRating', views.FlushRatingHandler)
         ], debug=DEBUG)
     run_wsgi_app(app)
 
@@ -0,0 +1,139 @@
+"""
+Output caching.
+
+C{OutputCache} keeps rendered output in a backend speaking the memcache
+C{get}/C{set}/C{delete} API: C{MemcacheBackend} uses App Engine's
+memcache, shared by all instances, and C{LRUCache} keeps a bounded
+number of entries in process, standing in for memcache where it is not
+available.  Entries are grouped under namespaces whose version is part
+of every key, so bumping the version invalidates a whole namespace
+without enumerating its keys.
+"""
+
+import time
+
+try:
+    from google.appengine.api import memcache
+except ImportError:
+    memcache = None
+
+
+# set() takes a memcache-style time argument shadowing the module
+_now = time.time
+
+
+class LRUCache(object):
+    """
+    An in-process cache of at most C{size} entries, evicting the least
+    recently used.
+    """
+
+    def __init__(self, size=200):
+        self.size = size
+        self._entries = {}
+        self._order = []
+
+    def get(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires, value = entry
+        if expires and expires <= _now():
+            self.delete(key)
+            return None
+        self._order.remove(key)
+        self._order.append(key)
+        return value
+
+    def set(self, key, value, time=0):
+        """
+        Store C{value}, expiring after C{time} seconds if non-zero.
+        """
+        if key in self._entries:
+            self._order.remove(key)
+        elif len(self._order) >= self.size:
+            del self._entries[self._order.pop(0)]
+        self._entries[key] = (time and _now() + time, value)
+        self._order.append(key)
+        return True
+
+    def delete(self, key):
+        if key in self._entries:
+            del self._entries[key]
+            self._order.remove(key)
+        return True
+
+
+class MemcacheBackend(object):
+    """
+    App Engine memcache, with keys prefixed by C{prefix}.
+    """
+
+    def __init__(self, prefix='output/'):
+        self.prefix = prefix
+
+    def get(self, key):
+        return memcache.get(self.prefix + key)
+
+    def set(self, key, value, time=0):
+        return memcache.set(self.prefix + key, value, time=time)
+
+    def delete(self, key):
+        return memcache.delete(self.prefix + key)
+
+
+def default_backend():
+    if memcache is not None:
+        return MemcacheBackend()
+    return LRUCache()
+
+
+class OutputCache(object):
+    """
+    Rendered output by namespace and key.
+
+    @ivar backend: a C{LRUCache}, C{MemcacheBackend} or anything else with
+        their C{get}/C{set}/C{delete} methods
+    @ivar ttl: seconds an entry is kept
+    """
+
+    def __init__(self, backend=None, ttl=60):
+        self.backend = backend or default_backend()
+        self.ttl = ttl
+
+    def _version(self, namespace):
+        version = self.backend.get('version/' + namespace)
+        if version is None:
+            version = self.invalidate(namespace)
+        return version
+
+    def _key(self, namespace, key):
+        return '%s/%s/%s' % (namespace, self._version(namespace), key)
+
+    def get(self, namespace, key):
+        return self.backend.get(self._key(namespace, key))
+
+    def set(self, namespace, key, value):
+        self.backend.set(self._key(namespace, key), value, time=self.ttl)
+
+    def invalidate(self, namespace):
+        """
+        Drop every entry of C{namespace} by moving it to a new version.
+
+        @return: the new version
+        """
+        version = '%x' % int(_now() * 1000000)
+        self.backend.set('version/' + namespace, version)
+        return version
+
+
+# rendered listing pages, invalidated whenever a listed dudle changes
+LISTINGS = 'listings'
+
+page_cache = OutputCache()
+
+# stroke data converted to text, keyed by a checksum of the stored data so
+# it never needs invalidating
+STROKES = 'strokes'
+
+stroke_cache = OutputCache(ttl=24 * 3600)
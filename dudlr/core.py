@@ -1,22 +1,122 @@
+import base64
+import calendar
+import hashlib
 import logging
-from StringIO import StringIO
+import math
+import time
+import uuid
+import zlib
 
+from django.utils import simplejson
 from google.appengine.ext import db
 from google.appengine.ext.db import Key
+from google.appengine.api import memcache
 from google.appengine.api import users
-
-from dudlr.models import Dudlr, Dudle, DudleRating
-from dudlr.ext import png
+try:
+    from google.appengine.api import taskqueue
+except ImportError:
+    from google.appengine.api.labs import taskqueue
+
+from dudlr.models import Dudlr, DudlrUser, Dudle, DudleBlob, \
+        DudleImageData, DudleStrokeChunk, DudleRating, RatingShard, \
+        DudleRank
+from dudlr import cache
+from dudlr import counters
+from dudlr import strokes
+from dudlr import raster
+from dudlr.utils import decode_pixel_data, PIXEL_ENCODINGS, \
+        encode_cursor, decode_cursor
 
 
 ERROR_DUDLR_NAME_TAKEN = 'dudlr name is already been taken'
 ERROR_DUDLR_NAME_FROZEN = 'dudlr name has already been set'
 ERROR_NOT_LOGGED_IN = 'user not logged in'
 ERROR_CONFLICT_OF_INTEREST = 'user cannot rate his/her own dudle'
+ERROR_UNKNOWN_ENCODING = 'unknown pixel data encoding'
+ERROR_BAD_PIXEL_DATA = 'malformed pixel data'
+ERROR_BAD_PIXEL_SIZE = 'pixel data does not match the image size'
+ERROR_BAD_UPLOAD_TOKEN = 'invalid upload token'
+ERROR_MISSING_CHUNKS = 'stroke upload is missing chunks'
+ERROR_BAD_CHUNK_COUNT = 'invalid stroke chunk count'
+ERROR_CHUNK_SAVED = 'stroke chunk has already been saved'
+ERROR_BAD_CURSOR = 'invalid page cursor'
 
 class DudleException(Exception):
     pass
 
+class MissingChunksException(DudleException):
+    """
+    Raised when finalizing a chunked upload with gaps in it.
+
+    @ivar missing: sequence numbers the client still has to send
+    """
+
+    def __init__(self, missing):
+        DudleException.__init__(self, ERROR_MISSING_CHUNKS)
+        self.missing = missing
+
+# Dudlrs by user key name, for the current request, for up to
+# DUDLR_CACHE_TTL seconds in the process and for up to DUDLR_MEMCACHE_TTL
+# seconds in memcache, so a process miss usually costs one memcache get
+# rather than the two datastore gets of the DudlrUser link.  Invalidation
+# of the process cache is per process, so another instance may show a
+# renamed dudlr's old name until its entry expires.
+DUDLR_CACHE_TTL = 60
+DUDLR_CACHE_SIZE = 1000
+DUDLR_MEMCACHE_TTL = 3600
+_request_dudlrs = {}
+_cached_dudlrs = cache.LRUCache(DUDLR_CACHE_SIZE)
+
+def reset_request_cache():
+    """
+    Forget what was looked up for the previous request.
+    """
+    _request_dudlrs.clear()
+
+def _userKeyName(user):
+    return 'u%s' % (user.user_id() or user.email())
+
+def _dudlrCacheKey(key_name):
+    return 'dudlr/%s' % key_name
+
+def _cacheDudlr(key_name, dudlr):
+    _request_dudlrs[key_name] = dudlr
+    _cached_dudlrs.set(key_name, dudlr, time=DUDLR_CACHE_TTL)
+    memcache.set(_dudlrCacheKey(key_name), dudlr, time=DUDLR_MEMCACHE_TTL)
+
+def _cachedDudlr(key_name):
+    dudlr = _request_dudlrs.get(key_name)
+    if dudlr is not None:
+        return dudlr
+    dudlr = _cached_dudlrs.get(key_name)
+    if dudlr is None:
+        dudlr = memcache.get(_dudlrCacheKey(key_name))
+        if dudlr is None:
+            return None
+        _cached_dudlrs.set(key_name, dudlr, time=DUDLR_CACHE_TTL)
+    _request_dudlrs[key_name] = dudlr
+    return dudlr
+
+def _invalidateDudlr(user):
+    key_name = _userKeyName(user)
+    _request_dudlrs.pop(key_name, None)
+    _cached_dudlrs.delete(key_name)
+    memcache.delete(_dudlrCacheKey(key_name))
+
+def _lookupDudlr(user):
+    """
+    Get the user's dudlr from the datastore.  Dudlrs made before they
+    were linked by user id are found by query and linked.
+    """
+    key_name = _userKeyName(user)
+    link = DudlrUser.get_by_key_name(key_name)
+    if link is not None:
+        return Dudlr.get(DudlrUser.dudlr.get_value_for_datastore(link))
+    dudlr = Dudlr.all().filter('user = ', user).get()
+    if dudlr is not None:
+        DudlrUser(key_name=key_name, dudlr=dudlr).put()
+    return dudlr
+
 def create_dudlr(user, name):
     """
     Create a new dudlr user
@@ -25,22 +125,30 @@ def create_dudlr(user, name):
     dudlr.name = name
     dudlr.user = user
     dudlr.put()
+    DudlrUser(key_name=_userKeyName(user), dudlr=dudlr).put()
+    _invalidateDudlr(user)
+    return dudlr
 
-def get_dudlr(user=None):
+def get_dudlr(user=None, create=True):
     """
     Get the dudlr associated with google user.
 
     @param user: C{User} object
+    @param create: save a new dudlr if the user has none yet; otherwise
+        an unsaved one is returned
     """
     user = user or users.get_current_user()
     if not user:
         return
-    dudlr = Dudlr.all()
-    dudlr.filter('user = ', user)
-    dudlr = dudlr.get()
-    if not dudlr:
-        dudlr = Dudlr(user=user, name=user.nickname())
-        dudlr.put()
+    key_name = _userKeyName(user)
+    dudlr = _cachedDudlr(key_name)
+    if dudlr is None:
+        dudlr = _lookupDudlr(user)
+        if dudlr is None:
+            if not create:
+                return Dudlr(user=user, name=user.nickname())
+            dudlr = create_dudlr(user, user.nickname())
+        _cacheDudlr(key_name, dudlr)
     return dudlr
 
 def get_dudlr_by_name(name):
@@ -70,7 +178,7 @@ def set_dudlr_name(user, name):
     @param user: C{User} object
     @param name: new name for user
     """
-    dudlr = Dudlr.all().filter('user = ', user).get()
+    dudlr = _lookupDudlr(user) or create_dudlr(user, user.nickname())
     if dudlr.name != user.nickname():
         raise DudleException(ERROR_DUDLR_NAME_FROZEN)
     other = Dudlr.all().filter('name = ', name).get()
@@ -78,6 +186,8 @@ def set_dudlr_name(user, name):
         raise DudleException(ERROR_DUDLR_NAME_TAKEN)
     dudlr.name = name
     dudlr.put()
+    _invalidateDudlr(user)
+    cache.page_cache.invalidate(cache.LISTINGS)
 
 def create_dudle(dudlr=None, request=None):
     """
@@ -90,59 +200,447 @@ def create_dudle(dudlr=None, request=None):
     # todo save
     #if not dudlr and request:
     #    dudle.ip_address = request.
-    dudle.partial_data = db.Blob('')
-    dudle.partial_stroke_data = db.Blob('')
+    dudle.upload_token = uuid.uuid4().hex
     dudle.put()
     return dudle
 
 
-def update_dudle(id, format, data):
+def update_dudle(id, format, data, encoding='decimal'):
     """
     Update DudlePartial with data received from client
+
+    @param encoding: how C{data} is encoded (see C{PIXEL_ENCODINGS});
+        defaults to the legacy comma-separated decimal bytes
     """
-    key = Key.from_path('Dudle', id)
-    dudle = Dudle.get(key);
-    if not hasattr(dudle, 'partial_data'):
-        dudle.partial_data = db.Blob('')
-    dudle.partial_data = db.Blob(dudle.partial_data
-            + ''.join([ chr(int(n)) for n in data.split(',') ]))
-    dudle.put()
+    if encoding not in PIXEL_ENCODINGS:
+        raise DudleException(ERROR_UNKNOWN_ENCODING)
+    try:
+        data = decode_pixel_data(data, encoding)
+    except (TypeError, ValueError):
+        raise DudleException(ERROR_BAD_PIXEL_DATA)
+    partial = _getBlob(id, BLOB_PARTIAL_PIXELS) or ''
+    _putBlob(id, BLOB_PARTIAL_PIXELS, partial + data)
 
 def update_dudle_strokes(id, data):
     """Update stroke data
     """
-    key = Key.from_path('Dudle', id)
-    dudle = Dudle.get(key);
-    if not hasattr(dudle, 'partial_stroke_data'):
-        dudle.partial_stroke_data = db.Blob('')
-    dudle.partial_stroke_data = db.Blob(dudle.partial_stroke_data
-            + data)
-    dudle.put()
+    partial = _getBlob(id, BLOB_PARTIAL_STROKES) or ''
+    _putBlob(id, BLOB_PARTIAL_STROKES, partial + data)
+
+BLOB_STROKES = 'strokes'
+BLOB_PARTIAL_PIXELS = 'partial_data'
+BLOB_PARTIAL_STROKES = 'partial_stroke_data'
+BLOB_NAMES = (BLOB_STROKES, BLOB_PARTIAL_PIXELS, BLOB_PARTIAL_STROKES)
+
+# strokes serialized as returned by the strokes handlers, for inlining
+BLOB_STROKES_JSON = 'strokes_json'
+
+# payloads older dudles keep as dynamic properties on the entity
+LEGACY_BLOBS = BLOB_NAMES + ('image_data', 'thumbnail_data')
+
+def _blobKey(id, name):
+    return Key.from_path('Dudle', id, 'DudleBlob', name)
+
+def _getBlob(id, name, dudle=None):
+    """
+    Get a dudle's payload with a get by key.  If C{dudle} is given and
+    has no record for it, fall back to a legacy property on the dudle.
+    """
+    record = DudleBlob.get(_blobKey(id, name))
+    if record is not None:
+        return record.data
+    if dudle is not None:
+        return getattr(dudle, name, None)
+
+def _putBlob(id, name, data):
+    DudleBlob(parent=Key.from_path('Dudle', id), key_name=name,
+              data=db.Blob(data)).put()
+
+def _dropLegacyBlobs(dudle, names=LEGACY_BLOBS):
+    """
+    Remove legacy payload properties from the (unsaved) dudle.
+    """
+    for name in names:
+        if hasattr(dudle, name):
+            delattr(dudle, name)
+
+def append_dudle_strokes(id, token, seq, data):
+    """
+    Store one chunk of stroke data as its own child record of the dudle.
+
+    Appending costs the same however much has already been uploaded, and
+    retrying a chunk simply overwrites it.  The token must be the dudle's
+    and the chunk must not have been assembled by an earlier finalize;
+    saving a dudle again carries on with the following sequence numbers.
+
+    @param id: id of the dudle
+    @param token: the dudle's upload token
+    @param seq: sequence number of the chunk, starting at 0
+    @param data: stroke data
+    """
+    parent = Key.from_path('Dudle', id)
+    dudle = Dudle.get(parent)
+    if dudle is None or token != getattr(dudle, 'upload_token', None):
+        raise DudleException(ERROR_BAD_UPLOAD_TOKEN)
+    if seq < dudle.stroke_chunks:
+        raise DudleException(ERROR_CHUNK_SAVED)
+    chunk = DudleStrokeChunk(parent=parent,
+            key_name=_chunkKeyName(token, seq),
+            token=token, seq=seq, data=db.Blob(data))
+    chunk.put()
+
+def _chunkKeyName(token, seq):
+    # zero-padded so key order is sequence order
+    return '%s-%08d' % (token, seq)
+
+def _collectStrokeChunks(dudle, token):
+    """
+    Fetch the stroke chunks uploaded with C{token}, in sequence order.
+    """
+    query = DudleStrokeChunk.all().ancestor(dudle).order('__key__')
+    return [ c for c in query if c.token == token ]
 
 def finalize_dudle(id, format, width, height):
     """
     Finalize the Dudle object based on associated DudlePartial
     object and remove the DudlePartial object from the datastore.
+
+    @raise DudleException: if the pixels uploaded are not exactly
+        C{width} by C{height}; they are dropped so the client can start
+        over
     """
     key = Key.from_path('Dudle', id)
     dudle = Dudle.get(key)
-    dudle.image_data = _pngData(dudle.partial_data, width, height)
-    del dudle.partial_data
+    partial = _getBlob(id, BLOB_PARTIAL_PIXELS, dudle) or ''
+    if width <= 0 or height <= 0 or len(partial) != width * height:
+        db.delete(_blobKey(id, BLOB_PARTIAL_PIXELS))
+        raise DudleException(ERROR_BAD_PIXEL_SIZE)
+    image, thumbnail = raster.pixels_png(partial, width, height)
+    _storeImages(dudle, image, thumbnail)
+    db.delete(_blobKey(id, BLOB_PARTIAL_PIXELS))
+    _dropLegacyBlobs(dudle, [BLOB_PARTIAL_PIXELS])
+    counted = _dudleCounters(dudle)
     dudle.complete = True
     dudle.put()
+    _updateCounters(counted, _dudleCounters(dudle))
+    _updateRank(dudle)
+    cache.page_cache.invalidate(cache.LISTINGS)
 
-def finalize_dudle_strokes(id, public=True, anonymous=False):
+def finalize_dudle_strokes(id, public=True, anonymous=False,
+        token=None, count=None):
+    """
+    Finalize the dudle's strokes.  Stroke data sent through
+    C{update_dudle_strokes} is used as is; if C{token} is given, chunks
+    appended with C{append_dudle_strokes} are assembled after it and
+    deleted.  Saving again appends the chunks sent since to the strokes
+    already saved, and a retried finalize saves the same strokes again.
+
+    @param token: upload token of a chunked upload
+    @param count: number of chunks the client sent in all; a gap raises
+        C{MissingChunksException} so the client can resend them
+    """
     key = Key.from_path('Dudle', id)
     dudle = Dudle.get(key)
+    stroke_data = _getBlob(id, BLOB_PARTIAL_STROKES, dudle) or ''
+    if token is not None:
+        if token != getattr(dudle, 'upload_token', None):
+            raise DudleException(ERROR_BAD_UPLOAD_TOKEN)
+        assembled = dudle.stroke_chunks
+        chunks = [ c for c in _collectStrokeChunks(dudle, token)
+                   if c.seq >= assembled ]
+        if count is None:
+            count = max([ c.seq + 1 for c in chunks ] + [assembled])
+        if count < assembled:
+            raise DudleException(ERROR_BAD_CHUNK_COUNT)
+        chunks = [ c for c in chunks if c.seq < count ]
+        seqs = set([ c.seq for c in chunks ])
+        missing = [ n for n in range(assembled, count) if n not in seqs ]
+        if missing:
+            raise MissingChunksException(missing)
+        if assembled:
+            stroke_data = strokes.to_text(
+                    _getBlob(id, BLOB_STROKES, dudle) or '') + stroke_data
+        stroke_data += ''.join([ c.data for c in chunks ])
+        db.delete(chunks)
+        dudle.stroke_chunks = count
+    counted = _dudleCounters(dudle)
     dudle.anonymous = anonymous
     dudle.public = public
-    dudle.strokes = dudle.partial_stroke_data
-    if hasattr(dudle, 'partial_data'):
-        del dudle.partial_data
-    del dudle.partial_stroke_data
-    if len(dudle.strokes) > 7:
+    try:
+        encoded = strokes.to_binary(stroke_data, compress=True)
+    except strokes.StrokeFormatError:
+        logging.warning('storing malformed strokes for dudle %d as text', id)
+        encoded = stroke_data
+    _putBlob(id, BLOB_STROKES, encoded)
+    _putStrokesJson(dudle, encoded)
+    db.delete([ _blobKey(id, BLOB_PARTIAL_PIXELS),
+                _blobKey(id, BLOB_PARTIAL_STROKES) ])
+    _dropLegacyBlobs(dudle, BLOB_NAMES)
+    if len(stroke_data) > 7:
         dudle.complete = True
+        render_dudle(dudle, encoded)
     dudle.put()
+    _updateCounters(counted, _dudleCounters(dudle))
+    _updateRank(dudle)
+    cache.page_cache.invalidate(cache.LISTINGS)
+
+COUNTER_PUBLIC = 'dudles/public'
+
+def _galleryCounter(artist_key, owner):
+    """
+    Name of the counter of an artist's dudles as seen by the artist
+    (C{owner}) or by everyone else.
+    """
+    return 'dudles/artist/%d/%s' % (artist_key.id(),
+                                    owner and 'all' or 'public')
+
+def _dudleCounters(dudle):
+    """
+    Names of the counters the dudle is included in, matching the filters
+    of the listings they stand in for.
+    """
+    if not dudle.complete:
+        return []
+    names = []
+    if dudle.public:
+        names.append(COUNTER_PUBLIC)
+    artist = Dudle.artist.get_value_for_datastore(dudle)
+    if artist is not None:
+        names.append(_galleryCounter(artist, True))
+        if dudle.public and not dudle.anonymous:
+            names.append(_galleryCounter(artist, False))
+    return names
+
+def _updateCounters(before, after):
+    """
+    Move a dudle from the counters in C{before} to those in C{after}.
+    """
+    for name in before:
+        if name not in after:
+            counters.increment(name, -1)
+    for name in after:
+        if name not in before:
+            counters.increment(name)
+
+def recount_dudles(start=None, batch=100):
+    """
+    Rebuild the dudle counters from the datastore in key-ordered batches,
+    clearing them first when C{start} is C{None}.  Dudles finalized while
+    this runs may be counted twice.
+
+    @param start: key of the last dudle of the previous batch
+    @return: the key to continue from, or C{None} when done
+    """
+    if start is None:
+        counters.clear()
+    query = Dudle.all().filter('complete = ', True).order('__key__')
+    if start is not None:
+        query.filter('__key__ >', start)
+    dudles = query.fetch(batch)
+    totals = {}
+    for dudle in dudles:
+        for name in _dudleCounters(dudle):
+            totals[name] = totals.get(name, 0) + 1
+    for name, n in totals.iteritems():
+        counters.increment(name, n)
+    if len(dudles) < batch:
+        return None
+    return dudles[-1].key()
+
+def get_dudle_strokes(id):
+    """
+    Get a dudle's stroke data.  The dudle itself is only loaded for
+    dudles that have not been migrated yet.
+    """
+    data = _getBlob(id, BLOB_STROKES)
+    if data is None:
+        data = _getBlob(id, BLOB_STROKES, get_dudle(id))
+    return data
+
+def strokes_json(data, binary=False):
+    """
+    Stroke data in the form the strokes handlers return it: legacy text,
+    or the binary format base64-encoded if C{binary} is requested and
+    the data is stored in it.  Text converted from the binary format is
+    cached, and corrupt data is returned as no strokes.
+    """
+    if not strokes.is_binary(data):
+        return data
+    try:
+        if binary:
+            return {'encoding':'base64',
+                    'data':base64.b64encode(strokes.to_binary(data))}
+        key = hashlib.md5(data).hexdigest()
+        text = cache.stroke_cache.get(cache.STROKES, key)
+        if text is None:
+            text = strokes.to_text(data)
+            cache.stroke_cache.set(cache.STROKES, key, text)
+        return text
+    except strokes.StrokeFormatError:
+        logging.warning('cannot decode stroke data %r...', data[:16])
+        return ''
+
+def _putStrokesJson(dudle, data):
+    """
+    Serialize the dudle's strokes once for listings to inline and note
+    their size on the (unsaved) dudle.
+    """
+    payload = simplejson.dumps(strokes_json(data, True))
+    _putBlob(dudle.key().id(), BLOB_STROKES_JSON, payload)
+    dudle.strokes_size = len(payload)
+
+# most bytes of strokes a listing page inlines
+INLINE_STROKES_BUDGET = 32 * 1024
+
+def get_inline_strokes(dudles, budget=INLINE_STROKES_BUDGET):
+    """
+    Get the serialized strokes of as many of C{dudles}, in order, as fit
+    in C{budget} bytes.  The rest are left for the client to fetch.
+    Dudles without a rendered image replay their strokes as soon as the
+    page loads, so they come first; the budget left over goes to dudles
+    shown from their image, whose strokes are replayed when clicked.
+
+    @return: a dict of JSON by dudle id
+    """
+    ids = []
+    total = 0
+    ordered = [ d for d in dudles if not d.image_etag ] + \
+              [ d for d in dudles if d.image_etag ]
+    for dudle in ordered:
+        size = dudle.strokes_size
+        if size is not None and total + size <= budget:
+            total += size
+            ids.append(dudle.key().id())
+    records = db.get([ _blobKey(id, BLOB_STROKES_JSON) for id in ids ])
+    return dict([ (id, r.data) for id, r in zip(ids, records)
+                  if r is not None ])
+
+def get_dudles_strokes(ids):
+    """
+    Get the stroke data of several dudles with one batch get, plus one
+    for dudles that have not been migrated yet.
+
+    @return: a dict of stroke data by dudle id, leaving out unknown ids
+    """
+    found = {}
+    legacy = []
+    for id, record in zip(ids,
+            db.get([ _blobKey(id, BLOB_STROKES) for id in ids ])):
+        if record is not None:
+            found[id] = record.data
+        else:
+            legacy.append(id)
+    if legacy:
+        for id, dudle in zip(legacy,
+                db.get([ Key.from_path('Dudle', id) for id in legacy ])):
+            if dudle is not None:
+                found[id] = getattr(dudle, BLOB_STROKES, None) or ''
+    return found
+
+def render_dudle(dudle, data=None):
+    """
+    Render the dudle's strokes to a full size PNG and a thumbnail.  The
+    dudle is not saved.
+
+    @param data: the stroke data, if already at hand
+    """
+    if data is None:
+        data = _getBlob(dudle.key().id(), BLOB_STROKES, dudle)
+    try:
+        image, thumbnail = raster.render_png(data or '')
+    except strokes.StrokeFormatError:
+        logging.warning('cannot render strokes of dudle %d',
+                        dudle.key().id())
+        return
+    _storeImages(dudle, image, thumbnail)
+
+IMAGE_SIZES = ('full', 'thumb')
+
+def _storeImages(dudle, image, thumbnail=None):
+    """
+    Save the dudle's PNGs as C{DudleImageData} records and note the full
+    size image's ETag on the (unsaved) dudle.
+    """
+    records = []
+    for size, data in zip(IMAGE_SIZES, (image, thumbnail)):
+        if data is None:
+            continue
+        records.append(DudleImageData(parent=dudle, key_name=size,
+                data=db.Blob(data), etag=hashlib.md5(data).hexdigest()))
+    db.put(records)
+    dudle.image_etag = records[0].etag
+
+def get_dudle_image(id, size='full'):
+    """
+    Get the C{DudleImageData} for a dudle with a get by key, without
+    loading the dudle itself.  Dudles rendered before images had their
+    own records fall back to the image stored on the dudle; the record
+    returned for those is not saved.
+
+    @param size: one of C{IMAGE_SIZES}
+    """
+    image = DudleImageData.get(Key.from_path('Dudle', id,
+                                             'DudleImageData', size))
+    if image is not None:
+        return image
+    dudle = get_dudle(id)
+    legacy = {'full': 'image_data', 'thumb': 'thumbnail_data'}[size]
+    data = dudle and getattr(dudle, legacy, None)
+    if not data:
+        return None
+    return DudleImageData(parent=dudle, key_name=size, data=data,
+            etag=hashlib.md5(data).hexdigest(),
+            modified_date=dudle.updated_date)
+
+def migrate_dudle(dudle):
+    """
+    Move the payloads of a dudle saved before they had records of their
+    own into C{DudleBlob} and C{DudleImageData} records, and serialize
+    its strokes for inlining if that was not done yet.  The dudle is not
+    saved.
+
+    @return: C{True} if the dudle was changed
+    """
+    id = dudle.key().id()
+    serialized = False
+    if dudle.complete and dudle.strokes_size is None:
+        data = _getBlob(id, BLOB_STROKES, dudle)
+        if data is not None:
+            _putStrokesJson(dudle, data)
+            serialized = True
+    present = [ n for n in LEGACY_BLOBS if hasattr(dudle, n) ]
+    if not present:
+        return serialized
+    for name in BLOB_NAMES:
+        data = getattr(dudle, name, None)
+        if data:
+            _putBlob(id, name, data)
+    image = getattr(dudle, 'image_data', None)
+    if image:
+        _storeImages(dudle, image, getattr(dudle, 'thumbnail_data', None))
+    elif getattr(dudle, BLOB_STROKES, None) and dudle.complete:
+        render_dudle(dudle, dudle.strokes)
+    _dropLegacyBlobs(dudle)
+    return True
+
+def migrate_dudles(start=None, batch=20):
+    """
+    Migrate a batch of dudles in key order.
+
+    @param start: key of the last dudle of the previous batch
+    @return: number of dudles changed and the key to continue from, or
+        C{None} when done
+    """
+    query = Dudle.all().order('__key__')
+    if start is not None:
+        query.filter('__key__ >', start)
+    dudles = query.fetch(batch)
+    changed = [ d for d in dudles if migrate_dudle(d) ]
+    if changed:
+        db.put(changed)
+    if len(dudles) < batch:
+        return len(changed), None
+    return len(changed), dudles[-1].key()
 
 def get_dudle(id):
     """
@@ -152,93 +650,360 @@ def get_dudle(id):
     dudle = Dudle.get(key)
     return dudle
 
+RATING_SHARDS = 10
+
+# at most one write of a dudle's rating per this many seconds
+RATING_FLUSH_INTERVAL = 60
+
+def _ratingShardKey(id, index):
+    return Key.from_path('RatingShard', 'd%d/%d' % (id, index))
+
+def _ratingKey(id, user):
+    """
+    Key of the user's C{DudleRating} of a dudle.  The shard is picked
+    from the user's email, so it never changes.
+    """
+    email = user.email()
+    hashed = email
+    if isinstance(hashed, unicode):
+        hashed = hashed.encode('utf-8')
+    index = zlib.crc32(hashed) % RATING_SHARDS
+    return Key.from_path('RatingShard', _ratingShardKey(id, index).name(),
+                         'DudleRating', email)
+
+def _addRating(id, user, rating):
+    """
+    Record or replace the user's rating of a dudle and update its shard
+    in one transaction.
+    """
+    key = _ratingKey(id, user)
+    shard_key = key.parent()
+    def txn():
+        shard, dudle_rating = db.get([shard_key, key])
+        if shard is None:
+            shard = RatingShard(key_name=shard_key.name(), dudle_id=id)
+        if dudle_rating is None:
+            dudle_rating = DudleRating(parent=shard_key, key_name=key.name(),
+                    user=user, dudle_id=id, rating=rating)
+            shard.count += 1
+        else:
+            shard.total -= dudle_rating.rating
+            dudle_rating.rating = rating
+        shard.total += rating
+        db.put([shard, dudle_rating])
+    db.run_in_transaction(txn)
+
+def _ratingCacheKey(id):
+    return 'dudle-rating/%d' % id
+
+def _sumRating(id):
+    """
+    Add up a dudle's rating shards and cache the result.
+
+    @return: the rating (0-100) and the number of ratings
+    """
+    total = count = 0
+    for shard in db.get([ _ratingShardKey(id, i)
+                          for i in range(RATING_SHARDS) ]):
+        if shard is not None:
+            total += shard.total
+            count += shard.count
+    rating = count and int(round(min(total / float(count), 100))) or 0
+    memcache.set(_ratingCacheKey(id), (rating, count))
+    return rating, count
+
+def _flushRating(id, rating, count):
+    """
+    Save an aggregated rating on the dudle, which listings sort by.
+    Cached listings are only invalidated when the saved rating or count
+    changes, which is also the only time the dudle's rank can.
+    """
+    def txn():
+        dudle = Dudle.get(Key.from_path('Dudle', id))
+        changed = dudle.rating != rating or dudle.rated_count != count
+        if changed:
+            dudle.rating = rating
+            dudle.rated_count = count
+            dudle.put()
+        return dudle, changed
+    dudle, changed = db.run_in_transaction(txn)
+    _updateRank(dudle)
+    if changed:
+        cache.page_cache.invalidate(cache.LISTINGS)
+
+def _queueRatingFlush(id):
+    """
+    Queue a flush for after the current C{RATING_FLUSH_INTERVAL}, so the
+    ratings throttled in it still reach the dudle.  The task is named
+    after the interval, so there is at most one per dudle per interval.
+    """
+    interval = int(time.time()) // RATING_FLUSH_INTERVAL
+    try:
+        taskqueue.add(name='rating-flush-%d-%d' % (id, interval),
+                      url='/admin/tasks/flushRating', params={'id': id},
+                      countdown=RATING_FLUSH_INTERVAL)
+    except (taskqueue.TaskAlreadyExistsError, taskqueue.TombstonedTaskError):
+        pass
+
+def flush_rating(id):
+    """
+    Save a dudle's current aggregate rating, run by the task queued with
+    L{_queueRatingFlush}.
+    """
+    _flushRating(id, *_sumRating(id))
+
+# a dudle's rating is pulled towards this with the weight of this many
+# ratings, so a single 100 does not top the page
+RANK_PRIOR_RATING = 50
+RANK_PRIOR_WEIGHT = 5
+
+# seconds for a dudle's standing to halve
+RANK_HALF_LIFE = 30 * 24 * 3600
+
+def rank_score(rating, count, created_date):
+    """
+    Score a dudle for the top rated page: the Bayesian average of its
+    rating decayed by age with a half-life of C{RANK_HALF_LIFE}.
+
+    Decaying C{avg} by C{2 ** (-age / half_life)} ranks dudles the same as
+    C{log2(avg) + created / half_life}, which does not change as time
+    passes, so scores only need updating when ratings do.  They are
+    updated with the saved rating, so at most C{RATING_FLUSH_INTERVAL}
+    after the last rating (see L{rate_dudle}).
+    """
+    average = ((RANK_PRIOR_RATING * RANK_PRIOR_WEIGHT + rating * count)
+               / float(RANK_PRIOR_WEIGHT + count))
+    created = calendar.timegm(created_date.utctimetuple())
+    return math.log(max(average, 1), 2) + created / float(RANK_HALF_LIFE)
+
+def _rankKey(id):
+    return Key.from_path('DudleRank', 'd%d' % id)
+
+def _updateRank(dudle):
+    """
+    Score the dudle, or drop its rank if it is not listed.  Called with
+    every rating flush, including the trailing one queued by
+    L{_queueRatingFlush}, so the top rated order sees every rating.
+    """
+    key = _rankKey(dudle.key().id())
+    if dudle.complete and dudle.public:
+        DudleRank(key_name=key.name(), dudle=dudle,
+                  score=rank_score(dudle.rating, dudle.rated_count,
+                                   dudle.created_date)).put()
+    else:
+        db.delete(key)
+
+def rerank_dudles(start=None, batch=100):
+    """
+    Recompute the ranks of a batch of dudles in key order, e.g. after
+    changing the scoring constants.
+
+    @param start: key of the last dudle of the previous batch
+    @return: the key to continue from, or C{None} when done
+    """
+    query = Dudle.all().order('__key__')
+    if start is not None:
+        query.filter('__key__ >', start)
+    dudles = query.fetch(batch)
+    for dudle in dudles:
+        _updateRank(dudle)
+    if len(dudles) < batch:
+        return None
+    return dudles[-1].key()
+
+def _overlayRatings(dudles):
+    """
+    Replace the saved ratings of the (unsaved) dudles with cached ones
+    that have not been flushed yet.
+    """
+    if not dudles:
+        return
+    cached = memcache.get_multi([ str(d.key().id()) for d in dudles ],
+                                key_prefix='dudle-rating/')
+    for dudle in dudles:
+        value = cached.get(str(dudle.key().id()))
+        if value is not None:
+            dudle.rating, dudle.rated_count = value
+
 def rate_dudle(id, rating, user):
     """
     Rate a dudle - may only be done once per dudle per authenticated user.
 
+    The rating is added to the dudle's shards; the aggregate is cached
+    and written to the dudle at most once per C{RATING_FLUSH_INTERVAL},
+    so a popular dudle does not serialize its raters.  Ratings arriving
+    while the write is throttled queue a flush for the end of the
+    interval; cached listings show them once it has run.
+
     @param id: id of dudle to rate
     @param rating: the rating (0-100)
     @param user: the user rating the dudle
+    @return: the dudle, with the up to date rating
     """
     if not user:
         raise DudleException(ERROR_NOT_LOGGED_IN)
-    dudle_rating = DudleRating.all().filter('user = ', user).filter('dudle_id = ', id).get()
-    rated = True
-    if not dudle_rating:
-        rated = False
-        dudle_rating = DudleRating(user=user, rating=rating, dudle_id=id)
     key = Key.from_path('Dudle', id)
     dudle = Dudle.get(key)
-    if dudle.artist and dudle.artist.user.email() == user.email():
+    artist = Dudle.artist.get_value_for_datastore(dudle)
+    rater = get_dudlr(user, create=False)
+    if artist is not None and rater.is_saved() and artist == rater.key():
         raise DudleException(ERROR_CONFLICT_OF_INTEREST)
-    if not rated:
-        adj = rating / float(dudle.rated_count + 1)
-        r = dudle.rating * (dudle.rated_count/float(dudle.rated_count + 1))
-        dudle.rated_count += 1
-        r = r + adj
-    else:
-        adj = rating / float(dudle.rated_count)
-        r = dudle.rating - (dudle_rating.rating / float(dudle.rated_count))
-        dudle_rating.rating = rating
-        r = r + adj
-    if r > 100:
-        r = 100
-    dudle.rating = int(round(r))
+    _addRating(id, user, rating)
+    dudle.rating, dudle.rated_count = _sumRating(id)
     logging.info('Updated rating : ' + str(dudle.rating));
-    dudle.put()
-    dudle_rating.put()
+    if memcache.add('dudle-rating-flush/%d' % id, True,
+                    time=RATING_FLUSH_INTERVAL):
+        _flushRating(id, dudle.rating, dudle.rated_count)
+    else:
+        _queueRatingFlush(id)
     return dudle
-    
 
-def get_latest_dudles(limit=5, order='asc', offset=0):
+def migrate_ratings(start=None, batch=50):
     """
-    Get last C{limit} dudles
-    """
-    o = { 'asc':'', 'desc':'-' }[order]
-    query = Dudle.all().filter('complete = ', True
-            ).filter('public = ', True).order('%screated_date' % o)
-    count = query.count(1000)
-    dudles = query.fetch(limit=limit, offset=offset)
-    return dudles, count
+    Move a batch of ratings saved as root entities under their rating
+    shards and re-aggregate the ratings of the dudles they belong to.
 
+    @param start: key of the last rating of the previous batch
+    @return: number of ratings moved and the key to continue from, or
+        C{None} when done
+    """
+    query = DudleRating.all().order('__key__')
+    if start is not None:
+        query.filter('__key__ >', start)
+    ratings = query.fetch(batch)
+    legacy = [ r for r in ratings if r.parent_key() is None ]
+    for r in legacy:
+        # a rating made since keeps precedence over the legacy one
+        if DudleRating.get(_ratingKey(r.dudle_id, r.user)) is None:
+            _addRating(r.dudle_id, r.user, r.rating)
+    db.delete(legacy)
+    for id in set([ r.dudle_id for r in legacy ]):
+        _flushRating(id, *_sumRating(id))
+    if len(ratings) < batch:
+        return len(legacy), None
+    return len(legacy), ratings[-1].key()
+
+
+def prefetch(entities, prop, known=()):
+    """
+    Resolve a C{ReferenceProperty} of several entities with one batch get
+    rather than a get per entity when it is first accessed.
 
-def get_toprated_dudles(limit=5, offset=0):
+    @param entities: models having C{prop}
+    @param prop: the property, e.g. C{Dudle.artist}
+    @param known: referenced entities already at hand, not fetched again
+    @return: C{entities}
     """
-    Get the highest rated dudles
+    resolved = dict([ (e.key(), e) for e in known ])
+    refs = [ prop.get_value_for_datastore(e) for e in entities ]
+    keys = []
+    for key in refs:
+        if key is not None and key not in resolved and key not in keys:
+            keys.append(key)
+    if keys:
+        resolved.update(zip(keys, db.get(keys)))
+    for entity, key in zip(entities, refs):
+        if resolved.get(key) is not None:
+            setattr(entity, prop.name, resolved[key])
+    return entities
+
+def _keysetPage(make_query, prop, descending, limit, offset=0, cursor=None,
+                kind='Dudle'):
     """
-    query = Dudle.all().filter('complete = ', True
-            ).filter('public = ', True).order('-rating')
-    count = query.count(1000)
-    dudles = query.fetch(limit=limit, offset=offset)
-    return dudles, count
+    Fetch a page of dudles ordered by C{prop}, ties broken by key as the
+    datastore does.  A cursor resumes right after the dudle it was made
+    from by seeking in the index rather than skipping rows, so every page
+    costs the same; without one C{offset} is used.
+
+    @param make_query: callable returning a fresh, filtered C{Query}
+    @param cursor: token returned with the previous page
+    @param kind: kind queried by C{make_query}
+    @return: the entities and a cursor for the next page, or C{None}
+    """
+    o = descending and '-' or ''
+    if cursor:
+        value_type = db.class_for_kind(kind).properties()[prop].data_type
+        try:
+            value, id = decode_cursor(cursor, value_type)
+        except ValueError:
+            raise DudleException(ERROR_BAD_CURSOR)
+        # the rest of the dudles sharing the last sort value ...
+        dudles = make_query().filter('%s = ' % prop, value).filter(
+                '__key__ > ', Key.from_path(kind, id)
+                ).order('__key__').fetch(limit + 1)
+        # ... then those after it
+        if len(dudles) <= limit:
+            dudles += make_query().filter(
+                    '%s %s ' % (prop, descending and '<' or '>'), value
+                    ).order(o + prop).fetch(limit + 1 - len(dudles))
+    else:
+        dudles = make_query().order(o + prop).fetch(limit + 1, offset)
+    next = None
+    if len(dudles) > limit:
+        dudles = dudles[:limit]
+        last = dudles[-1]
+        next = encode_cursor(getattr(last, prop), last.key().id_or_name())
+    return dudles, next
+
+def get_latest_dudles(limit=5, order='asc', offset=0, cursor=None):
+    """
+    Get last C{limit} dudles
 
+    @return: the dudles, the total count and a cursor for the next page
+    """
+    def make_query():
+        return Dudle.all().filter('complete = ', True
+                ).filter('public = ', True)
+    count = counters.get_count(COUNTER_PUBLIC)
+    dudles, next = _keysetPage(make_query, 'created_date', order == 'desc',
+                               limit, offset, cursor)
+    _overlayRatings(dudles)
+    prefetch(dudles, Dudle.artist)
+    return dudles, count, next
+
+
+def get_toprated_dudles(limit=5, offset=0, cursor=None):
+    """
+    Get the highest rated dudles, ordered by their C{DudleRank}
 
-def get_gallery(artist, current_user=None, offset=0, limit=5):
+    @return: the dudles, the total count and a cursor for the next page
+    """
+    count = counters.get_count(COUNTER_PUBLIC)
+    ranks, next = _keysetPage(DudleRank.all, 'score', True,
+                              limit, offset, cursor, 'DudleRank')
+    dudles = db.get([ DudleRank.dudle.get_value_for_datastore(r)
+                      for r in ranks ])
+    dudles = [ d for d in dudles if d is not None and d.public ]
+    _overlayRatings(dudles)
+    prefetch(dudles, Dudle.artist)
+    return dudles, count, next
+
+
+def get_gallery(artist, current_user=None, offset=0, limit=5, cursor=None):
     """
     Get dudles by artist.
 
     @param artist: the C{Dudlr} artist
     @param current_user: the current ${User}
-    @param offset: offset into results
+    @param offset: offset into results, if there is no C{cursor}
     @param limit: limit of dules to return (default: 5)
+    @param cursor: cursor returned with the previous page
+    @return: the dudles, the total count and a cursor for the next page
     """
     #o = { 'asc':'', 'desc':'-' }[order]
     current_user = current_user or users.get_current_user
-    query = Dudle.all().filter('artist = ', artist).filter('complete = ', True)
-    if current_user != artist.user:
-        query = query.filter('public = ', True).filter('anonymous = ', False)
-    count = query.count(1000)
-    dudles = query.order('-created_date').fetch(limit=limit, offset=offset)
-    return dudles, count
-
-def _pngData(data, width, height):
-    fd = StringIO()
-    writer = png.Writer(width, height, greyscale=True)
-    def scanlines():
-        for i in range(height):
-            offset = i * width
-            yield [ ord(c) for c in data[offset:offset+width] ]
-    writer.write(fd, scanlines())
-    return fd.getvalue()
-
+    def make_query():
+        query = Dudle.all().filter('artist = ', artist
+                ).filter('complete = ', True)
+        if current_user != artist.user:
+            query = query.filter('public = ', True
+                    ).filter('anonymous = ', False)
+        return query
+    count = counters.get_count(_galleryCounter(artist.key(),
+                                               current_user == artist.user))
+    dudles, next = _keysetPage(make_query, 'created_date', True,
+                               limit, offset, cursor)
+    _overlayRatings(dudles)
+    prefetch(dudles, Dudle.artist, [artist])
+    return dudles, count, next
 
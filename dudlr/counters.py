@@ -0,0 +1,56 @@
+"""
+Sharded counters.
+
+A counter is spread over C{NUM_SHARDS} C{CounterShard} records, and every
+update goes to a random shard in its own transaction, so concurrent
+updates rarely contend for one entity group.  Reading a counter gets its
+shards by key, which costs the same however large the count grows.
+"""
+
+import random
+
+from google.appengine.ext import db
+from google.appengine.ext.db import Key
+
+from dudlr.models import CounterShard
+
+
+NUM_SHARDS = 10
+
+
+def _shardKeyName(name, index):
+    return '%s/%d' % (name, index)
+
+def _shardKeys(name):
+    return [ Key.from_path('CounterShard', _shardKeyName(name, i))
+             for i in range(NUM_SHARDS) ]
+
+
+def get_count(name):
+    """
+    Get the current value of counter C{name}; unknown counters are 0.
+    """
+    return sum([ s.count for s in db.get(_shardKeys(name)) if s is not None ])
+
+def increment(name, delta=1):
+    """
+    Add C{delta}, which may be negative, to counter C{name}.
+    """
+    key_name = _shardKeyName(name, random.randint(0, NUM_SHARDS - 1))
+    def txn():
+        shard = CounterShard.get_by_key_name(key_name)
+        if shard is None:
+            shard = CounterShard(key_name=key_name, name=name)
+        shard.count += delta
+        shard.put()
+    db.run_in_transaction(txn)
+
+def clear(batch=500):
+    """
+    Delete every shard of every counter.
+    """
+    while True:
+        keys = CounterShard.all(keys_only=True).fetch(batch)
+        if not keys:
+            break
+        db.delete(keys)
@@ -61,6 +61,11 @@ import struct
 import math
 from array import array
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 
 _adam7 = ((0, 0, 8, 8),
           (4, 0, 8, 8),
@@ -96,6 +101,125 @@ def interleave_planes(ipixels, apixels, ipsize, apsize):
     return out
 
 
+# http://www.w3.org/TR/PNG/#9Filter-types
+FILTER_NONE = 0
+FILTER_SUB = 1
+FILTER_UP = 2
+FILTER_AVERAGE = 3
+FILTER_PAETH = 4
+FILTER_ADAPTIVE = 'adaptive'
+
+_filter_types = (FILTER_NONE, FILTER_SUB, FILTER_UP, FILTER_AVERAGE,
+                 FILTER_PAETH)
+
+
+def _paeth(a, b, c):
+    p = a + b - c
+    pa = abs(p - a)
+    pb = abs(p - b)
+    pc = abs(p - c)
+    if pa <= pb and pa <= pc:
+        return a
+    elif pb <= pc:
+        return b
+    return c
+
+
+def filter_scanline(filter_type, line, prev, psize):
+    """
+    Apply a PNG filter to a scanline.
+
+    Return an array of filtered bytes. line and prev are arrays of the
+    unfiltered current and previous scanline; prev is None for the
+    first line. psize is the number of bytes per pixel.
+    """
+    if filter_type == FILTER_NONE:
+        return line
+    left = array('B', [0] * psize) + line[:-psize]
+    if prev is None:
+        prev = array('B', [0]) * len(line)
+    if filter_type == FILTER_SUB:
+        out = [(x - a) & 0xff for x, a in zip(line, left)]
+    elif filter_type == FILTER_UP:
+        out = [(x - b) & 0xff for x, b in zip(line, prev)]
+    elif filter_type == FILTER_AVERAGE:
+        out = [(x - ((a + b) >> 1)) & 0xff
+               for x, a, b in zip(line, left, prev)]
+    elif filter_type == FILTER_PAETH:
+        upleft = array('B', [0] * psize) + prev[:-psize]
+        out = [(x - _paeth(a, b, c)) & 0xff
+               for x, a, b, c in zip(line, left, prev, upleft)]
+    else:
+        raise ValueError("unknown filter type %r" % (filter_type,))
+    return array('B', out)
+
+
+# sum of absolute values of filtered bytes read as signed
+_signed_abs = [min(v, 256 - v) for v in range(256)]
+
+
+def choose_filter(line, prev, psize):
+    """
+    Pick the filter for a scanline with the minimum sum of absolute
+    differences heuristic. Return the filter type and filtered bytes.
+    """
+    best = None
+    for filter_type in _filter_types:
+        filtered = filter_scanline(filter_type, line, prev, psize)
+        score = sum([_signed_abs[v] for v in filtered])
+        if best is None or score < best[0]:
+            best = (score, filter_type, filtered)
+    return best[1], best[2]
+
+
+def _filter_image_numpy(image, psize, filter_type):
+    """
+    Filter a whole image held in a (height, row_bytes) NumPy array.
+    Return a (height, row_bytes + 1) array with the filter type of
+    each row prepended.
+    """
+    height, row_bytes = image.shape
+    out = numpy.empty((height, row_bytes + 1), dtype=numpy.uint8)
+    if filter_type == FILTER_NONE:
+        out[:, 0] = 0
+        out[:, 1:] = image
+        return out
+    x = image.astype(numpy.int16)
+    a = numpy.zeros_like(x)
+    a[:, psize:] = x[:, :-psize]
+    b = numpy.zeros_like(x)
+    b[1:] = x[:-1]
+    candidates = {
+        FILTER_NONE: lambda: x,
+        FILTER_SUB: lambda: x - a,
+        FILTER_UP: lambda: x - b,
+        FILTER_AVERAGE: lambda: x - ((a + b) >> 1),
+        FILTER_PAETH: lambda: x - _paeth_numpy(a, b, psize),
+        }
+    if filter_type == FILTER_ADAPTIVE:
+        filtered = numpy.array([candidates[t]() & 0xff
+                                for t in _filter_types]).astype(numpy.uint8)
+        scores = numpy.abs(filtered.view(numpy.int8).astype(numpy.int32))
+        types = scores.sum(axis=2).argmin(axis=0)
+        out[:, 0] = types
+        out[:, 1:] = filtered[types, numpy.arange(height)]
+    else:
+        out[:, 0] = filter_type
+        out[:, 1:] = candidates[filter_type]() & 0xff
+    return out
+
+
+def _paeth_numpy(a, b, psize):
+    c = numpy.zeros_like(a)
+    c[1:, psize:] = b[1:, :-psize]
+    p = a + b - c
+    pa = numpy.abs(p - a)
+    pb = numpy.abs(p - b)
+    pc = numpy.abs(p - c)
+    return numpy.where((pa <= pb) & (pa <= pc), a,
+                       numpy.where(pb <= pc, b, c))
+
+
 class Error(Exception):
     pass
 
@@ -114,7 +238,10 @@ class Writer:
                  bytes_per_sample=1,
                  compression=None,
                  interlaced=False,
-                 chunk_limit=2**20):
+                 chunk_limit=2**20,
+                 filter_type=FILTER_NONE,
+                 bitdepth=None,
+                 palette=None):
         """
         Create a PNG encoder object.
 
@@ -128,6 +255,20 @@ class Writer:
         bytes_per_sample - 8-bit or 16-bit input data
         compression - zlib compression level (1-9)
         chunk_limit - write multiple IDAT chunks to save memory
+        filter_type - scanline filter (FILTER_NONE, FILTER_SUB, FILTER_UP,
+                      FILTER_AVERAGE, FILTER_PAETH) or FILTER_ADAPTIVE
+                      to pick one per scanline; adaptive filtering
+                      needs NumPy and is FILTER_NONE without it
+        bitdepth - bits per sample: 1, 2, 4, 8 or 16 (overrides
+                   bytes_per_sample); depths below 8 need greyscale
+                   or a palette and are packed by the writer
+        palette - create an indexed colour image (PLTE chunk) from a
+                  list of (r, g, b) or (r, g, b, a) tuples; input data
+                  is then one palette index per pixel and any alpha
+                  values go into a tRNS chunk
+
+        Input data always holds one sample per byte (two for 16-bit),
+        also for bit depths below 8.
 
         If specified, the transparent and background parameters must
         be a tuple with three integer values for red, green, blue, or
@@ -146,6 +287,42 @@ class Writer:
         if bytes_per_sample < 1 or bytes_per_sample > 2:
             raise ValueError("bytes per sample must be 1 or 2")
 
+        if bitdepth is None:
+            bitdepth = bytes_per_sample * 8
+        if bitdepth not in (1, 2, 4, 8, 16):
+            raise ValueError("bit depth must be 1, 2, 4, 8 or 16")
+        bytes_per_sample = (bitdepth + 7) // 8
+
+        if palette is not None:
+            if greyscale or has_alpha or transparent is not None:
+                raise ValueError("palette not allowed with greyscale, "
+                                 "alpha channel or transparent color")
+            if bitdepth > 8:
+                raise ValueError("palette bit depth must be 8 or less")
+            if not 0 < len(palette) <= 2 ** bitdepth:
+                raise ValueError("palette must have 1 to %d entries"
+                                 % 2 ** bitdepth)
+            for entry in palette:
+                if (len(entry) not in (3, 4) or
+                    [v for v in entry if not 0 <= v <= 255]):
+                    raise ValueError("palette entries must be RGB or RGBA "
+                                     "tuples of integers 0-255")
+        elif bitdepth < 8 and (not greyscale or has_alpha):
+            raise ValueError("bit depths below 8 need greyscale without "
+                             "alpha channel or a palette")
+
+        if filter_type not in _filter_types + (FILTER_ADAPTIVE,):
+            raise ValueError("unknown filter type %r" % (filter_type,))
+
+        if interlaced:
+            # filtering restarts with every interlace pass; keep it simple
+            filter_type = FILTER_NONE
+
+        if filter_type == FILTER_ADAPTIVE and numpy is None:
+            # trying every filter on every byte in Python costs about 50
+            # times FILTER_NONE and rarely pays off in size
+            filter_type = FILTER_NONE
+
         if transparent is not None:
             if greyscale:
                 if type(transparent) is not int:
@@ -180,11 +357,18 @@ class Writer:
         self.greyscale = greyscale
         self.has_alpha = has_alpha
         self.bytes_per_sample = bytes_per_sample
+        self.bitdepth = bitdepth
+        self.palette = palette
         self.compression = compression
         self.chunk_limit = chunk_limit
         self.interlaced = interlaced
+        self.filter_type = filter_type
 
-        if self.greyscale:
+        if self.palette is not None:
+            self.color_depth = 1
+            self.color_type = 3
+            self.psize = 1
+        elif self.greyscale:
             self.color_depth = 1
             if self.has_alpha:
                 self.color_type = 4
@@ -201,6 +385,9 @@ class Writer:
                 self.color_type = 2
                 self.psize = self.bytes_per_sample * 3
 
+        # filters work on whole bytes of packed scanlines
+        self.filter_psize = max(self.psize * bitdepth // 8, 1)
+
     def write_chunk(self, outfile, tag, data):
         """
         Write a PNG chunk to the output file, including length and checksum.
@@ -217,6 +404,99 @@ class Writer:
         """
         Write a PNG image to the output file.
         """
+        self.write_header(outfile)
+        compressor = self.make_compressor()
+
+        # http://www.w3.org/TR/PNG/#11IDAT
+        data = array('B')
+        prev = None
+        for scanline in scanlines:
+            if self.bitdepth < 8:
+                scanline = pack_scanline(scanline, self.bitdepth)
+            if self.filter_type == FILTER_NONE:
+                data.append(0)
+                data.extend(scanline)
+            else:
+                if not isinstance(scanline, array):
+                    scanline = array('B', scanline)
+                if self.filter_type == FILTER_ADAPTIVE:
+                    filter_type, filtered = choose_filter(
+                        scanline, prev, self.filter_psize)
+                else:
+                    filter_type = self.filter_type
+                    filtered = filter_scanline(filter_type, scanline, prev,
+                                               self.filter_psize)
+                data.append(filter_type)
+                data.extend(filtered)
+                prev = scanline
+            if len(data) > self.chunk_limit:
+                compressed = compressor.compress(data.tostring())
+                if len(compressed):
+                    # print >> sys.stderr, len(data), len(compressed)
+                    self.write_chunk(outfile, 'IDAT', compressed)
+                data = array('B')
+        if len(data):
+            compressed = compressor.compress(data.tostring())
+        else:
+            compressed = ''
+        self.write_footer(outfile, compressor, compressed)
+
+    def write_buffer(self, outfile, buf, stride=None):
+        """
+        Write a PNG image from a contiguous pixel buffer.
+
+        buf - str, buffer, memoryview, array or NumPy array holding
+              the rows of the image one after the other
+        stride - bytes from the start of one row to the start of the
+                 next (defaults to the row length)
+
+        Filter bytes are inserted with a single strided copy when NumPy
+        is available and with one string join otherwise; the result is
+        handed to zlib in chunk_limit sized slices.
+        """
+        row_bytes = self.width * self.psize
+        if stride is None:
+            stride = row_bytes
+        if stride < row_bytes:
+            raise ValueError("stride must be at least width * pixel size")
+        if self.interlaced or (self.filter_type != FILTER_NONE and
+                               numpy is None):
+            rows = _rows(_tostring(buf), self.height, row_bytes, stride)
+            if self.interlaced:
+                pixels = array('B', ''.join(rows))
+                self.write(outfile, self.array_scanlines_interlace(pixels))
+            else:
+                self.write(outfile, [array('B', row) for row in rows])
+            return
+        if numpy is not None:
+            image = _strided_numpy(buf, self.height, row_bytes, stride)
+            if self.bitdepth < 8:
+                image = _pack_numpy(image, self.bitdepth)
+            data = _filter_image_numpy(image, self.filter_psize,
+                                       self.filter_type).tostring()
+        else:
+            rows = _rows(_tostring(buf), self.height, row_bytes, stride)
+            if self.bitdepth < 8:
+                rows = [pack_scanline(array('B', row),
+                                      self.bitdepth).tostring()
+                        for row in rows]
+            data = '\0' + '\0'.join(rows)
+
+        self.write_header(outfile)
+        compressor = self.make_compressor()
+        # http://www.w3.org/TR/PNG/#11IDAT
+        limit = self.chunk_limit
+        compressed = ''
+        for start in range(0, len(data), limit):
+            if len(compressed):
+                self.write_chunk(outfile, 'IDAT', compressed)
+            compressed = compressor.compress(data[start:start + limit])
+        self.write_footer(outfile, compressor, compressed)
+
+    def write_header(self, outfile):
+        """
+        Write the PNG signature and the chunks preceding the image data.
+        """
         # http://www.w3.org/TR/PNG/#5PNG-file-signature
         outfile.write(struct.pack("8B", 137, 80, 78, 71, 13, 10, 26, 10))
 
@@ -227,9 +507,22 @@ class Writer:
             interlaced = 0
         self.write_chunk(outfile, 'IHDR',
                          struct.pack("!2I5B", self.width, self.height,
-                                     self.bytes_per_sample * 8,
+                                     self.bitdepth,
                                      self.color_type, 0, 0, interlaced))
 
+        # http://www.w3.org/TR/PNG/#11PLTE
+        if self.palette is not None:
+            self.write_chunk(outfile, 'PLTE',
+                             ''.join([struct.pack("3B", *entry[:3])
+                                      for entry in self.palette]))
+            alpha = [(tuple(entry) + (255,))[3] for entry in self.palette]
+            while alpha and alpha[-1] == 255:
+                alpha.pop()
+            if alpha:
+                # http://www.w3.org/TR/PNG/#11tRNS
+                self.write_chunk(outfile, 'tRNS',
+                                 struct.pack("%dB" % len(alpha), *alpha))
+
         # http://www.w3.org/TR/PNG/#11tRNS
         if self.transparent is not None:
             if self.greyscale:
@@ -253,26 +546,15 @@ class Writer:
             self.write_chunk(outfile, 'gAMA',
                              struct.pack("!L", int(self.gamma * 100000)))
 
-        # http://www.w3.org/TR/PNG/#11IDAT
+    def make_compressor(self):
         if self.compression is not None:
-            compressor = zlib.compressobj(self.compression)
-        else:
-            compressor = zlib.compressobj()
+            return zlib.compressobj(self.compression)
+        return zlib.compressobj()
 
-        data = array('B')
-        for scanline in scanlines:
-            data.append(0)
-            data.extend(scanline)
-            if len(data) > self.chunk_limit:
-                compressed = compressor.compress(data.tostring())
-                if len(compressed):
-                    # print >> sys.stderr, len(data), len(compressed)
-                    self.write_chunk(outfile, 'IDAT', compressed)
-                data = array('B')
-        if len(data):
-            compressed = compressor.compress(data.tostring())
-        else:
-            compressed = ''
+    def write_footer(self, outfile, compressor, compressed):
+        """
+        Flush the compressor into the last IDAT chunk and end the file.
+        """
         flushed = compressor.flush()
         if len(compressed) or len(flushed):
             # print >> sys.stderr, len(data), len(compressed), len(flushed)
@@ -396,6 +678,86 @@ class Writer:
                     yield row
 
 
+def _tostring(buf):
+    """
+    Return the contents of a buffer-like object as a string.
+    """
+    if isinstance(buf, str):
+        return buf
+    if isinstance(buf, array):
+        return buf.tostring()
+    if hasattr(buf, 'tobytes'):
+        # memoryview and NumPy arrays
+        return buf.tobytes()
+    return str(buf)
+
+
+def _rows(data, height, row_bytes, stride):
+    """
+    Split a string of pixel data into rows.
+    """
+    return [data[y*stride:y*stride + row_bytes] for y in range(height)]
+
+
+def _strided_numpy(buf, height, row_bytes, stride):
+    """
+    Return a (height, row_bytes) NumPy view of the rows in a buffer.
+    """
+    if isinstance(buf, numpy.ndarray):
+        flat = numpy.ascontiguousarray(buf).reshape(-1).view(numpy.uint8)
+    else:
+        flat = numpy.frombuffer(buf, dtype=numpy.uint8)
+    if len(flat) < (height - 1) * stride + row_bytes:
+        raise ValueError("buffer too small for image")
+    return numpy.lib.stride_tricks.as_strided(
+        flat, shape=(height, row_bytes), strides=(stride, 1))
+
+
+def pack_scanline(line, bitdepth):
+    """
+    Pack a scanline of 1, 2 or 4 bit samples, one per byte, into bytes
+    with the leftmost sample in the high-order bits.
+    """
+    per_byte = 8 // bitdepth
+    count = (len(line) + per_byte - 1) // per_byte
+    packed = [0] * count
+    for i in range(per_byte):
+        shift = 8 - bitdepth * (i + 1)
+        column = line[i::per_byte]
+        packed = [p | (x << shift) for p, x in zip(packed, column)] + \
+                 packed[len(column):]
+    return array('B', packed)
+
+
+def _pack_numpy(image, bitdepth):
+    """
+    Pack the rows of a (height, width) NumPy array of 1, 2 or 4 bit
+    samples into bytes.
+    """
+    per_byte = 8 // bitdepth
+    height, width = image.shape
+    count = (width + per_byte - 1) // per_byte
+    padded = numpy.zeros((height, count * per_byte), dtype=numpy.uint8)
+    padded[:, :width] = image
+    shifts = numpy.arange(8 - bitdepth, -1, -bitdepth, dtype=numpy.uint8)
+    padded = padded.reshape(height, count, per_byte) << shifts
+    return numpy.bitwise_or.reduce(padded, axis=2).astype(numpy.uint8)
+
+
+def unpack_scanline(line, bitdepth, width):
+    """
+    Unpack a scanline of 1, 2 or 4 bit samples into one sample per byte,
+    the inverse of pack_scanline.
+    """
+    per_byte = 8 // bitdepth
+    mask = 2 ** bitdepth - 1
+    out = [0] * (len(line) * per_byte)
+    for i in range(per_byte):
+        shift = 8 - bitdepth * (i + 1)
+        out[i::per_byte] = [(x >> shift) & mask for x in line]
+    return array('B', out[:width])
+
+
 class _readable:
     """
     A simple file-like interface for strings and arrays.
@@ -710,12 +1072,25 @@ class Reader:
                 (width, height, bits_per_sample, color_type,
                  compression_method, filter_method,
                  interlaced) = struct.unpack("!2I5B", data)
-                bps = bits_per_sample / 8
-                if bps == 0:
-                    raise Error("unsupported pixel depth")
-                if bps > 2 or bits_per_sample != (bps * 8):
-                    raise Error("invalid pixel depth")
-                if color_type == 0:
+                if bits_per_sample in (1, 2, 4):
+                    # one sample per byte once unpacked
+                    if color_type not in (0, 3):
+                        raise Error("invalid pixel depth")
+                    if interlaced:
+                        raise Error("unsupported pixel depth")
+                    bps = 1
+                else:
+                    bps = bits_per_sample / 8
+                    if bps == 0 or bps > 2 or \
+                       bits_per_sample != (bps * 8):
+                        raise Error("invalid pixel depth")
+                if color_type == 3:
+                    if bits_per_sample > 8:
+                        raise Error("invalid pixel depth")
+                    greyscale = False
+                    has_alpha = False
+                    planes = 1
+                elif color_type == 0:
                     greyscale = True
                     has_alpha = False
                     planes = 1
@@ -742,7 +1117,12 @@ class Reader:
                 self.psize = bps * planes
                 self.width = width
                 self.height = height
-                self.row_bytes = width * self.psize
+                self.bitdepth = bits_per_sample
+                self.row_bytes = (width * planes * bits_per_sample + 7) // 8
+            elif tag == 'PLTE': # http://www.w3.org/TR/PNG/#11PLTE
+                image_metadata["palette"] = [
+                    struct.unpack("3B", data[i:i+3])
+                    for i in range(0, len(data), 3)]
             elif tag == 'IDAT': # http://www.w3.org/TR/PNG/#11IDAT
                 compressed.append(data)
             elif tag == 'bKGD':
@@ -751,7 +1131,14 @@ class Reader:
                 else:
                     image_metadata["background"] = struct.unpack("!3H", data)
             elif tag == 'tRNS':
-                if greyscale:
+                if color_type == 3:
+                    # entries past the end of tRNS are opaque
+                    palette = image_metadata["palette"]
+                    alpha = struct.unpack("%dB" % len(data), data)
+                    alpha += (255,) * (len(palette) - len(alpha))
+                    image_metadata["palette"] = [
+                        entry + (a,) for entry, a in zip(palette, alpha)]
+                elif greyscale:
                     image_metadata["transparent"] = struct.unpack("!1H", data)
                 else:
                     image_metadata["transparent"] = struct.unpack("!3H", data)
@@ -765,150 +1152,156 @@ class Reader:
             pixels = self.deinterlace(scanlines)
         else:
             pixels = self.read_flat(scanlines)
+        if self.bitdepth < 8:
+            rows = [unpack_scanline(pixels[y*self.row_bytes:
+                                           (y+1)*self.row_bytes],
+                                    self.bitdepth, width).tostring()
+                    for y in range(height)]
+            pixels = array('B', ''.join(rows))
         image_metadata["greyscale"] = greyscale
+        image_metadata["bitdepth"] = self.bitdepth
         image_metadata["has_alpha"] = has_alpha
         image_metadata["bytes_per_sample"] = bps
         image_metadata["interlaced"] = interlaced
         return width, height, pixels, image_metadata
 
 
-def test_suite(options):
-    """
-    Run regression test and write PNG file to stdout.
-    """
+# Below is a big stack of test image generators
 
-    # Below is a big stack of test image generators
+def test_gradient_horizontal_lr(x, y):
+    return x
 
-    def test_gradient_horizontal_lr(x, y):
-        return x
+def test_gradient_horizontal_rl(x, y):
+    return 1-x
 
-    def test_gradient_horizontal_rl(x, y):
-        return 1-x
+def test_gradient_vertical_tb(x, y):
+    return y
 
-    def test_gradient_vertical_tb(x, y):
-        return y
+def test_gradient_vertical_bt(x, y):
+    return 1-y
 
-    def test_gradient_vertical_bt(x, y):
-        return 1-y
+def test_radial_tl(x, y):
+    return max(1-math.sqrt(x*x+y*y), 0.0)
 
-    def test_radial_tl(x, y):
-        return max(1-math.sqrt(x*x+y*y), 0.0)
+def test_radial_center(x, y):
+    return test_radial_tl(x-0.5, y-0.5)
 
-    def test_radial_center(x, y):
-        return test_radial_tl(x-0.5, y-0.5)
+def test_radial_tr(x, y):
+    return test_radial_tl(1-x, y)
 
-    def test_radial_tr(x, y):
-        return test_radial_tl(1-x, y)
+def test_radial_bl(x, y):
+    return test_radial_tl(x, 1-y)
 
-    def test_radial_bl(x, y):
-        return test_radial_tl(x, 1-y)
+def test_radial_br(x, y):
+    return test_radial_tl(1-x, 1-y)
 
-    def test_radial_br(x, y):
-        return test_radial_tl(1-x, 1-y)
+def test_stripe(x, n):
+    return 1.0*(int(x*n) & 1)
 
-    def test_stripe(x, n):
-        return 1.0*(int(x*n) & 1)
+def test_stripe_h_2(x, y):
+    return test_stripe(x, 2)
 
-    def test_stripe_h_2(x, y):
-        return test_stripe(x, 2)
+def test_stripe_h_4(x, y):
+    return test_stripe(x, 4)
 
-    def test_stripe_h_4(x, y):
-        return test_stripe(x, 4)
+def test_stripe_h_10(x, y):
+    return test_stripe(x, 10)
 
-    def test_stripe_h_10(x, y):
-        return test_stripe(x, 10)
+def test_stripe_v_2(x, y):
+    return test_stripe(y, 2)
 
-    def test_stripe_v_2(x, y):
-        return test_stripe(y, 2)
+def test_stripe_v_4(x, y):
+    return test_stripe(y, 4)
 
-    def test_stripe_v_4(x, y):
-        return test_stripe(y, 4)
+def test_stripe_v_10(x, y):
+    return test_stripe(y, 10)
 
-    def test_stripe_v_10(x, y):
-        return test_stripe(y, 10)
+def test_stripe_lr_10(x, y):
+    return test_stripe(x+y, 10)
 
-    def test_stripe_lr_10(x, y):
-        return test_stripe(x+y, 10)
+def test_stripe_rl_10(x, y):
+    return test_stripe(x-y, 10)
 
-    def test_stripe_rl_10(x, y):
-        return test_stripe(x-y, 10)
+def test_checker(x, y, n):
+    return 1.0*((int(x*n) & 1) ^ (int(y*n) & 1))
 
-    def test_checker(x, y, n):
-        return 1.0*((int(x*n) & 1) ^ (int(y*n) & 1))
+def test_checker_8(x, y):
+    return test_checker(x, y, 8)
 
-    def test_checker_8(x, y):
-        return test_checker(x, y, 8)
+def test_checker_15(x, y):
+    return test_checker(x, y, 15)
 
-    def test_checker_15(x, y):
-        return test_checker(x, y, 15)
+def test_zero(x, y):
+    return 0
 
-    def test_zero(x, y):
-        return 0
+def test_one(x, y):
+    return 1
 
-    def test_one(x, y):
-        return 1
+test_patterns = {
+    "GLR": test_gradient_horizontal_lr,
+    "GRL": test_gradient_horizontal_rl,
+    "GTB": test_gradient_vertical_tb,
+    "GBT": test_gradient_vertical_bt,
+    "RTL": test_radial_tl,
+    "RTR": test_radial_tr,
+    "RBL": test_radial_bl,
+    "RBR": test_radial_br,
+    "RCTR": test_radial_center,
+    "HS2": test_stripe_h_2,
+    "HS4": test_stripe_h_4,
+    "HS10": test_stripe_h_10,
+    "VS2": test_stripe_v_2,
+    "VS4": test_stripe_v_4,
+    "VS10": test_stripe_v_10,
+    "LRS": test_stripe_lr_10,
+    "RLS": test_stripe_rl_10,
+    "CK8": test_checker_8,
+    "CK15": test_checker_15,
+    "ZERO": test_zero,
+    "ONE": test_one,
+    }
 
-    test_patterns = {
-        "GLR": test_gradient_horizontal_lr,
-        "GRL": test_gradient_horizontal_rl,
-        "GTB": test_gradient_vertical_tb,
-        "GBT": test_gradient_vertical_bt,
-        "RTL": test_radial_tl,
-        "RTR": test_radial_tr,
-        "RBL": test_radial_bl,
-        "RBR": test_radial_br,
-        "RCTR": test_radial_center,
-        "HS2": test_stripe_h_2,
-        "HS4": test_stripe_h_4,
-        "HS10": test_stripe_h_10,
-        "VS2": test_stripe_v_2,
-        "VS4": test_stripe_v_4,
-        "VS10": test_stripe_v_10,
-        "LRS": test_stripe_lr_10,
-        "RLS": test_stripe_rl_10,
-        "CK8": test_checker_8,
-        "CK15": test_checker_15,
-        "ZERO": test_zero,
-        "ONE": test_one,
-        }
+def test_pattern(width, height, depth, pattern):
+    """
+    Create a single plane (monochrome) test pattern.
+    """
+    a = array('B')
+    fw = float(width)
+    fh = float(height)
+    pfun = test_patterns[pattern]
+    if depth == 1:
+        for y in range(height):
+            for x in range(width):
+                a.append(int(pfun(float(x)/fw, float(y)/fh) * 255))
+    elif depth == 2:
+        for y in range(height):
+            for x in range(width):
+                v = int(pfun(float(x)/fw, float(y)/fh) * 65535)
+                a.append(v >> 8)
+                a.append(v & 0xff)
+    return a
+
+def test_rgba(size=256, depth=1,
+              red="GTB", green="GLR", blue="RTL", alpha=None):
+    """
+    Create a test image.
+    """
+    r = test_pattern(size, size, depth, red)
+    g = test_pattern(size, size, depth, green)
+    b = test_pattern(size, size, depth, blue)
+    if alpha:
+        a = test_pattern(size, size, depth, alpha)
+    i = interleave_planes(r, g, depth, depth)
+    i = interleave_planes(i, b, 2 * depth, depth)
+    if alpha:
+        i = interleave_planes(i, a, 3 * depth, depth)
+    return i
 
-    def test_pattern(width, height, depth, pattern):
-        """
-        Create a single plane (monochrome) test pattern.
-        """
-        a = array('B')
-        fw = float(width)
-        fh = float(height)
-        pfun = test_patterns[pattern]
-        if depth == 1:
-            for y in range(height):
-                for x in range(width):
-                    a.append(int(pfun(float(x)/fw, float(y)/fh) * 255))
-        elif depth == 2:
-            for y in range(height):
-                for x in range(width):
-                    v = int(pfun(float(x)/fw, float(y)/fh) * 65535)
-                    a.append(v >> 8)
-                    a.append(v & 0xff)
-        return a
 
-    def test_rgba(size=256, depth=1,
-                    red="GTB", green="GLR", blue="RTL", alpha=None):
-        """
-        Create a test image.
-        """
-        r = test_pattern(size, size, depth, red)
-        g = test_pattern(size, size, depth, green)
-        b = test_pattern(size, size, depth, blue)
-        if alpha:
-            a = test_pattern(size, size, depth, alpha)
-        i = interleave_planes(r, g, depth, depth)
-        i = interleave_planes(i, b, 2 * depth, depth)
-        if alpha:
-            i = interleave_planes(i, a, 3 * depth, depth)
-        return i
-
-    # The body of test_suite()
+def test_suite(options):
+    """
+    Run regression test and write PNG file to stdout.
+    """
     size = 256
     if options.test_size:
         size = options.test_size
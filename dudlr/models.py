@@ -11,18 +11,39 @@ class Dudlr(db.Expando):
     name = db.StringProperty(required=True)
     user = db.UserProperty(required=True )
 
+class DudlrUser(db.Model):
+    """
+    Links a Google account, keyed by user id, to its C{Dudlr} so the
+    current user's dudlr is found by key rather than by query.
+
+    @param dudlr: the user's C{Dudlr}
+    """
+    dudlr = db.ReferenceProperty(Dudlr)
+
 class Dudle(db.Expando):
     """
     A saved dudle with an associated artist.
 
+    Only metadata is stored on the dudle so listings stay cheap; stroke
+    data lives in C{DudleBlob} and images in C{DudleImageData} records.
+    Dudles saved before that may still carry C{strokes}, C{image_data},
+    C{thumbnail_data}, C{partial_data} and C{partial_stroke_data} as
+    dynamic properties until they are migrated.
+
     @param created_date: Date and time dudle was created
     @param uploaded_date: Last date and time dudle was updated
     @param public: Dudle is publically visible
     @param anonymous: Dudle artist should appear anonymously
     @param rating: Community rating of dudle
-    @param image_data: Image data (PNG-encoded)
+    @param image_etag: ETag of the full size C{DudleImageData}, if any
+    @param strokes_size: length of the serialized strokes kept for
+    inlining in listings, if any
     @param complete: Upload has completed
     @param artist: Dudlr who drew the dudle
+    @param upload_token: Secret handed to the client that created the
+    dudle, required to append stroke chunks
+    @param stroke_chunks: number of uploaded stroke chunks assembled into
+    the saved strokes so far
     """
     created_date = db.DateTimeProperty(auto_now_add=True)
     updated_date = db.DateTimeProperty(auto_now=True)
@@ -30,18 +51,102 @@ class Dudle(db.Expando):
     anonymous = db.BooleanProperty(default=False)
     rating = db.RatingProperty(default=0)
     rated_count = db.IntegerProperty(default=0)
-    image_data = db.BlobProperty()
-    strokes = db.BlobProperty()
     complete = db.BooleanProperty(default=False)
     artist = db.ReferenceProperty(Dudlr)
+    upload_token = db.StringProperty()
+    stroke_chunks = db.IntegerProperty(default=0)
+    image_etag = db.StringProperty()
+    strokes_size = db.IntegerProperty()
+
+
+class DudleBlob(db.Model):
+    """
+    A large payload of a dudle, loaded only when needed.  Children of
+    their C{Dudle}, keyed by payload name (C{'strokes'},
+    C{'strokes_json'}, C{'partial_data'} or C{'partial_stroke_data'}).
+
+    @param data: the payload
+    """
+    data = db.BlobProperty()
+
+
+class DudleImageData(db.Model):
+    """
+    A PNG rendering of a dudle, kept apart from the C{Dudle} so it can be
+    served without loading strokes.  Children of their C{Dudle}, keyed by
+    size name (C{'full'} or C{'thumb'}).
+
+    @param data: PNG-encoded image
+    @param etag: MD5 hex digest of C{data}
+    @param modified_date: Date and time the image was last rendered
+    """
+    data = db.BlobProperty()
+    etag = db.StringProperty()
+    modified_date = db.DateTimeProperty(auto_now=True)
+
+
+class DudleStrokeChunk(db.Model):
+    """
+    A sequence-numbered piece of stroke data uploaded and not yet
+    assembled into the dudle's strokes.  Chunks are children of their
+    C{Dudle} and keyed by upload token and sequence number, so a retried
+    upload overwrites the same record.
+
+    @param token: upload token the chunk was sent with
+    @param seq: position of the chunk in the stroke data (0-based)
+    @param data: the stroke data
+    """
+    token = db.StringProperty(required=True)
+    seq = db.IntegerProperty(required=True)
+    data = db.BlobProperty()
+
+
+class DudleRank(db.Model):
+    """
+    Position of a listed dudle on the top rated page, kept apart so the
+    page reads a single property index.  Keyed by C{'d'} and the dudle's
+    id; only complete, public dudles have one.
+
+    @param dudle: the ranked dudle
+    @param score: sort key, higher ranks first (see C{core.rank_score})
+    """
+    dudle = db.ReferenceProperty(Dudle)
+    score = db.FloatProperty(required=True)
+
+
+class RatingShard(db.Model):
+    """
+    One shard of a dudle's rating totals.  Raters are spread over the
+    shards by user, so concurrent ratings of one dudle rarely contend.
+
+    @param dudle_id: id of the rated dudle
+    @param total: sum of the ratings in this shard
+    @param count: number of ratings in this shard
+    """
+    dudle_id = db.IntegerProperty(required=True)
+    total = db.IntegerProperty(default=0)
+    count = db.IntegerProperty(default=0)
 
 
 class DudleRating(db.Model):
     """
-    A record of a users rating on a dudle
+    A record of a users rating on a dudle.  Children of the user's
+    C{RatingShard} for the dudle, keyed by email, so they are looked up
+    by key and updated in the same transaction as their shard.  Ratings
+    saved before that are root entities until migrated.
     """
     dudle_id = db.IntegerProperty(required=True)
     rating = db.RatingProperty(default=0)
     user = db.UserProperty(required=True)
 
 
+class CounterShard(db.Model):
+    """
+    One shard of a sharded counter (see L{dudlr.counters}), keyed by
+    counter name and shard number.
+
+    @param name: name of the counter
+    @param count: this shard's part of the total
+    """
+    name = db.StringProperty(required=True)
+    count = db.IntegerProperty(default=0)
@@ -0,0 +1,36 @@
+#!/usr/bin/env python
+"""
+Compile every template in dudlr/templates into the dudlr.compiled_templates
+package, which the app then imports instead of parsing the templates on
+each cold start, and write the manifest of template checksums next to it.
+Run this before every deployment: precompiled templates and the manifest
+are used as they are, even when their source has changed since.
+
+Usage: python dudlr/precompile.py
+"""
+
+import os
+import sys
+
+# relative to the application root, so tracebacks point at the template
+# sources wherever the application is deployed
+os.chdir(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+sys.path.insert(0, os.curdir)
+
+from jinja2.loaders import dump_manifest
+from dudlr.utils import jinja_env, COMPILED_TEMPLATE_PATH, TEMPLATE_MANIFEST
+
+
+def main():
+    # never leave the manifest of an older run next to the new package
+    if os.path.exists(TEMPLATE_MANIFEST):
+        os.remove(TEMPLATE_MANIFEST)
+    for name in jinja_env.compile_templates(COMPILED_TEMPLATE_PATH):
+        print name
+    # the development server loads the sources without the module loader
+    source = getattr(jinja_env.loader, 'fallback', jinja_env.loader)
+    dump_manifest(source.build_manifest(), TEMPLATE_MANIFEST)
+
+
+if __name__ == '__main__':
+    main()
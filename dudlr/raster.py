@@ -0,0 +1,272 @@
+"""
+Server-side rendering of dudle strokes to PNG.
+
+Replays stroke commands (see L{dudlr.strokes}) the way C{DudlrRobot} does
+on a canvas: a 1px black pen, C{s} selecting one of C{FILL_MODES} and C{f}
+filling the path started by the last C{m} using the nonzero winding rule.
+Pixels are 8-bit greyscale on a white background.  NumPy is used for
+downscaling when it is available.
+"""
+
+import math
+from StringIO import StringIO
+from array import array
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from dudlr import strokes
+from dudlr.ext import png
+
+
+# (grey, alpha) for each fill mode, mirroring FILL_MODES in dudlr.js
+FILL_MODES = [
+    None,
+    (0, 0.5),
+    (0, 1.0),
+    (255, 0.5),
+    (255, 1.0),
+]
+
+# the robot starts out with the first real fill mode
+DEFAULT_FILL_MODE = 1
+
+WIDTH = 500
+HEIGHT = 250
+THUMBNAIL_FACTOR = 4
+
+
+_blend_tables = {}
+
+def _blend_table(grey, alpha):
+    """
+    A C{str.translate} table blending every grey level with C{grey} at
+    C{alpha}.
+    """
+    key = (grey, alpha)
+    table = _blend_tables.get(key)
+    if table is None:
+        table = ''.join([ chr(int(v * (1 - alpha) + grey * alpha + 0.5))
+                          for v in range(256) ])
+        _blend_tables[key] = table
+    return table
+
+
+class Canvas:
+    """
+    An 8-bit greyscale pixel buffer.
+    """
+
+    def __init__(self, width=WIDTH, height=HEIGHT, pixels=None):
+        self.width = width
+        self.height = height
+        if pixels is None:
+            pixels = array('B', [255]) * (width * height)
+        self.pixels = pixels
+
+    def plot(self, x, y, grey=0):
+        if 0 <= x < self.width and 0 <= y < self.height:
+            self.pixels[y * self.width + x] = grey
+
+    def line(self, x0, y0, x1, y1, grey=0):
+        """
+        Draw a 1px line with Bresenham's algorithm.
+        """
+        dx = abs(x1 - x0)
+        dy = -abs(y1 - y0)
+        sx = x0 < x1 and 1 or -1
+        sy = y0 < y1 and 1 or -1
+        err = dx + dy
+        while True:
+            self.plot(x0, y0, grey)
+            if x0 == x1 and y0 == y1:
+                break
+            e2 = 2 * err
+            if e2 >= dy:
+                err += dy
+                x0 += sx
+            if e2 <= dx:
+                err += dx
+                y0 += sy
+
+    def fill_span(self, y, x0, x1, grey, alpha):
+        """
+        Blend pixels C{x0} up to but not including C{x1} on row C{y}.
+        """
+        x0 = max(x0, 0)
+        x1 = min(x1, self.width)
+        if x0 >= x1 or not 0 <= y < self.height:
+            return
+        start = y * self.width + x0
+        stop = y * self.width + x1
+        if alpha >= 1.0:
+            self.pixels[start:stop] = array('B', [grey]) * (x1 - x0)
+        else:
+            span = self.pixels[start:stop].tostring()
+            self.pixels[start:stop] = array('B',
+                    span.translate(_blend_table(grey, alpha)))
+
+    def fill_polygon(self, points, grey, alpha):
+        """
+        Fill a closed polygon using the nonzero winding rule, sampling at
+        pixel centres like the canvas does.
+        """
+        crossings = {}
+        n = len(points)
+        for i in range(n):
+            (xa, ya), (xb, yb) = points[i], points[(i + 1) % n]
+            if ya == yb:
+                continue
+            winding = 1
+            if ya > yb:
+                (xa, ya), (xb, yb) = (xb, yb), (xa, ya)
+                winding = -1
+            # rows whose centre (y + 0.5) lies in [ya, yb)
+            first = max(int(math.ceil(ya - 0.5)), 0)
+            last = min(int(math.ceil(yb - 0.5)), self.height)
+            slope = float(xb - xa) / (yb - ya)
+            for y in range(first, last):
+                x = xa + (y + 0.5 - ya) * slope
+                crossings.setdefault(y, []).append((x, winding))
+        for y, row in crossings.iteritems():
+            row.sort()
+            total = 0
+            for i in range(len(row) - 1):
+                total += row[i][1]
+                if total:
+                    # pixels whose centre (x + 0.5) lies in [xa, xb)
+                    x0 = int(math.ceil(row[i][0] - 0.5))
+                    x1 = int(math.ceil(row[i + 1][0] - 0.5))
+                    self.fill_span(y, x0, x1, grey, alpha)
+
+    def scaled(self, factor):
+        """
+        Return a copy of the canvas shrunk by C{factor} with a box filter.
+        """
+        w = self.width // factor
+        h = self.height // factor
+        n = factor * factor
+        if numpy is not None:
+            a = numpy.frombuffer(self.pixels.tostring(), dtype=numpy.uint8)
+            a = a.reshape(self.height, self.width)[:h * factor, :w * factor]
+            a = a.reshape(h, factor, w, factor).astype(numpy.uint32)
+            a = (a.sum(axis=3).sum(axis=1) + n // 2) // n
+            return Canvas(w, h, array('B', a.astype(numpy.uint8).tostring()))
+        out = array('B')
+        for ty in range(h):
+            sums = [0] * w
+            for y in range(ty * factor, (ty + 1) * factor):
+                offset = y * self.width
+                row = self.pixels[offset:offset + w * factor]
+                for x in range(w * factor):
+                    sums[x // factor] += row[x]
+            out.extend([ (s + n // 2) // n for s in sums ])
+        return Canvas(w, h, out)
+
+    def to_png(self):
+        return greyscale_png(self.pixels.tostring(), self.width, self.height)
+
+
+def greyscale_png(data, width, height):
+    """
+    Encode 8-bit greyscale pixels as the smallest lossless PNG.
+
+    Dudles only use a handful of grey levels, so this picks whichever
+    needs fewer bits per pixel: greyscale at the lowest bit depth that
+    holds every level exactly, or a palette of the levels in use.
+
+    @param data: string of pixels, one byte each
+    """
+    levels = [ ord(c) for c in set(data) ]
+    levels.sort()
+    for bitdepth in (1, 2, 4, 8):
+        scale = 255 // (2 ** bitdepth - 1)
+        if not [ v for v in levels if v % scale ]:
+            break
+    for palette_depth in (1, 2, 4):
+        if len(levels) <= 2 ** palette_depth:
+            break
+    else:
+        palette_depth = 8
+    # both tables index the original levels, so the data is translated once
+    table = None
+    if palette_depth < bitdepth:
+        table = range(256)
+        for index, v in enumerate(levels):
+            table[v] = index
+        bitdepth = palette_depth
+        options = {'palette': [ (v, v, v) for v in levels ]}
+    else:
+        if bitdepth < 8:
+            table = [ v // scale for v in range(256) ]
+        options = {'greyscale': True}
+    if table is not None:
+        data = data.translate(''.join([ chr(i) for i in table ]))
+    fd = StringIO()
+    writer = png.Writer(width, height, bitdepth=bitdepth, **options)
+    writer.write_buffer(fd, data, width)
+    return fd.getvalue()
+
+
+def render(commands, width=WIDTH, height=HEIGHT):
+    """
+    Replay stroke commands onto a new C{Canvas}.
+
+    @param commands: a list of commands as returned by L{strokes.decode}
+    """
+    canvas = Canvas(width, height)
+    fill = FILL_MODES[DEFAULT_FILL_MODE]
+    path = []
+    last = None
+    for command in commands:
+        op = command[0]
+        if op == 'm':
+            x, y = command[1], command[2]
+            # the robot marks a dot at the start of every stroke
+            canvas.line(x, y, x + 1, y + 1)
+            path = [(x, y), (x + 1, y + 1)]
+            last = (x + 1, y + 1)
+        elif op == 'l':
+            for (x, y) in command[1]:
+                if last is not None:
+                    canvas.line(last[0], last[1], x, y)
+                else:
+                    canvas.plot(x, y)
+                path.append((x, y))
+                last = (x, y)
+        elif op == 's':
+            if 0 <= command[1] < len(FILL_MODES) and FILL_MODES[command[1]]:
+                fill = FILL_MODES[command[1]]
+        elif op == 'f':
+            if len(path) > 2:
+                canvas.fill_polygon(path, fill[0], fill[1])
+    return canvas
+
+
+def render_png(data, width=WIDTH, height=HEIGHT,
+               thumbnail_factor=THUMBNAIL_FACTOR):
+    """
+    Render stroke data, binary or legacy text, to a full size PNG and a
+    thumbnail shrunk by C{thumbnail_factor}.
+
+    @return: a tuple of C{(image, thumbnail)} PNG strings
+    """
+    canvas = render(strokes.decode(data), width, height)
+    return canvas.to_png(), canvas.scaled(thumbnail_factor).to_png()
+
+
+def pixels_png(data, width, height, thumbnail_factor=THUMBNAIL_FACTOR):
+    """
+    Encode uploaded greyscale pixels to a full size PNG and a thumbnail.
+
+    @return: a tuple of C{(image, thumbnail)} PNG strings
+    @raise ValueError: unless C{data} holds exactly C{width} by C{height}
+        pixels
+    """
+    if width <= 0 or height <= 0 or len(data) != width * height:
+        raise ValueError('expected %dx%d pixels, got %d bytes'
+                         % (width, height, len(data)))
+    canvas = Canvas(width, height, array('B', data))
+    return canvas.to_png(), canvas.scaled(thumbnail_factor).to_png()
@@ -0,0 +1,283 @@
+"""
+Stroke data codecs.
+
+C{DudlrStrokeRecorder} in dudlr.js records strokes as ASCII text made up of
+the opcodes C{m} (move to a point), C{l} (line through the points that
+follow), C{s} (set the fill mode, one digit) and C{f} (fill).  Every point
+is a pair of three character, zero-padded coordinates, e.g.::
+
+    m010020l011021012022s2l010020f
+
+The binary format stores the same commands with one byte opcodes and the
+coordinates delta-encoded against the previous point as zigzag varints, so
+a typical point takes two bytes instead of six.  A blob starts with the
+C{MAGIC} bytes, a version byte and a flags byte; if C{FLAG_ZLIB} is set the
+rest of the blob is zlib-compressed.
+
+Commands are represented as tuples::
+
+    ('m', x, y)
+    ('l', [(x, y), ...])
+    ('s', mode)
+    ('f',)
+"""
+
+import zlib
+from array import array
+
+
+MAGIC = 'DS'
+VERSION = 1
+
+FLAG_ZLIB = 0x01
+
+OP_MOVE = 1
+OP_LINE = 2
+OP_STYLE = 3
+OP_FILL = 4
+
+# smallest and largest coordinates the text format can hold
+MIN_COORD = -99
+MAX_COORD = 999
+
+
+class StrokeFormatError(ValueError):
+    pass
+
+
+def is_binary(data):
+    """
+    Check if C{data} is in the binary stroke format.
+    """
+    return data[:len(MAGIC)] == MAGIC
+
+
+def parse_text(text):
+    """
+    Parse legacy text stroke data into a list of commands.
+
+    Coordinate pairs not preceded by an C{l} opcode are read as a line,
+    the same way C{DudlrRobot} replays them.
+    """
+    commands = []
+    points = None
+    i = 0
+    n = len(text)
+    try:
+        while i < n:
+            c = text[i]
+            if c == 'm':
+                commands.append(('m', int(text[i+1:i+4]), int(text[i+4:i+7])))
+                points = None
+                i += 7
+            elif c == 'l':
+                points = []
+                commands.append(('l', points))
+                i += 1
+            elif c == 's':
+                commands.append(('s', int(text[i+1])))
+                points = None
+                i += 2
+            elif c == 'f':
+                commands.append(('f',))
+                points = None
+                i += 1
+            else:
+                if points is None:
+                    points = []
+                    commands.append(('l', points))
+                points.append((int(text[i:i+3]), int(text[i+3:i+6])))
+                i += 6
+    except (ValueError, IndexError):
+        raise StrokeFormatError('malformed stroke data at offset %d' % i)
+    return commands
+
+
+def _pad(n):
+    if n < MIN_COORD:
+        n = MIN_COORD
+    elif n > MAX_COORD:
+        n = MAX_COORD
+    return '%03d' % n
+
+
+def format_text(commands):
+    """
+    Format a list of commands as legacy text stroke data.
+    """
+    out = []
+    for command in commands:
+        op = command[0]
+        if op == 'm':
+            out.append('m' + _pad(command[1]) + _pad(command[2]))
+        elif op == 'l':
+            out.append('l')
+            out.extend([ _pad(x) + _pad(y) for (x, y) in command[1] ])
+        elif op == 's':
+            out.append('s%d' % command[1])
+        elif op == 'f':
+            out.append('f')
+        else:
+            raise StrokeFormatError('unknown stroke command %r' % (op,))
+    return ''.join(out)
+
+
+def _varint(out, n):
+    while n > 0x7f:
+        out.append((n & 0x7f) | 0x80)
+        n >>= 7
+    out.append(n)
+
+
+def _svarint(out, n):
+    # zigzag: 0, -1, 1, -2, 2 ... -> 0, 1, 2, 3, 4 ...
+    if n < 0:
+        _varint(out, ((-n) << 1) - 1)
+    else:
+        _varint(out, n << 1)
+
+
+def encode(commands, compress=False):
+    """
+    Encode a list of commands in the binary stroke format.
+
+    @param compress: wrap the encoded commands with zlib
+    """
+    out = array('B')
+    lx = ly = 0
+    for command in commands:
+        op = command[0]
+        if op == 'm':
+            x, y = command[1], command[2]
+            out.append(OP_MOVE)
+            _svarint(out, x - lx)
+            _svarint(out, y - ly)
+            lx, ly = x, y
+        elif op == 'l':
+            points = command[1]
+            out.append(OP_LINE)
+            _varint(out, len(points))
+            for (x, y) in points:
+                _svarint(out, x - lx)
+                _svarint(out, y - ly)
+                lx, ly = x, y
+        elif op == 's':
+            out.append(OP_STYLE)
+            out.append(command[1])
+        elif op == 'f':
+            out.append(OP_FILL)
+        else:
+            raise StrokeFormatError('unknown stroke command %r' % (op,))
+    return _wrap(out.tostring(), compress)
+
+
+def _wrap(payload, compress):
+    flags = 0
+    if compress:
+        flags |= FLAG_ZLIB
+        payload = zlib.compress(payload, 9)
+    return MAGIC + chr(VERSION) + chr(flags) + payload
+
+
+def _unwrap(data):
+    """
+    Check the header of a binary blob and return its uncompressed payload.
+    """
+    header = len(MAGIC) + 2
+    if not is_binary(data) or len(data) < header:
+        raise StrokeFormatError('not binary stroke data')
+    version = ord(data[len(MAGIC)])
+    if version != VERSION:
+        raise StrokeFormatError('unsupported stroke format version %d'
+                                % version)
+    flags = ord(data[len(MAGIC) + 1])
+    payload = data[header:]
+    if flags & FLAG_ZLIB:
+        try:
+            payload = zlib.decompress(payload)
+        except zlib.error:
+            raise StrokeFormatError('corrupt compressed stroke data')
+    return payload
+
+
+def _readvarint(buf, i):
+    """
+    Read a varint from C{buf} at offset C{i}, return it and the new offset.
+    """
+    result = shift = 0
+    while True:
+        b = buf[i]
+        i += 1
+        result |= (b & 0x7f) << shift
+        if not b & 0x80:
+            return result, i
+        shift += 7
+
+
+def _unzigzag(n):
+    if n & 1:
+        return -((n + 1) >> 1)
+    return n >> 1
+
+
+def decode(data):
+    """
+    Decode stroke data, binary or legacy text, into a list of commands.
+    """
+    if not is_binary(data):
+        return parse_text(data)
+    buf = array('B', _unwrap(data))
+    commands = []
+    i = 0
+    n = len(buf)
+    lx = ly = 0
+    try:
+        while i < n:
+            op = buf[i]
+            i += 1
+            if op == OP_MOVE:
+                dx, i = _readvarint(buf, i)
+                dy, i = _readvarint(buf, i)
+                lx += _unzigzag(dx)
+                ly += _unzigzag(dy)
+                commands.append(('m', lx, ly))
+            elif op == OP_LINE:
+                count, i = _readvarint(buf, i)
+                points = []
+                for k in xrange(count):
+                    dx, i = _readvarint(buf, i)
+                    dy, i = _readvarint(buf, i)
+                    lx += _unzigzag(dx)
+                    ly += _unzigzag(dy)
+                    points.append((lx, ly))
+                commands.append(('l', points))
+            elif op == OP_STYLE:
+                commands.append(('s', buf[i]))
+                i += 1
+            elif op == OP_FILL:
+                commands.append(('f',))
+            else:
+                raise StrokeFormatError('unknown stroke opcode %d at offset %d'
+                                        % (op, i - 1))
+    except IndexError:
+        raise StrokeFormatError('truncated stroke data')
+    return commands
+
+
+def to_binary(data, compress=False):
+    """
+    Convert stroke data, binary or legacy text, to the binary format.
+    Binary data is only re-wrapped, not re-encoded.
+    """
+    if is_binary(data):
+        return _wrap(_unwrap(data), compress)
+    return encode(parse_text(data), compress)
+
+
+def to_text(data):
+    """
+    Convert stroke data, binary or legacy text, to legacy text.
+    """
+    if not is_binary(data):
+        return data
+    return format_text(decode(data))
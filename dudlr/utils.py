@@ -1,7 +1,16 @@
 import os
+import re
+import base64
+import calendar
+import datetime
+from email.utils import formatdate, parsedate
 
-from jinja2 import Environment, FileSystemLoader
+from jinja2 import Environment, FileSystemLoader, ModuleLoader, \
+     MemcachedBytecodeCache, MemoryBytecodeCache
 from jinja2 import tests
+from jinja2.loaders import load_manifest
+
+from dudlr import cache
 
 def test_gt(n, other):
     return n > other
@@ -11,9 +20,66 @@ tests.TESTS.update({
 })
 
 
+def bytecode_cache():
+    """
+    Compiled templates are shared through memcache so a fresh instance
+    only unmarshals them; without memcache they are kept in process.
+    """
+    if cache.memcache is not None:
+        return MemcachedBytecodeCache(cache.memcache)
+    return MemoryBytecodeCache()
+
+
+DEVELOPMENT = os.environ.get('SERVER_SOFTWARE', '').startswith('Development')
+
 TEMPLATE_PATH = os.path.join(os.path.dirname(__file__), 'templates')
-jinja_env = Environment(loader=FileSystemLoader(TEMPLATE_PATH),
-                        autoescape=True, trim_blocks=True)
+
+# written by dudlr/precompile.py at deployment; templates missing from it
+# are compiled from TEMPLATE_PATH
+COMPILED_TEMPLATES = 'dudlr.compiled_templates'
+COMPILED_TEMPLATE_PATH = os.path.join(os.path.dirname(__file__),
+                                      'compiled_templates')
+TEMPLATE_MANIFEST = os.path.join(COMPILED_TEMPLATE_PATH, 'templates.sha1')
+
+# deployed templates never change, so only the development server looks
+# for edits, on every use
+if DEVELOPMENT:
+    TEMPLATE_CHECK_INTERVAL = 0
+else:
+    TEMPLATE_CHECK_INTERVAL = None
+
+
+def template_loader():
+    """
+    Precompiled templates first, falling back to the sources.  Outside
+    development the manifest written by dudlr/precompile.py keys their
+    bytecode, saving a hash of each source.  The development server only
+    uses the sources, so edits show up even after precompiling.
+
+    The manifest is trusted as is, so it has to be rebuilt with the
+    compiled package on every deploy; it is only read when that package
+    can be imported.
+    """
+    if DEVELOPMENT:
+        return FileSystemLoader(TEMPLATE_PATH,
+                                check_interval=TEMPLATE_CHECK_INTERVAL)
+    manifest = None
+    try:
+        __import__(COMPILED_TEMPLATES)
+    except ImportError:
+        pass
+    else:
+        if os.path.exists(TEMPLATE_MANIFEST):
+            manifest = load_manifest(TEMPLATE_MANIFEST)
+    source = FileSystemLoader(TEMPLATE_PATH,
+                              check_interval=TEMPLATE_CHECK_INTERVAL,
+                              manifest=manifest)
+    return ModuleLoader(COMPILED_TEMPLATES, source)
+
+
+jinja_env = Environment(loader=template_loader(),
+                        autoescape=True, trim_blocks=True,
+                        bytecode_cache=bytecode_cache())
 
 
 def form(*names):
@@ -36,4 +102,128 @@ def form(*names):
     return _wrapper
 
 
+PIXEL_ENCODINGS = ('decimal', 'raw', 'base64')
+
+_BASE64 = re.compile(r'^[A-Za-z0-9+/]*={0,2}$')
+
+def decode_pixel_data(data, encoding='decimal'):
+    """
+    Decode pixel data uploaded by the client into a string of bytes.
+
+    @param data: the uploaded payload
+    @param encoding: one of C{PIXEL_ENCODINGS}; C{'decimal'} is the legacy
+        comma-separated list of byte values, C{'raw'} is an
+        application/octet-stream body and C{'base64'} is the same body
+        base64-encoded for clients without binary XHR support
+    @raise ValueError: if C{data} is not valid in C{encoding}
+    """
+    if encoding == 'raw':
+        return data
+    if encoding == 'base64':
+        # b64decode skips characters outside the alphabet
+        if len(data) % 4 or not _BASE64.match(data):
+            raise ValueError('malformed base64 pixel data')
+        return base64.b64decode(data)
+    if encoding == 'decimal':
+        return ''.join([ chr(int(n)) for n in data.split(',') ])
+    raise ValueError('unknown pixel encoding: %r' % (encoding,))
 
+
+def http_date(dt):
+    """
+    Format a naive UTC C{datetime} as an HTTP date.
+    """
+    return formatdate(calendar.timegm(dt.utctimetuple()), usegmt=True)
+
+def not_modified(request, etag, last_modified=None):
+    """
+    Check a conditional GET against the current representation.
+
+    If-None-Match takes precedence over If-Modified-Since, as in RFC 2616.
+
+    @param request: the C{webapp.Request}
+    @param etag: current entity tag, quoted
+    @param last_modified: naive UTC C{datetime} of the last change
+    """
+    if_none_match = request.headers.get('If-None-Match')
+    if if_none_match:
+        tags = [ t.strip() for t in if_none_match.split(',') ]
+        return '*' in tags or etag in tags or ('W/' + etag) in tags
+    if_modified_since = request.headers.get('If-Modified-Since')
+    if if_modified_since and last_modified is not None:
+        since = parsedate(if_modified_since.split(';')[0])
+        if since is not None:
+            return (calendar.timegm(last_modified.utctimetuple())
+                    <= calendar.timegm(since))
+    return False
+
+
+_EPOCH = datetime.datetime(1970, 1, 1)
+
+def encode_cursor(value, id):
+    """
+    Encode the sort value and key id or name of the last item on a page
+    as an opaque, URL-safe token.
+
+    @param value: an C{int}, C{float} or naive UTC C{datetime}
+    """
+    if isinstance(value, datetime.datetime):
+        delta = value - _EPOCH
+        value = 'd%d' % ((delta.days * 86400 + delta.seconds) * 1000000
+                         + delta.microseconds)
+    elif isinstance(value, float):
+        value = 'f%r' % value
+    else:
+        value = 'i%d' % value
+    if not isinstance(id, (int, long)):
+        id = 'n' + id
+    return base64.urlsafe_b64encode('%s:%s' % (value, id)).rstrip('=')
+
+# datastore integers are signed 64-bit
+_MAX_INT = 2 ** 63 - 1
+
+_CURSOR_TYPES = {
+    'd': datetime.datetime,
+    'f': float,
+    'i': (int, long),
+}
+
+def decode_cursor(token, value_type=None):
+    """
+    Decode a token made by L{encode_cursor} into C{(value, id)}.
+
+    @param value_type: type the sort value must have, if known, e.g. the
+        C{data_type} of the property the listing is ordered by
+    @raise ValueError: if the token is malformed or its value is not of
+        C{value_type}
+    """
+    try:
+        raw = base64.urlsafe_b64decode(str(token) + '=' * (-len(token) % 4))
+        value, id = raw.split(':', 1)
+        kind, value = value[0], value[1:]
+        if kind == 'f':
+            value = float(value)
+            if value != value or abs(value) == float('inf'):
+                raise ValueError(value)
+        else:
+            value = int(value)
+            if abs(value) > _MAX_INT:
+                raise ValueError(value)
+        if id[:1] == 'n':
+            id = id[1:]
+            if not id:
+                raise ValueError(id)
+        else:
+            id = int(id)
+            if not 0 < id <= _MAX_INT:
+                raise ValueError(id)
+        if kind not in _CURSOR_TYPES:
+            raise ValueError(kind)
+        if kind == 'd':
+            value = _EPOCH + datetime.timedelta(microseconds=value)
+    except (TypeError, ValueError, IndexError, OverflowError):
+        raise ValueError('malformed cursor: %r' % (token,))
+    if value_type is not None and not issubclass(value_type,
+                                                 _CURSOR_TYPES[kind]):
+        raise ValueError('cursor does not match the listing: %r' % (token,))
+    return value, id
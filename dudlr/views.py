@@ -1,29 +1,98 @@
+import base64
+import hashlib
 import logging
 import math
 
 from django.utils import simplejson
+from jinja2 import Markup
 from google.appengine.ext import webapp
+from google.appengine.ext.db import Key
 from google.appengine.api import users
 
+from dudlr import cache
 from dudlr import core
 from dudlr.core import DudleException
-from dudlr.utils import jinja_env, form
+from dudlr.utils import jinja_env, form, http_date, not_modified
+
+
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000'
+REVALIDATE_CACHE_CONTROL = 'public, max-age=300, must-revalidate'
+
+# stands in for the per-user header in cached pages
+HEADER_SLOT = '<!--header-->'
+
+def inline_strokes(dudles):
+    """
+    A JavaScript object literal of the strokes of as many C{dudles} as
+    fit in C{core.INLINE_STROKES_BUDGET}, safe to put in a script block.
+    """
+    found = core.get_inline_strokes(dudles)
+    js = '{%s}' % ','.join([ '"%d":%s' % (id, data)
+                             for id, data in found.items() ])
+    return Markup(js.replace('<', '\\u003c').replace('>', '\\u003e')
+                    .replace('&', '\\u0026'))
 
 class TemplateRequestHandler(webapp.RequestHandler):
 
-    def render_template(self, template, headers=None, **context):
-        self.response.headers['Content-Type'] = 'text/html'
+    def user_context(self):
+        context = {}
         context['user'] = user = users.get_current_user()
-        context['dudlr'] = core.get_dudlr(user)
+        context['dudlr'] = core.get_dudlr(user, create=False)
         context['request'] = self.request
         if user is None:
             context['login_url'] = users.create_login_url(self.request.url)
         else:
             context['logout_url'] = users.create_logout_url('/')
+        return context
+
+    def render_template(self, template, headers=None, cache_key=None,
+                        **context):
+        """
+        Render C{template} to the response.
+
+        @param cache_key: if given, also keep the page in the listings
+            cache under this key, with the header left out so the page
+            can be served to others (see L{cached_page_key})
+        """
+        self.response.headers['Content-Type'] = 'text/html'
+        context.update(self.user_context())
         if headers:
             response.headers.update(headers)
-        self.response.out.write(
-                jinja_env.get_template(template).render(**context))
+        template = jinja_env.get_template(template)
+        if cache_key is None:
+            self.response.out.write(template.render(**context))
+            return
+        page = template.render(header=Markup(HEADER_SLOT), **context)
+        cache.page_cache.set(cache.LISTINGS, cache_key, page)
+        self.write_page(page, context)
+
+    def write_page(self, page, context=None):
+        header = jinja_env.get_template('header.html').render(
+                **(context or self.user_context()))
+        self.response.out.write(page.replace(HEADER_SLOT, header, 1))
+
+    def cached_page_key(self):
+        """
+        Key of this listing page in the listings cache, if it looks the
+        same to everyone.  Signed in visitors get rating controls and
+        galleries of their own, so they are never served from it.
+        """
+        if users.get_current_user() is not None:
+            return None
+        return '%s?page=%s&cursor=%s' % (self.request.path,
+                self.request.get('page', '1'), self.request.get('cursor'))
+
+    def write_cached_page(self):
+        """
+        Write this page from the listings cache if it is there.
+        """
+        key = self.cached_page_key()
+        page = key and cache.page_cache.get(cache.LISTINGS, key)
+        if not page:
+            return False
+        self.response.headers['Content-Type'] = 'text/html'
+        self.write_page(page)
+        return True
 
 BaseHandler = TemplateRequestHandler
 
@@ -43,15 +112,38 @@ class DudleCreationHandler(JsonHandler):
 
     def post(self):
         dudle = core.create_dudle()
-        self.json({'id':dudle.key().id()})
+        self.json({'id':dudle.key().id(), 'token':dudle.upload_token})
 
 
 class DudleUpdateHandler(JsonHandler):
 
     @form('id:int', 'data:str', 'format:str', 'width:int', 'height:int')
     def post(self, id, data, format, width, height):
-        core.update_dudle(id, format, data)
-        core.finalize_dudle(id, format, width, height)
+        try:
+            core.update_dudle(id, format, data)
+            core.finalize_dudle(id, format, width, height)
+        except DudleException, de:
+            self.response.set_status(400)
+            self.json({'status':'error', 'message':str(de)})
+            return
+        self.json('ok')
+
+class DudleBinaryUpdateHandler(JsonHandler):
+    """
+    Accepts pixel data as an application/octet-stream request body (raw
+    or base64-encoded) with the remaining parameters in the query string.
+    """
+
+    @form('id:int', 'format:str', 'width:int', 'height:int', 'encoding:str')
+    def post(self, id, format, width, height, encoding):
+        try:
+            core.update_dudle(id, format, self.request.body,
+                    encoding or 'raw')
+            core.finalize_dudle(id, format, width, height)
+        except DudleException, de:
+            self.response.set_status(400)
+            self.json({'status':'error', 'message':str(de)})
+            return
         self.json('ok')
 
 class DudleUpdateStrokesHandler(JsonHandler):
@@ -68,67 +160,257 @@ class DudleUpdateStrokesHandler(JsonHandler):
         core.finalize_dudle_strokes(id, public, anon)
         self.json('ok')
 
+class DudleAppendStrokesHandler(JsonHandler):
+    """
+    Stores one chunk of a chunked stroke upload.  Chunks may be retried
+    and arrive in any order.
+    """
+
+    @form('id:int', 'token:str', 'seq:int', 'data:str')
+    def post(self, id, token, seq, data):
+        try:
+            core.append_dudle_strokes(id, token, seq, data)
+        except DudleException, de:
+            self.response.set_status(400)
+            self.json({'status':'error', 'message':str(de)})
+            return
+        self.json({'status':'ok', 'seq':seq})
+
+class DudleFinalizeStrokesHandler(JsonHandler):
+    """
+    Assembles the chunks of a chunked stroke upload.  If any are missing
+    their sequence numbers are returned so the client can resend them.
+    """
+
+    @form('id:int', 'token:str', 'count:str', 'public:str', 'anon:str')
+    def post(self, id, token, count, public, anon):
+        if not count.isdigit():
+            self.response.set_status(400)
+            self.json({'status':'error',
+                       'message':core.ERROR_BAD_CHUNK_COUNT})
+            return
+        count = int(count)
+        try:
+            core.finalize_dudle_strokes(id, public == 'true', anon == 'true',
+                    token=token, count=count)
+        except core.MissingChunksException, mce:
+            self.json({'status':'error', 'message':str(mce),
+                       'missing':mce.missing})
+        except DudleException, de:
+            self.json({'status':'error', 'message':str(de)})
+        else:
+            self.json({'status':'ok'})
+
 class ViewDudleHandler(BaseHandler):
 
     def get(self):
+        if self.write_cached_page():
+            return
         order = 'desc'
         page = int(self.request.get('page', 1))
         offset = (page - 1) * 5
-        dudles, count = core.get_latest_dudles(limit=5, order=order, offset=offset)
+        try:
+            dudles, count, cursor = core.get_latest_dudles(limit=5,
+                    order=order, offset=offset,
+                    cursor=self.request.get('cursor'))
+        except DudleException:
+            self.error(400)
+            return
+        inlined = inline_strokes(dudles)
         dudles = [ (d.key().id(), d ) for d in dudles ]
         dudle_ids = [ k for (k,v) in dudles ]
         dudles = dict(dudles)
         self.render_template('latest.html',
                 dudle_ids=dudle_ids,
-                dudles=dudles, artist=False,
-                page=page, pages=int(math.ceil(count/5.)))
+                dudles=dudles, artist=False, cursor=cursor,
+                page=page, pages=int(math.ceil(count/5.)),
+                inline_strokes=inlined, cache_key=self.cached_page_key())
 
 class TopRatedDudleHandler(BaseHandler):
 
     def get(self):
+        if self.write_cached_page():
+            return
         page = int(self.request.get('page', 1))
         offset = (page - 1) * 5
-        dudles, count = core.get_toprated_dudles(limit=5, offset=offset)
+        try:
+            dudles, count, cursor = core.get_toprated_dudles(limit=5,
+                    offset=offset, cursor=self.request.get('cursor'))
+        except DudleException:
+            self.error(400)
+            return
+        inlined = inline_strokes(dudles)
         dudles = [ (d.key().id(), d ) for d in dudles ]
         dudle_ids = [ k for (k,v) in dudles ]
         dudles = dict(dudles)
         logging.info('got dudles : %d' % len(dudles))
         self.render_template('latest.html',
                 dudle_ids=dudle_ids,
-                dudles=dudles, artist=False,
-                page=page, pages=int(math.ceil(count/5.)))
+                dudles=dudles, artist=False, cursor=cursor,
+                page=page, pages=int(math.ceil(count/5.)),
+                inline_strokes=inlined, cache_key=self.cached_page_key())
 
 class DudlrGalleryHandler(BaseHandler):
 
     def get(self):
+        if self.write_cached_page():
+            return
         order = 'desc'
         id = int(self.request.path.split('/')[-1])
         logging.info('artist : %d' % id)
         page = int(self.request.get('page', 1))
         offset = (page - 1) * 5
         artist = core.get_dudlr_by_id(id)
-        dudles, count = core.get_gallery(artist, users.get_current_user(), limit=5, offset=offset)
+        try:
+            dudles, count, cursor = core.get_gallery(artist,
+                    users.get_current_user(), limit=5, offset=offset,
+                    cursor=self.request.get('cursor'))
+        except DudleException:
+            self.error(400)
+            return
+        inlined = inline_strokes(dudles)
         dudles = [ (d.key().id(), d ) for d in dudles ]
         dudle_ids = [ k for (k,v) in dudles ]
         dudles = dict(dudles)
         self.render_template('latest.html',
                 dudle_ids=dudle_ids, dudles=dudles, artist=artist,
-                page=page, pages=int(math.ceil(count/5.)))
+                cursor=cursor,
+                page=page, pages=int(math.ceil(count/5.)),
+                inline_strokes=inlined, cache_key=self.cached_page_key())
 
 
 class DudleImage(webapp.RequestHandler):
+    """
+    Serves a dudle's PNG with validators for conditional GETs.  URLs that
+    carry the image's ETag as C{v} never change and may be cached for
+    good; plain URLs must be revalidated.
+    """
 
     def get(self):
-        dudle = core.get_dudle(int(self.request.get('id')))
-        self.response.headers['Content-Type'] = 'image/png'
-        self.response.out.write(dudle.image_data)
+        size = self.request.get('size') == 'thumb' and 'thumb' or 'full'
+        image = core.get_dudle_image(int(self.request.get('id')), size)
+        if image is None:
+            self.error(404)
+            return
+        headers = self.response.headers
+        etag = '"%s"' % image.etag
+        headers['ETag'] = etag
+        headers['Last-Modified'] = http_date(image.modified_date)
+        if self.request.get('v') == image.etag:
+            headers['Cache-Control'] = IMMUTABLE_CACHE_CONTROL
+        else:
+            headers['Cache-Control'] = REVALIDATE_CACHE_CONTROL
+        if not_modified(self.request, etag, image.modified_date):
+            self.response.set_status(304)
+            return
+        headers['Content-Type'] = 'image/png'
+        self.response.out.write(image.data)
 
 
 class DudleStrokes(JsonHandler):
+    """
+    Stroke data for a dudle: legacy text by default, or the binary stroke
+    format base64-encoded if C{format=binary} is requested and the dudle
+    was stored in it.
+    """
 
     def get(self):
-        dudle = core.get_dudle(int(self.request.get('id')))
-        self.json(dudle.strokes)
+        data = core.get_dudle_strokes(int(self.request.get('id'))) or ''
+        self.json(core.strokes_json(data,
+                                    self.request.get('format') == 'binary'))
+
+# most dudles a bulk strokes request may ask for
+BULK_STROKES_LIMIT = 50
+
+class DudleBulkStrokes(JsonHandler):
+    """
+    Stroke data for the comma-separated dudle C{ids}, as an object keyed
+    by id with values as returned by C{DudleStrokes}; unknown ids are
+    left out.  Responses carry an ETag for conditional GETs and are left
+    to the front end to gzip, which it does for compressible types when
+    the client accepts it (App Engine does not let apps set
+    Content-Encoding themselves).
+    """
+
+    def get(self):
+        try:
+            ids = [ int(i) for i in self.request.get('ids').split(',') if i ]
+        except ValueError:
+            self.error(400)
+            return
+        binary = self.request.get('format') == 'binary'
+        found = core.get_dudles_strokes(ids[:BULK_STROKES_LIMIT])
+        body = simplejson.dumps(dict([ (str(id),
+                                        core.strokes_json(data, binary))
+                                       for id, data in found.items() ]))
+        headers = self.response.headers
+        etag = '"%s"' % hashlib.md5(body).hexdigest()
+        headers['ETag'] = etag
+        headers['Cache-Control'] = REVALIDATE_CACHE_CONTROL
+        headers['Vary'] = 'Accept-Encoding'
+        if not_modified(self.request, etag):
+            self.response.set_status(304)
+            return
+        headers['Content-Type'] = 'application/json'
+        self.response.out.write(body)
+
+class MigrateBlobsHandler(JsonHandler):
+    """
+    Moves the payloads of one batch of older dudles into their own
+    records.  Call again with C{start} set to the returned C{next} until
+    it is C{null}.
+    """
+
+    @form('start:str')
+    def get(self, start):
+        migrated, next = core.migrate_dudles(start and Key(start) or None)
+        self.json({'migrated':migrated, 'next':next and str(next) or None})
+
+class MigrateRatingsHandler(JsonHandler):
+    """
+    Moves one batch of older ratings under their rating shards.  Call
+    again with C{start} set to the returned C{next} until it is C{null}.
+    """
+
+    @form('start:str')
+    def get(self, start):
+        migrated, next = core.migrate_ratings(start and Key(start) or None)
+        self.json({'migrated':migrated, 'next':next and str(next) or None})
+
+class RecountHandler(JsonHandler):
+    """
+    Rebuilds the dudle counters one batch at a time.  Call without
+    C{start} to begin, then with the returned C{next} until it is
+    C{null}.
+    """
+
+    @form('start:str')
+    def get(self, start):
+        next = core.recount_dudles(start and Key(start) or None)
+        self.json({'next':next and str(next) or None})
+
+class RerankHandler(JsonHandler):
+    """
+    Recomputes the top rated ranks of one batch of dudles.  Call without
+    C{start} to begin, then with the returned C{next} until it is
+    C{null}.
+    """
+
+    @form('start:str')
+    def get(self, start):
+        next = core.rerank_dudles(start and Key(start) or None)
+        self.json({'next':next and str(next) or None})
+
+class FlushRatingHandler(JsonHandler):
+    """
+    Task saving the ratings of a dudle that arrived while writing them was
+    throttled (see L{core.rate_dudle}).
+    """
+
+    @form('id:int')
+    def post(self, id):
+        core.flush_rating(id)
+        self.json('ok')
 
 class EditProfileHandler(BaseHandler):
 
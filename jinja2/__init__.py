@@ -38,7 +38,11 @@ from jinja2.environment import Environment, Template
 
 # loaders
 from jinja2.loaders import BaseLoader, FileSystemLoader, PackageLoader, \
-     DictLoader, FunctionLoader, PrefixLoader, ChoiceLoader
+     DictLoader, FunctionLoader, PrefixLoader, ChoiceLoader, ModuleLoader
+
+# bytecode caches
+from jinja2.bccache import BytecodeCache, FileSystemBytecodeCache, \
+     MemoryBytecodeCache, MemcachedBytecodeCache
 
 # undefined types
 from jinja2.runtime import Undefined, DebugUndefined, StrictUndefined
@@ -48,16 +52,18 @@ from jinja2.exceptions import TemplateError, UndefinedError, \
      TemplateNotFound, TemplateSyntaxError, TemplateAssertionError
 
 # decorators and public utilities
-from jinja2.filters import environmentfilter, contextfilter
+from jinja2.filters import environmentfilter, contextfilter, impurefilter
 from jinja2.utils import Markup, escape, clear_caches, \
      environmentfunction, contextfunction, is_undefined
 
 __all__ = [
     'Environment', 'Template', 'BaseLoader', 'FileSystemLoader',
     'PackageLoader', 'DictLoader', 'FunctionLoader', 'PrefixLoader',
-    'ChoiceLoader', 'Undefined', 'DebugUndefined', 'StrictUndefined',
-    'TemplateError', 'UndefinedError', 'TemplateNotFound',
+    'ChoiceLoader', 'ModuleLoader', 'BytecodeCache',
+    'FileSystemBytecodeCache', 'MemoryBytecodeCache',
+    'MemcachedBytecodeCache', 'Undefined', 'DebugUndefined',
+    'StrictUndefined', 'TemplateError', 'UndefinedError', 'TemplateNotFound',
     'TemplateSyntaxError', 'TemplateAssertionError', 'environmentfilter',
-    'contextfilter', 'Markup', 'escape', 'environmentfunction',
+    'contextfilter', 'impurefilter', 'Markup', 'escape', 'environmentfunction',
     'contextfunction', 'clear_caches', 'is_undefined'
 ]
@@ -0,0 +1,283 @@
+# -*- coding: utf-8 -*-
+"""
+    jinja2.bccache
+    ~~~~~~~~~~~~~~
+
+    This module implements the bytecode cache system Jinja uses to skip
+    lexing, parsing, optimizing and code generation for templates that
+    were compiled before.  The loader asks the cache for a bucket keyed
+    by the template name, filename and the environment options affecting
+    compilation; the bucket holds the marshalled code object together
+    with a checksum of the source it was compiled from.
+
+    :copyright: 2008 by Armin Ronacher.
+    :license: BSD, see LICENSE for more details.
+"""
+from os import path, listdir
+import imp
+import marshal
+import tempfile
+import fnmatch
+try:
+    from hashlib import sha1
+except ImportError:
+    from sha import new as sha1
+from jinja2.utils import LRUCache
+
+
+#: version of the bucket format, bump it if the layout or the code
+#: generated by the compiler changes
+bc_version = 2
+
+#: magic header of every bucket.  The python bytecode magic is part of it
+#: because marshalled code objects are not portable between versions.
+bc_magic = 'j2' + chr(bc_version) + imp.get_magic()
+
+
+class Bucket(object):
+    """Buckets are used to store the bytecode for one template.  They are
+    created by the bytecode cache and initialized by it; the loader fills
+    in the code after compiling, or uses the one loaded if the checksum
+    of the source still matches.
+    """
+
+    def __init__(self, environment, key, checksum):
+        self.environment = environment
+        self.key = key
+        self.checksum = checksum
+        self.reset()
+
+    def reset(self):
+        """Resets the bucket (unloads the bytecode)."""
+        self.code = None
+
+    def bytecode_from_string(self, string):
+        """Load bytecode from a string.  Buckets with a different magic
+        header or checksum are ignored and stay empty.
+        """
+        self.reset()
+        if not string or not string.startswith(bc_magic):
+            return
+        checksum_end = string.find('|', len(bc_magic))
+        if checksum_end < 0 or \
+           string[len(bc_magic):checksum_end] != self.checksum:
+            return
+        try:
+            self.code = marshal.loads(string[checksum_end + 1:])
+        except (EOFError, ValueError, TypeError):
+            self.reset()
+
+    def bytecode_to_string(self):
+        """Return the bytecode as string, including the magic header and
+        the source checksum.
+        """
+        return '%s%s|%s' % (bc_magic, self.checksum, marshal.dumps(self.code))
+
+
+class BytecodeCache(object):
+    """To implement your own bytecode cache you have to subclass this class
+    and override :meth:`load_bytecode` and :meth:`dump_bytecode`.  Both of
+    these methods are passed a :class:`Bucket`.
+
+    A very basic bytecode cache that saves the bytecode on the file system::
+
+        from os import path
+
+        class MyCache(BytecodeCache):
+
+            def __init__(self, directory):
+                self.directory = directory
+
+            def load_bytecode(self, bucket):
+                filename = path.join(self.directory, bucket.key)
+                if path.exists(filename):
+                    f = file(filename, 'rb')
+                    try:
+                        bucket.bytecode_from_string(f.read())
+                    finally:
+                        f.close()
+
+            def dump_bytecode(self, bucket):
+                filename = path.join(self.directory, bucket.key)
+                f = file(filename, 'wb')
+                try:
+                    f.write(bucket.bytecode_to_string())
+                finally:
+                    f.close()
+    """
+
+    def load_bytecode(self, bucket):
+        """Subclasses have to override this method to load bytecode into a
+        bucket.  If they are not able to find code in the cache for the
+        bucket, it must not do anything.
+        """
+        raise NotImplementedError()
+
+    def dump_bytecode(self, bucket):
+        """Subclasses have to override this method to write the bytecode
+        from a bucket back to the cache.  If it unable to do so it must not
+        fail silently but raise an exception.
+        """
+        raise NotImplementedError()
+
+    def clear(self):
+        """Clears the cache.  This method is not used by Jinja2 but should
+        be implemented to allow applications to clear the bytecode cache
+        used by a particular environment.
+        """
+
+    def get_cache_key(self, environment, name, filename=None):
+        """Return the unique hash key for this template name.  Besides the
+        name and filename it covers every environment option that changes
+        the generated code, so environments configured differently never
+        share bytecode.
+        """
+        hash = sha1(name.encode('utf-8'))
+        if filename is not None:
+            if isinstance(filename, unicode):
+                filename = filename.encode('utf-8')
+            hash.update('|' + filename)
+        hash.update('|' + repr(environment.compile_options))
+        return hash.hexdigest()
+
+    def get_source_checksum(self, source):
+        """Returns a checksum for the source."""
+        if isinstance(source, unicode):
+            source = source.encode('utf-8')
+        return sha1(source).hexdigest()
+
+    def get_bucket(self, environment, name, filename, source, checksum=None):
+        """Return a cache bucket for the given template.  All arguments are
+        mandatory but filename may be `None`.  If the loader already knows
+        the `checksum` of the source it is used instead of computing it.
+        """
+        key = self.get_cache_key(environment, name, filename)
+        if checksum is None:
+            checksum = self.get_source_checksum(source)
+        bucket = Bucket(environment, key, checksum)
+        self.load_bytecode(bucket)
+        return bucket
+
+    def set_bucket(self, bucket):
+        """Put the bucket into the cache."""
+        self.dump_bytecode(bucket)
+
+
+class FileSystemBytecodeCache(BytecodeCache):
+    """A bytecode cache that stores bytecode on the filesystem.  It accepts
+    two arguments: The directory where the cache items are stored and a
+    pattern string that is used to build the filename.
+
+    If no directory is specified the system temporary items folder is used.
+
+    The pattern can be used to have multiple separate caches operate on the
+    same directory.  The default pattern is ``'__jinja2_%s.cache'``.  ``%s``
+    is replaced with the cache key.
+
+    >>> bcc = FileSystemBytecodeCache('/tmp/jinja_cache', '%s.cache')
+    """
+
+    def __init__(self, directory=None, pattern='__jinja2_%s.cache'):
+        if directory is None:
+            directory = tempfile.gettempdir()
+        self.directory = directory
+        self.pattern = pattern
+
+    def _get_cache_filename(self, bucket):
+        return path.join(self.directory, self.pattern % bucket.key)
+
+    def load_bytecode(self, bucket):
+        filename = self._get_cache_filename(bucket)
+        if path.exists(filename):
+            f = file(filename, 'rb')
+            try:
+                bucket.bytecode_from_string(f.read())
+            finally:
+                f.close()
+
+    def dump_bytecode(self, bucket):
+        f = file(self._get_cache_filename(bucket), 'wb')
+        try:
+            f.write(bucket.bytecode_to_string())
+        finally:
+            f.close()
+
+    def clear(self):
+        # imported lazily here because google app-engine doesn't support
+        # write access on the file system and the function does not exist
+        # normally.
+        from os import remove
+        files = fnmatch.filter(listdir(self.directory), self.pattern % '*')
+        for filename in files:
+            try:
+                remove(path.join(self.directory, filename))
+            except OSError:
+                pass
+
+
+class MemoryBytecodeCache(BytecodeCache):
+    """Keeps the bytecode of up to `size` templates in process.  This only
+    saves work if templates are compiled more than once per process, for
+    example with a small environment cache or for spontaneous environments;
+    across processes a :class:`FileSystemBytecodeCache` or
+    :class:`MemcachedBytecodeCache` has to be used.
+    """
+
+    def __init__(self, size=100):
+        self.mapping = LRUCache(size)
+
+    def load_bytecode(self, bucket):
+        code = self.mapping.get(bucket.key)
+        if code is not None:
+            bucket.bytecode_from_string(code)
+
+    def dump_bytecode(self, bucket):
+        self.mapping[bucket.key] = bucket.bytecode_to_string()
+
+    def clear(self):
+        self.mapping.clear()
+
+
+class MemcachedBytecodeCache(BytecodeCache):
+    """This class implements a bytecode cache that uses a memcache cache for
+    storing the information.  It does not enforce a specific memcache
+    library, the client just has to provide the following minimal
+    interface::
+
+        class MinimalClientInterface(object):
+
+            def set(self, key, value, timeout=None):
+                \"""Stores the bytecode in the cache.  `value` is a string
+                and `timeout` the timeout of the key.  If timeout is not
+                provided a default timeout or no timeout should be assumed,
+                if it's provided it's an integer with the number of seconds
+                the cache item should exist.\"""
+
+            def get(self, key):
+                \"""Returns the value for the cache key.  If the item does
+                not exist in the cache the return value must be `None`.\"""
+
+    Both App Engine's ``google.appengine.api.memcache`` module and the
+    python-memcached client fit, so the bytecode is shared by every
+    instance and a cold process only pays for unmarshalling.
+
+    The other arguments to the constructor are the prefix for all keys that
+    is added before the actual cache key and the timeout for the bytecode
+    in the cache system.  We recommend a high (or no, the default) timeout.
+    """
+
+    def __init__(self, client, prefix='jinja2/bytecode/', timeout=None):
+        self.client = client
+        self.prefix = prefix
+        self.timeout = timeout
+
+    def load_bytecode(self, bucket):
+        code = self.client.get(self.prefix + bucket.key)
+        if code is not None:
+            bucket.bytecode_from_string(code)
+
+    def dump_bytecode(self, bucket):
+        args = (self.prefix + bucket.key, bucket.bytecode_to_string())
+        if self.timeout is not None:
+            args += (self.timeout,)
+        self.client.set(*args)
@@ -37,11 +37,16 @@ else:
     have_condexpr = True
 
 
-def generate(node, environment, name, filename, stream=None):
-    """Generate the python source for a node tree."""
+def generate(node, environment, name, filename, stream=None,
+             defer_init=False):
+    """Generate the python source for a node tree.  If `defer_init` is
+    true the render functions look up `environment` in the module globals
+    at call time instead of binding it when the module is executed, so the
+    code can be imported as a regular module.
+    """
     if not isinstance(node, nodes.Template):
         raise TypeError('Can\'t compile non template nodes')
-    generator = CodeGenerator(environment, name, filename, stream)
+    generator = CodeGenerator(environment, name, filename, stream, defer_init)
     generator.visit(node)
     if stream is None:
         return generator.stream.getvalue()
@@ -299,13 +304,15 @@ class CompilerExit(Exception):
 
 class CodeGenerator(NodeVisitor):
 
-    def __init__(self, environment, name, filename, stream=None):
+    def __init__(self, environment, name, filename, stream=None,
+                 defer_init=False):
         if stream is None:
             stream = StringIO()
         self.environment = environment
         self.name = name
         self.filename = filename
         self.stream = stream
+        self.defer_init = defer_init
 
         # aliases for imports
         self.import_aliases = {}
@@ -656,7 +663,8 @@ class CodeGenerator(NodeVisitor):
         self.writeline('name = %r' % self.name)
 
         # generate the root render function.
-        self.writeline('def root(context, environment=environment):', extra=1)
+        envenv = not self.defer_init and ', environment=environment' or ''
+        self.writeline('def root(context%s):' % envenv, extra=1)
 
         # process the root
         frame = Frame()
@@ -690,8 +698,8 @@ class CodeGenerator(NodeVisitor):
             block_frame = Frame()
             block_frame.inspect(block.body)
             block_frame.block = name
-            self.writeline('def block_%s(context, environment=environment):'
-                           % name, block, 1)
+            self.writeline('def block_%s(context%s):' % (name, envenv),
+                           block, 1)
             self.indent()
             undeclared = find_undeclared(block.body, ('self', 'super'))
             if 'self' in undeclared:
@@ -1046,21 +1054,27 @@ class CodeGenerator(NodeVisitor):
             outdent_later = True
 
         # try to evaluate as many chunks as possible into a static
-        # string at compile time.
+        # string at compile time.  Conditional expressions choosing between
+        # constants become a choice between static strings, which are
+        # written without escaping or converting them at runtime.
         body = []
+        static = set()
         for child in node.nodes:
             try:
-                const = child.as_const()
+                const = self.output_const(child.as_const())
             except nodes.Impossible:
+                if isinstance(child, nodes.CondExpr) and \
+                   self.environment.finalize is None:
+                    try:
+                        child = nodes.CondExpr(child.test, *[
+                            nodes.Const(self.output_const(x.as_const()))
+                            for x in (child.expr1, child.expr2)
+                        ]).set_lineno(child.lineno)
+                        static.add(id(child))
+                    except:
+                        pass
                 body.append(child)
                 continue
-            try:
-                if self.environment.autoescape:
-                    if hasattr(const, '__html__'):
-                        const = const.__html__()
-                    else:
-                        const = escape(const)
-                const = unicode(const)
             except:
                 # if something goes wrong here we evaluate the node
                 # at runtime for easier debugging
@@ -1071,8 +1085,9 @@ class CodeGenerator(NodeVisitor):
             else:
                 body.append([const])
 
-        # if we have less than 3 nodes or a buffer we yield or extend/append
-        if len(body) < 3 or frame.buffer is not None:
+        # a single node or a buffer is yielded or extended/appended directly,
+        # anything longer is joined into one string to save generator steps
+        if len(body) < 2 or frame.buffer is not None:
             if frame.buffer is not None:
                 # for one item we append, for more we extend
                 if len(body) == 1:
@@ -1092,6 +1107,11 @@ class CodeGenerator(NodeVisitor):
                         self.writeline('yield ', item)
                     else:
                         self.newline(item)
+                    if id(item) in static:
+                        self.visit(item, frame)
+                        if frame.buffer is not None:
+                            self.write(', ')
+                        continue
                     close = 1
                     if self.environment.autoescape:
                         self.write('escape(')
@@ -1109,37 +1129,48 @@ class CodeGenerator(NodeVisitor):
                 self.outdent()
                 self.writeline(len(body) == 1 and ')' or '))')
 
-        # otherwise we create a format string as this is faster in that case
+        # otherwise the chunks are joined in one go.  This is faster than a
+        # format string, which is scanned on every call, with long template
+        # data in particular.
         else:
-            format = []
-            arguments = []
+            self.writeline('yield concat((')
+            self.indent()
             for item in body:
                 if isinstance(item, list):
-                    format.append(concat(item).replace('%', '%%'))
-                else:
-                    format.append('%s')
-                    arguments.append(item)
-            self.writeline('yield ')
-            self.write(repr(concat(format)) + ' % (')
-            idx = -1
-            self.indent()
-            for argument in arguments:
-                self.newline(argument)
-                close = 0
+                    self.writeline(repr(concat(item)) + ', ')
+                    continue
+                self.newline(item)
+                if id(item) in static:
+                    self.visit(item, frame)
+                    self.write(', ')
+                    continue
+                close = 1
                 if self.environment.autoescape:
                     self.write('escape(')
-                    close += 1
+                else:
+                    self.write('unicode(')
                 if self.environment.finalize is not None:
                     self.write('environment.finalize(')
                     close += 1
-                self.visit(argument, frame)
+                self.visit(item, frame)
                 self.write(')' * close + ', ')
             self.outdent()
-            self.writeline(')')
+            self.writeline('))')
 
         if outdent_later:
             self.outdent()
 
+    def output_const(self, const):
+        """Convert a constant to the unicode string an output statement
+        would write for it.
+        """
+        if self.environment.autoescape:
+            if hasattr(const, '__html__'):
+                const = const.__html__()
+            else:
+                const = escape(const)
+        return unicode(const)
+
     def visit_Assign(self, node, frame):
         self.newline(node)
         # toplevel assignments however go into the local namespace and
@@ -8,6 +8,7 @@
     :copyright: 2008 by Armin Ronacher.
     :license: BSD, see LICENSE for more details.
 """
+import os
 import sys
 from jinja2.defaults import *
 from jinja2.lexer import Lexer
@@ -39,6 +40,15 @@ def get_spontaneous_environment(*args):
     return env
 
 
+def write_file(filename, data):
+    """Write `data` to `filename`, replacing whatever was there."""
+    f = file(filename, 'wb')
+    try:
+        f.write(data)
+    finally:
+        f.close()
+
+
 def create_cache(size):
     """Return the cache class for the given size."""
     if size == 0:
@@ -153,6 +163,12 @@ class Environment(object):
             requested the loader checks if the source changed and if yes, it
             will reload the template.  For higher performance it's possible to
             disable that.
+
+        `bytecode_cache`
+            If set to a bytecode cache object, this object will provide a
+            cache for the internal Jinja bytecode so that templates don't
+            have to be parsed if they were not changed.  See
+            :mod:`jinja2.bccache` for the available backends.
     """
 
     #: if this environment is sandboxed.  Modifying this variable won't make
@@ -187,7 +203,8 @@ class Environment(object):
                  autoescape=False,
                  loader=None,
                  cache_size=50,
-                 auto_reload=True):
+                 auto_reload=True,
+                 bytecode_cache=None):
         # !!Important notice!!
         #   The constructor accepts quite a few arguments that should be
         #   passed by keyword rather than position.  However it's important to
@@ -225,6 +242,7 @@ class Environment(object):
         self.loader = loader
         self.cache = create_cache(cache_size)
         self.auto_reload = auto_reload
+        self.bytecode_cache = bytecode_cache
 
         # load extensions
         self.extensions = load_extensions(self, extensions)
@@ -246,7 +264,8 @@ class Environment(object):
                 line_statement_prefix=missing, trim_blocks=missing,
                 extensions=missing, optimized=missing, undefined=missing,
                 finalize=missing, autoescape=missing, loader=missing,
-                cache_size=missing, auto_reload=missing):
+                cache_size=missing, auto_reload=missing,
+                bytecode_cache=missing):
         """Create a new overlay environment that shares all the data with the
         current environment except of cache and the overriden attributes.
         Extensions cannot be removed for a overlayed environment.  A overlayed
@@ -281,6 +300,19 @@ class Environment(object):
 
         return _environment_sanity_check(rv)
 
+    @property
+    def compile_options(self):
+        """The options that change the code generated for a template.  Used
+        by the bytecode cache so differently configured environments never
+        share bytecode.
+        """
+        return (self.block_start_string, self.block_end_string,
+                self.variable_start_string, self.variable_end_string,
+                self.comment_start_string, self.comment_end_string,
+                self.line_statement_prefix, self.trim_blocks,
+                self.newline_sequence, self.optimized, bool(self.autoescape),
+                self.finalize is not None, tuple(sorted(self.extensions)))
+
     @property
     def lexer(self):
         """Return a fresh lexer for the environment."""
@@ -329,7 +361,8 @@ class Environment(object):
         """
         return self.lexer.tokeniter(source, name, filename)
 
-    def compile(self, source, name=None, filename=None, raw=False):
+    def compile(self, source, name=None, filename=None, raw=False,
+                defer_init=False):
         """Compile a node or template source code.  The `name` parameter is
         the load name of the template after it was joined using
         :meth:`join_path` if necessary, not the filename on the file system.
@@ -341,12 +374,15 @@ class Environment(object):
         parameter is `True` the return value will be a string with python
         code equivalent to the bytecode returned otherwise.  This method is
         mainly used internally.
+
+        `defer_init` is passed to the code generator, see
+        :meth:`compile_templates`.
         """
         if isinstance(source, basestring):
             source = self.parse(source, name, filename)
         if self.optimized:
-            node = optimize(source, self)
-        source = generate(node, self, name, filename)
+            source = optimize(source, self)
+        source = generate(source, self, name, filename, defer_init=defer_init)
         if raw:
             return source
         if filename is None:
@@ -355,6 +391,43 @@ class Environment(object):
             filename = filename.encode('utf-8')
         return compile(source, filename, 'exec')
 
+    def compile_templates(self, target, filter_func=None):
+        """Compile every template the loader knows about into a package of
+        python modules in the `target` directory, to be loaded with a
+        :class:`~jinja2.loaders.ModuleLoader`.  Templates loaded that way are
+        never lexed, parsed or compiled at runtime, importing the module is
+        all it takes.
+
+        `filter_func` can be passed a template name and return `False` to
+        skip that template.  Modules left over from templates that no longer
+        exist are removed.  Returns the list of compiled template names.
+        """
+        from jinja2.loaders import ModuleLoader
+        if self.loader is None:
+            raise TypeError('no loader for this environment specified')
+        if not os.path.isdir(target):
+            os.makedirs(target)
+        for filename in os.listdir(target):
+            if filename.startswith('tmpl_'):
+                os.remove(os.path.join(target, filename))
+        write_file(os.path.join(target, '__init__.py'),
+                   '# templates precompiled by jinja2, do not edit\n')
+
+        compiled = []
+        for name in self.loader.list_templates():
+            if filter_func is not None and not filter_func(name):
+                continue
+            source, filename, uptodate = self.loader.get_source(self, name)
+            code = self.compile(source, name, filename, raw=True,
+                                defer_init=True)
+            # appended so the line numbers of the debug info still match
+            code += '\nfilename = %r\ncompile_options = %r\n' % \
+                    (filename, self.compile_options)
+            key = ModuleLoader.get_template_key(name)
+            write_file(os.path.join(target, key + '.py'), code)
+            compiled.append(name)
+        return compiled
+
     def join_path(self, template, parent):
         """Join a template with the parent.  By default all the lookups are
         relative to the loader root so this method returns the `template`
@@ -475,21 +548,41 @@ class Template(object):
             '__jinja_template__':   t
         }
         exec code in namespace
-        t.environment = environment
-        t.globals = globals
-        t.name = namespace['name']
-        t.filename = code.co_filename
-        t.blocks = namespace['blocks']
+        return t._from_namespace(environment, namespace, globals,
+                                 code.co_filename, uptodate)
+
+    @classmethod
+    def from_module_dict(cls, environment, module_dict, globals,
+                         uptodate=None):
+        """Creates a template object from the namespace of a module written
+        by :meth:`Environment.compile_templates`.  The module is bound to
+        `environment`, so it must not be shared by differently configured
+        environments.
+        """
+        t = object.__new__(cls)
+        module_dict['environment'] = environment
+        module_dict['__jinja_template__'] = t
+        return t._from_namespace(environment, module_dict, globals,
+                                 module_dict.get('filename') or
+                                 module_dict.get('__file__'), uptodate)
+
+    def _from_namespace(self, environment, namespace, globals, filename,
+                        uptodate):
+        self.environment = environment
+        self.globals = globals
+        self.name = namespace['name']
+        self.filename = filename
+        self.blocks = namespace['blocks']
 
         # render function and module 
-        t.root_render_func = namespace['root']
-        t._module = None
+        self.root_render_func = namespace['root']
+        self._module = None
 
         # debug and loader helpers
-        t._debug_info = namespace['debug_info']
-        t._uptodate = uptodate
+        self._debug_info = namespace['debug_info']
+        self._uptodate = uptodate
 
-        return t
+        return self
 
     def render(self, *args, **kwargs):
         """This method accepts the same arguments as the `dict` constructor:
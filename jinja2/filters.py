@@ -42,6 +42,15 @@ def environmentfilter(f):
     return f
 
 
+def impurefilter(f):
+    """Decorator for marking filters whose result does not only depend on
+    their arguments, such as ``random``.  The optimizer never evaluates them
+    at compile time.
+    """
+    f.impurefilter = True
+    return f
+
+
 def do_forceescape(value):
     """Enforce HTML escaping.  This will probably double escape variables."""
     if hasattr(value, '__html__'):
@@ -255,6 +264,7 @@ def do_last(environment, seq):
         return environment.undefined('No last item, sequence was empty.')
 
 
+@impurefilter
 @environmentfilter
 def do_random(environment, seq):
     """Return a random item from the sequence."""
@@ -8,12 +8,47 @@
     :copyright: 2008 by Armin Ronacher.
     :license: BSD, see LICENSE for more details.
 """
-from os import path
+import time
+from os import path, walk
+try:
+    from hashlib import sha1
+except ImportError:
+    from sha import new as sha1
 from jinja2.exceptions import TemplateNotFound
 from jinja2.utils import LRUCache
 
 import logging
 
+def load_manifest(filename):
+    """Read a manifest written by :func:`dump_manifest` and return it as
+    dict of checksums by template name.
+    """
+    manifest = {}
+    f = file(filename)
+    try:
+        for line in f:
+            line = line.rstrip('\r\n')
+            if line:
+                checksum, template = line.split('  ', 1)
+                manifest[template.decode('utf-8')] = checksum
+    finally:
+        f.close()
+    return manifest
+
+
+def dump_manifest(manifest, filename):
+    """Write a manifest as returned by :meth:`FileSystemLoader.build_manifest`
+    in the format of ``sha1sum``, one template per line.
+    """
+    f = file(filename, 'w')
+    try:
+        for template in sorted(manifest):
+            f.write('%s  %s\n' % (manifest[template],
+                                  template.encode('utf-8')))
+    finally:
+        f.close()
+
+
 def split_template_path(template):
     """Split a path into segments and perform a sanity check.  If it detects
     '..' in the path it will raise a `TemplateNotFound` error.
@@ -77,9 +112,24 @@ class BaseLoader(object):
         """
         raise TemplateNotFound(template)
 
+    def get_source_checksum(self, environment, template):
+        """Return the checksum of the template source if the loader knows it
+        without reading the source, otherwise `None`.  Bytecode caches use it
+        instead of hashing the source on every load.
+        """
+        return None
+
+    def list_templates(self):
+        """Iterates over all templates.  If the loader does not support that
+        it should raise a :exc:`TypeError` which is the default behavior.
+        """
+        raise TypeError('this loader cannot iterate over all templates')
+
     def load(self, environment, name, globals=None):
         """Loads a template.  This method looks up the template in the cache
-        or loads one by calling :meth:`get_source`.  Subclasses should not
+        or loads one by calling :meth:`get_source`.  If the environment has a
+        bytecode cache the compiled code is taken from there as long as the
+        source did not change.  Subclasses should not
         override this method as loaders working on collections of other
         loaders (such as :class:`PrefixLoader` or :class:`ChoiceLoader`)
         will not call this method but `get_source` directly.
@@ -87,7 +137,25 @@ class BaseLoader(object):
         if globals is None:
             globals = {}
         source, filename, uptodate = self.get_source(environment, name)
-        code = environment.compile(source, name, filename)
+
+        # try to load the code from the bytecode cache if there is a
+        # bytecode cache configured.
+        bcc = environment.bytecode_cache
+        code = None
+        if bcc is not None:
+            checksum = self.get_source_checksum(environment, name)
+            bucket = bcc.get_bucket(environment, name, filename, source,
+                                    checksum)
+            code = bucket.code
+
+        # if we don't have code so far (not cached, no longer up to
+        # date) etc. we compile the template and store it in the cache
+        if code is None:
+            code = environment.compile(source, name, filename)
+            if bcc is not None:
+                bucket.code = code
+                bcc.set_bucket(bucket)
+
         return environment.template_class.from_code(environment, code,
                                                     globals, uptodate)
 
@@ -105,13 +173,29 @@ class FileSystemLoader(BaseLoader):
 
     Per default the template encoding is ``'utf-8'`` which can be changed
     by setting the `encoding` parameter to something else.
+
+    If the environment auto reloads, every use of a cached template checks
+    the modification time of its file.  `check_interval` limits that to one
+    check in so many seconds, and if it is `None` templates are never checked
+    once loaded, which suits deployments where the files cannot change.
+
+    A `manifest` of source checksums by template name, built at deployment
+    with :meth:`build_manifest`, declares the listed templates current: they
+    are never checked and the bytecode cache is keyed by their checksum
+    instead of hashing the source.
+
+    >>> loader = FileSystemLoader('/path/to/templates', check_interval=None,
+    ...                           manifest=load_manifest('templates.sha1'))
     """
 
-    def __init__(self, searchpath, encoding='utf-8'):
+    def __init__(self, searchpath, encoding='utf-8', check_interval=0,
+                 manifest=None):
         if isinstance(searchpath, basestring):
             searchpath = [searchpath]
         self.searchpath = list(searchpath)
         self.encoding = encoding
+        self.check_interval = check_interval
+        self.manifest = manifest or {}
 
     def get_source(self, environment, template):
         pieces = split_template_path(template)
@@ -125,10 +209,51 @@ class FileSystemLoader(BaseLoader):
                 contents = f.read().decode(self.encoding)
             finally:
                 f.close()
-            old = path.getmtime(filename)
-            return contents, filename, lambda: path.getmtime(filename) == old
+            if template in self.manifest or self.check_interval is None:
+                return contents, filename, None
+            return contents, filename, self._uptodate(filename)
         raise TemplateNotFound(template)
 
+    def _uptodate(self, filename):
+        """Return a function telling if `filename` was not modified since,
+        looking at the file at most once per `check_interval`.
+        """
+        old = path.getmtime(filename)
+        interval = self.check_interval
+        if not interval:
+            return lambda: path.getmtime(filename) == old
+        next_check = [time.time() + interval]
+        def uptodate():
+            now = time.time()
+            if now < next_check[0]:
+                return True
+            next_check[0] = now + interval
+            return path.getmtime(filename) == old
+        return uptodate
+
+    def get_source_checksum(self, environment, template):
+        return self.manifest.get(template)
+
+    def build_manifest(self):
+        """Return the checksums of all templates by name, for the `manifest`
+        argument.  Checksums are the same a bytecode cache computes.
+        """
+        manifest = {}
+        for template in self.list_templates():
+            contents = self.get_source(None, template)[0]
+            manifest[template] = sha1(contents.encode('utf-8')).hexdigest()
+        return manifest
+
+    def list_templates(self):
+        found = set()
+        for searchpath in self.searchpath:
+            for dirpath, dirnames, filenames in walk(searchpath):
+                for filename in filenames:
+                    template = path.relpath(path.join(dirpath, filename),
+                                            searchpath)
+                    found.add(template.replace(path.sep, '/'))
+        return sorted(found)
+
 
 class PackageLoader(BaseLoader):
     """Load templates from python eggs or packages.  It is constructed with
@@ -273,3 +398,62 @@ class ChoiceLoader(BaseLoader):
             except TemplateNotFound:
                 pass
         raise TemplateNotFound(template)
+
+
+class ModuleLoader(BaseLoader):
+    """Loads templates precompiled by :meth:`Environment.compile_templates`
+    from a python package, so nothing is lexed, parsed or compiled at
+    runtime:
+
+    >>> loader = ModuleLoader('myapplication.compiled_templates')
+
+    Templates missing from the package, or compiled for an environment
+    configured differently, are loaded with the `fallback` loader if one is
+    given.  As there is no source to check, precompiled templates are never
+    reloaded; rerun the compilation whenever the templates change.
+    """
+
+    def __init__(self, package_name, fallback=None):
+        self.package_name = package_name
+        self.fallback = fallback
+
+    @staticmethod
+    def get_template_key(name):
+        """Return the name of the module holding the template `name`."""
+        return 'tmpl_' + sha1(name.encode('utf-8')).hexdigest()
+
+    def get_module(self, environment, name):
+        """Import the module for the template or return `None` if there is
+        no usable one.
+        """
+        module = '%s.%s' % (self.package_name, self.get_template_key(name))
+        try:
+            mod = __import__(module, None, None, ['root'])
+        except ImportError:
+            return None
+        if getattr(mod, 'compile_options', None) != \
+           environment.compile_options:
+            return None
+        return mod
+
+    def get_source(self, environment, template):
+        if self.fallback is None:
+            raise TemplateNotFound(template)
+        return self.fallback.get_source(environment, template)
+
+    def list_templates(self):
+        if self.fallback is None:
+            return BaseLoader.list_templates(self)
+        return self.fallback.list_templates()
+
+    def load(self, environment, name, globals=None):
+        if globals is None:
+            globals = {}
+        mod = self.get_module(environment, name)
+        if mod is None:
+            if self.fallback is None:
+                raise TemplateNotFound(name)
+            return self.fallback.load(environment, name, globals)
+        return environment.template_class.from_module_dict(environment,
+                                                           mod.__dict__,
+                                                           globals)
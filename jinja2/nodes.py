@@ -515,11 +515,12 @@ class Filter(Expr):
         if self.node is obj is None:
             raise Impossible()
         filter = self.environment.filters.get(self.name)
-        if filter is None or getattr(filter, 'contextfilter', False):
+        if filter is None or getattr(filter, 'contextfilter', False) or \
+           getattr(filter, 'impurefilter', False):
             raise Impossible()
         if obj is None:
             obj = self.node.as_const()
-        args = [x.as_const() for x in self.args]
+        args = [obj] + [x.as_const() for x in self.args]
         if getattr(filter, 'environmentfilter', False):
             args.insert(0, self.environment)
         kwargs = dict(x.as_const() for x in self.kwargs)
@@ -534,7 +535,7 @@ class Filter(Expr):
             except:
                 raise Impossible()
         try:
-            return filter(obj, *args, **kwargs)
+            return filter(*args, **kwargs)
         except:
             raise Impossible()
 
@@ -545,6 +546,28 @@ class Test(Expr):
     """
     fields = ('node', 'name', 'args', 'kwargs', 'dyn_args', 'dyn_kwargs')
 
+    def as_const(self):
+        test = self.environment.tests.get(self.name)
+        if test is None:
+            raise Impossible()
+        obj = self.node.as_const()
+        args = [x.as_const() for x in self.args]
+        kwargs = dict(x.as_const() for x in self.kwargs)
+        if self.dyn_args is not None:
+            try:
+                args.extend(self.dyn_args.as_const())
+            except:
+                raise Impossible()
+        if self.dyn_kwargs is not None:
+            try:
+                kwargs.update(self.dyn_kwargs.as_const())
+            except:
+                raise Impossible()
+        try:
+            return test(obj, *args, **kwargs)
+        except:
+            raise Impossible()
+
 
 class Call(Expr):
     """Calls an expression.  `args` is a list of arguments, `kwargs` a list
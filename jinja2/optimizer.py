@@ -5,6 +5,10 @@
 
     The jinja optimizer is currently trying to constant fold a few expressions
     and modify the AST in place so that it should be easier to evaluate it.
+    Pure filters and tests on constants are evaluated at compile time, `if`
+    statements and expressions over constants lose their dead branches and
+    neighbouring output statements are merged so that the compiler can
+    write them as a single yield.
 
     Because the AST does not contain all the scoping information and the
     compiler has to find that out, we cannot do all the optimizations we
@@ -27,11 +31,32 @@ def optimize(node, environment):
     return optimizer.visit(node)
 
 
+def merge_output(body):
+    """Merge neighbouring :class:`~jinja2.nodes.Output` nodes of a list of
+    statements in place.
+    """
+    result = []
+    for node in body:
+        if isinstance(node, nodes.Output) and result and \
+           isinstance(result[-1], nodes.Output):
+            result[-1].nodes.extend(node.nodes)
+        else:
+            result.append(node)
+    body[:] = result
+
+
 class Optimizer(NodeTransformer):
 
     def __init__(self, environment):
         self.environment = environment
 
+    def generic_visit(self, node, *args, **kwargs):
+        node = NodeTransformer.generic_visit(self, node, *args, **kwargs)
+        for field, value in node.iter_fields():
+            if isinstance(value, list):
+                merge_output(value)
+        return node
+
     def visit_If(self, node):
         """Eliminate dead code."""
         # do not optimize ifs that have a block inside so that it doesn't
@@ -41,7 +66,7 @@ class Optimizer(NodeTransformer):
         try:
             val = self.visit(node.test).as_const()
         except nodes.Impossible:
-            return self.generic_visit(node)
+            return self.inline_if(self.generic_visit(node))
         if val:
             body = node.body
         else:
@@ -51,6 +76,41 @@ class Optimizer(NodeTransformer):
             result.extend(self.visit_list(node))
         return result
 
+    def inline_if(self, node):
+        """Turn an `if` statement that does nothing but output one node into
+        an output of a conditional expression, so it can be merged with the
+        output around it.
+        """
+        if self.environment.finalize is not None:
+            return node
+        branches = []
+        for body in node.body, node.else_:
+            if not body:
+                branches.append(nodes.Const(u'', lineno=node.lineno,
+                                            environment=self.environment))
+                continue
+            # several nodes would have to be concatenated, which does not
+            # escape them the way output does
+            if len(body) > 1 or not isinstance(body[0], nodes.Output) or \
+               len(body[0].nodes) != 1:
+                return node
+            branches.append(body[0].nodes[0])
+        expr = nodes.CondExpr(node.test, branches[0], branches[1],
+                              lineno=node.lineno,
+                              environment=self.environment)
+        return nodes.Output([expr], lineno=node.lineno,
+                            environment=self.environment)
+
+    def visit_CondExpr(self, node):
+        """Eliminate the dead branch of a conditional expression."""
+        try:
+            val = self.visit(node.test).as_const()
+        except nodes.Impossible:
+            return self.fold(node)
+        if val:
+            return self.visit(node.expr1)
+        return self.visit(node.expr2)
+
     def fold(self, node):
         """Do constant folding."""
         node = self.generic_visit(node)
@@ -64,5 +124,4 @@ class Optimizer(NodeTransformer):
     visit_Add = visit_Sub = visit_Mul = visit_Div = visit_FloorDiv = \
     visit_Pow = visit_Mod = visit_And = visit_Or = visit_Pos = visit_Neg = \
     visit_Not = visit_Compare = visit_Subscript = visit_Call = \
-    visit_Filter = visit_Test = visit_CondExpr = fold
-    del fold
+    visit_Filter = visit_Test = fold
@@ -29,14 +29,15 @@ def markup_join(seq):
     iterator = imap(soft_unicode, seq)
     for arg in iterator:
         buf.append(arg)
-        if hasattr(arg, '__html__'):
+        # plain unicode strings cannot have __html__, spare the lookup
+        if type(arg) is not unicode and hasattr(arg, '__html__'):
             return Markup(u'').join(chain(buf, iterator))
     return concat(buf)
 
 
 def unicode_join(seq):
     """Simple args to unicode conversion and concatenation."""
-    return concat(imap(unicode, seq))
+    return concat(map(unicode, seq))
 
 
 class Context(object):
@@ -621,20 +621,36 @@ except ImportError:
 try:
     from jinja2._speedups import escape, soft_unicode
 except ImportError:
+    _new_markup = unicode.__new__
+
     def escape(s):
         """Convert the characters &, <, >, ' and " in string s to HTML-safe
         sequences.  Use this if you need to display text that might contain
         such characters in HTML.  Marks return value as markup string.
         """
+        # the common cases are tested by exact type first as hasattr is
+        # slow for objects without __html__, and strings without anything
+        # to escape are found by searching for every character, which is
+        # faster than a regular expression or unicode.translate
+        t = type(s)
+        if t is Markup:
+            return s
+        if t is unicode or t is str:
+            if '&' not in s and '<' not in s and '>' not in s and \
+               "'" not in s and '"' not in s:
+                return _new_markup(Markup, s)
+            return _new_markup(Markup, s
+                .replace('&', '&amp;')
+                .replace('>', '&gt;')
+                .replace('<', '&lt;')
+                .replace("'", '&#39;')
+                .replace('"', '&#34;')
+            )
+        if t is int or t is long:
+            return _new_markup(Markup, str(s))
         if hasattr(s, '__html__'):
             return s.__html__()
-        return Markup(unicode(s)
-            .replace('&', '&amp;')
-            .replace('>', '&gt;')
-            .replace('<', '&lt;')
-            .replace("'", '&#39;')
-            .replace('"', '&#34;')
-        )
+        return escape(unicode(s))
 
     def soft_unicode(s):
         """Make a string unicode if it isn't already.  That way a markup
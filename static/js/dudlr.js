@@ -76,6 +76,50 @@
             upload(format, data, w, h);
         },
 
+        /*
+         * Upload greyscale pixel data as an application/octet-stream body
+         * to /json/dudles/updateBinary.  Browsers that can send typed
+         * arrays post the raw bytes; older ones fall back to base64.
+         */
+        saveBinary: function(id, callback) {
+            var w = this.cvs_elm[0].width;
+            var h = this.cvs_elm[0].height;
+            var pixels = this.ctx.getImageData(0,0,w,h).data;
+            var data = this._packPixelData_L(pixels, w, h);
+            var encoding = (typeof(Uint8Array) != 'undefined') ? 'raw' : 'base64';
+            if (encoding == 'base64') {
+                data = window.btoa(data);
+            }
+            var xhr = new XMLHttpRequest();
+            xhr.open('POST', '/json/dudles/updateBinary?id=' + id +
+                '&format=L&width=' + w + '&height=' + h +
+                '&encoding=' + encoding, true);
+            xhr.setRequestHeader('Content-Type', 'application/octet-stream');
+            xhr.onreadystatechange = function() {
+                if (xhr.readyState == 4 && callback) {
+                    callback(xhr.status == 200);
+                }
+            };
+            xhr.send(data);
+        },
+
+        _packPixelData_L: function(pixels, w, h) {
+            var n = w * h;
+            var i, data;
+            if (typeof(Uint8Array) != 'undefined') {
+                data = new Uint8Array(n);
+                for (i = 0; i < n; i++) {
+                    data[i] = pixels[i << 2];
+                }
+                return data;
+            }
+            data = [];
+            for (i = 0; i < n; i++) {
+                data.push(String.fromCharCode(pixels[i << 2]));
+            }
+            return data.join('');
+        },
+
         setUpWidget: function(widget) {
 
             var close = function (widget, f) {
@@ -203,6 +247,17 @@
         }
     };
     
+    var RECORD_MOVE = 1, RECORD_POINT = 2, RECORD_STYLE = 3, RECORD_FILL = 4;
+
+    var RecordBuffer = window.Int16Array || Array;
+
+    /*
+     * Records strokes as they are drawn into a typed array of commands,
+     * three slots each (opcode and two arguments), rather than by
+     * growing a string.  take() encodes the oldest commands to the text
+     * stroke format and drops them, so the buffer only holds what has
+     * not been handed to the uploader yet.
+     */
     var DudlrStrokeRecorder = function () {
         return this.__init__();
     };
@@ -210,43 +265,118 @@
     DudlrStrokeRecorder.prototype = {
         __init__: function() {
             this.stack = [];
-            this.recorded = "";
             this.last_command = null;
+            this._buf = new RecordBuffer(3 * 1024);
+            this._start = 0;
+            this._end = 0;
+            this._chars = 0;
+            this._inLine = false;
         },
         lineTo: function(x, y) {
-            //if (!this._inbounds(x, y)) {
-            //    return;
-            //}
-            //var stack = this.stack;
             this._popStack();
-            if (this.last_command != 'l') {
-                this.last_command = 'l';
-                //stack.push('l');
-                this.recorded += 'l';
-            }
-            //stack.push(x);
-            //stack.push(y);
-            this.recorded += this._pad(x) + this._pad(y);
+            this.last_command = 'l';
+            this._push(RECORD_POINT, x, y);
         },
         moveTo: function(x, y) {
-            //if (!this._inbounds(x, y)) {
-            //    return;
-            //}
             this._popStack();
-            this.recorded += 'm' + this._pad(x) + this._pad(y);
+            this._push(RECORD_MOVE, x, y);
             this.last_command = 'm';
         },
         fillStyle: function(mode) {
-            this.stack.push('s' + mode);
+            this.stack.push(mode);
             this.last_command = 's';
         },
         fill: function() {
             this.last_command = 'f';
-            this.recorded += 'f';
+            this._push(RECORD_FILL, 0, 0);
+        },
+
+        /*
+         * About how many characters of text are waiting to be taken.
+         */
+        pending: function() {
+            return this._chars;
+        },
+
+        /*
+         * Encode and drop the oldest commands, up to maxChars characters
+         * of text (but at least one command).  Returns '' if there is
+         * nothing to take.
+         */
+        take: function(maxChars) {
+            var buf = this._buf;
+            var out = [];
+            var size = 0;
+            var i = this._start;
+            while (i < this._end) {
+                var op = buf[i], text;
+                if (op == RECORD_POINT) {
+                    text = this._pad(buf[i + 1]) + this._pad(buf[i + 2]);
+                    if (!this._inLine) {
+                        text = 'l' + text;
+                    }
+                } else if (op == RECORD_MOVE) {
+                    text = 'm' + this._pad(buf[i + 1]) + this._pad(buf[i + 2]);
+                } else if (op == RECORD_STYLE) {
+                    text = 's' + buf[i + 1];
+                } else {
+                    text = 'f';
+                }
+                if (out.length && size + text.length > maxChars) {
+                    break;
+                }
+                this._inLine = op == RECORD_POINT;
+                out.push(text);
+                size += text.length;
+                i += 3;
+            }
+            this._start = i;
+            this._chars -= size;
+            if (this._start == this._end) {
+                this._start = this._end = this._chars = 0;
+            }
+            return out.join('');
         },
+
+        _push: function(op, a, b) {
+            if (this._end + 3 > this._buf.length) {
+                this._grow();
+            }
+            var buf = this._buf;
+            var i = this._end;
+            buf[i] = op;
+            buf[i + 1] = a;
+            buf[i + 2] = b;
+            this._end = i + 3;
+            // what take() will make of it
+            if (op == RECORD_POINT) {
+                var last = i > this._start ? buf[i - 3] :
+                                             (this._inLine && RECORD_POINT);
+                this._chars += last == RECORD_POINT ? 6 : 7;
+            } else {
+                this._chars += op == RECORD_MOVE ? 7 : (op == RECORD_STYLE ? 2 : 1);
+            }
+        },
+
+        _grow: function() {
+            // drop what has been taken, and double if still over half full
+            var used = this._end - this._start;
+            var size = this._buf.length;
+            if (2 * (used + 3) > size) {
+                size *= 2;
+            }
+            var buf = new RecordBuffer(size);
+            for (var i = 0; i < used; i++) {
+                buf[i] = this._buf[this._start + i];
+            }
+            this._buf = buf;
+            this._start = 0;
+            this._end = used;
+        },
+
         _popStack: function() {
             if (this.stack.length) {
-                this.recorded += this.stack[this.stack.length - 1];
+                this._push(RECORD_STYLE, this.stack[this.stack.length - 1], 0);
                 this.stack = [];
             }
         },
@@ -274,6 +404,531 @@
         }
     };
 
+    /*
+     * Uploads stroke data in fixed-size, sequence-numbered chunks to
+     * /json/dudles/appendStrokes and then asks the server to assemble
+     * them.  Failed chunks are retried with backoff, and chunks the
+     * server reports missing at finalize time are resent.
+     *
+     * Chunks can be sent all at once with upload(), or appended one by
+     * one as they are recorded with append() and finalized with
+     * finish().  Appended chunks are sent one at a time in the
+     * background.
+     */
+    var DudlrStrokeUploader = function(id, token, opts) {
+        return this.__init__(id, token, opts);
+    };
+
+    DudlrStrokeUploader.prototype = {
+        __init__: function(id, token, opts) {
+            opts = opts || {};
+            this.id = id;
+            this.token = token;
+            this.chunkSize = opts.chunkSize || 16384;
+            this.retries = opts.retries || 3;
+            this.chunks = [];
+            this._queue = [];
+            this._failed = [];
+            this._sending = false;
+            this._drained = [];
+        },
+
+        append: function(data) {
+            this._queue.push(this.chunks.length);
+            this.chunks.push(data);
+            this._pump();
+        },
+
+        /*
+         * Whether appended chunks are still waiting to be sent.
+         */
+        busy: function() {
+            return this._sending || this._queue.length > 0;
+        },
+
+        /*
+         * Finalize once every appended chunk has been sent.  Chunks that
+         * failed in the background are resent first; if they fail again
+         * the callback is told so.
+         */
+        finish: function(params, callback) {
+            var o = this;
+            this._drained.push(function() {
+                var failed = o._failed;
+                o._failed = [];
+                o._sendAll(failed, params, o.retries, callback);
+            });
+            this._pump();
+        },
+
+        _pump: function() {
+            var o = this;
+            if (this._sending) {
+                return;
+            }
+            if (!this._queue.length) {
+                var drained = this._drained;
+                this._drained = [];
+                for (var i = 0; i < drained.length; i++) {
+                    drained[i]();
+                }
+                return;
+            }
+            this._sending = true;
+            var seq = this._queue.shift();
+            this._send(seq, this.retries, function(ok) {
+                o._sending = false;
+                if (!ok) {
+                    o._failed.push(seq);
+                }
+                o._pump();
+            });
+        },
+
+        upload: function(data, params, callback) {
+            var seqs = [];
+            for (var i = 0; i < data.length; i += this.chunkSize) {
+                seqs.push(this.chunks.length);
+                this.chunks.push(data.substring(i, i + this.chunkSize));
+            }
+            this._sendAll(seqs, params, this.retries, callback);
+        },
+
+        _sendAll: function(seqs, params, attempts, callback) {
+            var o = this;
+            if (!seqs.length) {
+                this._finalize(params, attempts, callback);
+                return;
+            }
+            this._send(seqs[0], this.retries, function(ok) {
+                if (ok) {
+                    o._sendAll(seqs.slice(1), params, attempts, callback);
+                } else {
+                    callback(false);
+                }
+            });
+        },
+
+        _send: function(seq, retries, callback) {
+            var o = this;
+            $.ajax({
+                type: 'POST',
+                url: '/json/dudles/appendStrokes',
+                dataType: 'json',
+                data: {id: this.id, token: this.token, seq: seq,
+                       data: this.chunks[seq]},
+                success: function() { callback(true); },
+                error: function(xhr) {
+                    // 400: the upload is closed, resending will not help
+                    if (retries <= 0 || xhr.status == 400) {
+                        callback(false);
+                        return;
+                    }
+                    var delay = 500 * (o.retries - retries + 1);
+                    window.setTimeout(function() {
+                        o._send(seq, retries - 1, callback);
+                    }, delay);
+                }
+            });
+        },
+
+        _finalize: function(params, attempts, callback) {
+            var o = this;
+            var data = $.extend({id: this.id, token: this.token,
+                                 count: this.chunks.length}, params);
+            $.post('/json/dudles/finalizeStrokes', data, function(json) {
+                if (json.status == 'ok') {
+                    callback(true);
+                } else if (json.missing && attempts > 0) {
+                    o._sendAll(json.missing, params, attempts - 1, callback);
+                } else {
+                    callback(false);
+                }
+            }, 'json');
+        }
+    };
+
+    /*
+     * Sends what a DudlrStrokeRecorder records while the user is still
+     * drawing.  Every interval milliseconds, if at least minChunk
+     * characters are waiting and the previous chunk has gone out, a chunk
+     * of at most chunkSize characters is appended to the dudle, so saving
+     * only has to send the tail and finalize.
+     *
+     * open(callback) is called once, before the first chunk, and must
+     * call callback(id, token) for the dudle to upload to.
+     */
+    var DudlrStrokeStream = function(recorder, open, opts) {
+        return this.__init__(recorder, open, opts);
+    };
+
+    DudlrStrokeStream.prototype = {
+        __init__: function(recorder, open, opts) {
+            var o = this;
+            opts = opts || {};
+            this.recorder = recorder;
+            this.open = open;
+            this.opts = opts;
+            this.chunkSize = opts.chunkSize || 16384;
+            this.minChunk = opts.minChunk || 4096;
+            this.uploader = null;
+            this._waiting = null;
+            this._timer = window.setInterval(function() {
+                o.flush(false);
+            }, opts.interval || 5000);
+        },
+
+        /*
+         * Hand recorded strokes to the uploader: one chunk, if enough is
+         * waiting and the uploader has caught up, or everything if all.
+         */
+        flush: function(all) {
+            var o = this;
+            if (!all && (this.recorder.pending() < this.minChunk ||
+                         (this.uploader && this.uploader.busy()))) {
+                return;
+            }
+            this._withUploader(function(uploader) {
+                do {
+                    var text = o.recorder.take(o.chunkSize);
+                    if (text) {
+                        uploader.append(text);
+                    }
+                } while (all && text);
+            });
+        },
+
+        save: function(params, callback) {
+            this.flush(true);
+            this._withUploader(function(uploader) {
+                uploader.finish(params, callback);
+            });
+        },
+
+        stop: function() {
+            window.clearInterval(this._timer);
+        },
+
+        _withUploader: function(callback) {
+            var o = this;
+            if (this.uploader) {
+                callback(this.uploader);
+                return;
+            }
+            if (this._waiting) {
+                this._waiting.push(callback);
+                return;
+            }
+            this._waiting = [callback];
+            this.open(function(id, token) {
+                var waiting = o._waiting;
+                o.uploader = new DudlrStrokeUploader(id, token, o.opts);
+                o._waiting = null;
+                for (var i = 0; i < waiting.length; i++) {
+                    waiting[i](o.uploader);
+                }
+            });
+        }
+    };
+
+    /*
+     * Decoder for the binary stroke format (see dudlr/strokes.py).
+     * Binary recordings are converted back to the text format the robot
+     * replays.  Only uncompressed blobs can be decoded here; the server
+     * strips the zlib wrapper before sending them.
+     */
+    var DudlrStrokeCodec = {
+        MAGIC: 'DS',
+        VERSION: 1,
+        FLAG_ZLIB: 0x01,
+
+        load: function(recording) {
+            if (recording && recording.encoding == 'base64') {
+                return this.toText(window.atob(recording.data));
+            }
+            return recording || '';
+        },
+
+        /*
+         * Parse text stroke data into commands: ['m', x, y] starting a
+         * stroke, ['p', x, y] for each point of a line, ['s', mode] and
+         * ['f'].  Points without an 'l' before them are read as a line,
+         * as in dudlr.strokes.parse_text.
+         */
+        parse: function(text) {
+            var commands = [];
+            var i = 0, n = text.length, c;
+            while (i < n) {
+                c = text.charAt(i);
+                if (c == 'm') {
+                    commands.push(['m', 1 * text.substring(i + 1, i + 4),
+                                   1 * text.substring(i + 4, i + 7)]);
+                    i += 7;
+                } else if (c == 'l') {
+                    i++;
+                } else if (c == 's') {
+                    commands.push(['s', 1 * text.charAt(i + 1)]);
+                    i += 2;
+                } else if (c == 'f') {
+                    commands.push(['f']);
+                    i++;
+                } else {
+                    commands.push(['p', 1 * text.substring(i, i + 3),
+                                   1 * text.substring(i + 3, i + 6)]);
+                    i += 6;
+                }
+            }
+            return commands;
+        },
+
+        toText: function(bytes) {
+            if (bytes.substring(0, 2) != this.MAGIC) {
+                return bytes;
+            }
+            if (bytes.charCodeAt(2) != this.VERSION ||
+                    (bytes.charCodeAt(3) & this.FLAG_ZLIB)) {
+                throw new Error('unsupported stroke data');
+            }
+            var out = [];
+            var i = 4, n = bytes.length;
+            var lx = 0, ly = 0;
+            var pad = function(v) {
+                if (v < -99) {
+                    v = -99;
+                } else if (v > 999) {
+                    v = 999;
+                }
+                if (v < 0) {
+                    return (v > -10 ? '-0' : '-') + (0 - v);
+                }
+                return (v < 10 ? '00' : (v < 100 ? '0' : '')) + v;
+            };
+            var varint = function() {
+                var result = 0, shift = 0, b;
+                do {
+                    b = bytes.charCodeAt(i++);
+                    result += (b & 0x7f) * Math.pow(2, shift);
+                    shift += 7;
+                } while (b & 0x80);
+                return result;
+            };
+            var svarint = function() {
+                var v = varint();
+                return (v % 2) ? -(v + 1) / 2 : v / 2;
+            };
+            while (i < n) {
+                var op = bytes.charCodeAt(i++);
+                if (op == 1) {
+                    lx += svarint();
+                    ly += svarint();
+                    out.push('m' + pad(lx) + pad(ly));
+                } else if (op == 2) {
+                    var count = varint();
+                    out.push('l');
+                    for (var k = 0; k < count; k++) {
+                        lx += svarint();
+                        ly += svarint();
+                        out.push(pad(lx) + pad(ly));
+                    }
+                } else if (op == 3) {
+                    out.push('s' + bytes.charCodeAt(i++));
+                } else if (op == 4) {
+                    out.push('f');
+                } else {
+                    throw new Error('unknown stroke opcode ' + op);
+                }
+            }
+            return out.join('');
+        }
+    };
+
+    /*
+     * Fetches the strokes of several dudles with one request and keeps
+     * them, so replaying a dudle again costs no request at all.
+     */
+    var DudlrStrokeStore = {
+        url: '/json/dudles/bulkStrokes?format=binary&ids=',
+        batchSize: 50,
+        _strokes: {},
+        _waiting: {},
+
+        /*
+         * Call callback with an object of strokes by id once all of ids
+         * are fetched.  Ids the server does not know map to ''.
+         */
+        get: function(ids, callback) {
+            var store = this;
+            var missing = [];
+            var left = 0;
+            var done = function() {
+                if (--left > 0) {
+                    return;
+                }
+                var result = {};
+                $.each(ids, function(i, id) {
+                    result[id] = store._strokes[id];
+                });
+                callback(result);
+            };
+            $.each(ids, function(i, id) {
+                if (store._strokes[id] !== undefined) {
+                    return;
+                }
+                left++;
+                if (store._waiting[id]) {
+                    store._waiting[id].push(done);
+                } else {
+                    store._waiting[id] = [done];
+                    missing.push(id);
+                }
+            });
+            if (!left) {
+                left = 1;
+                done();
+                return;
+            }
+            for (var i = 0; i < missing.length; i += this.batchSize) {
+                this._fetch(missing.slice(i, i + this.batchSize));
+            }
+        },
+
+        /*
+         * Keep strokes the page came with, an object of strokes by id.
+         */
+        preload: function(strokes) {
+            for (var id in strokes) {
+                this._strokes[id] = strokes[id];
+            }
+        },
+
+        _fetch: function(ids) {
+            var store = this;
+            $.getJSON(this.url + ids.join(','), function(json) {
+                $.each(ids, function(i, id) {
+                    var waiting = store._waiting[id];
+                    store._strokes[id] = json[id] || '';
+                    delete store._waiting[id];
+                    $.each(waiting, function(k, done) {
+                        done();
+                    });
+                });
+            });
+        }
+    };
+
+    var now = (window.performance && window.performance.now) ?
+        function() { return window.performance.now(); } :
+        function() { return new Date().getTime(); };
+
+    var _raf = window.requestAnimationFrame ||
+        window.webkitRequestAnimationFrame ||
+        window.mozRequestAnimationFrame;
+
+    var requestFrame = _raf ?
+        function(callback) { return _raf.call(window, callback); } :
+        function(callback) { return window.setTimeout(callback, 16); };
+
+    /*
+     * Runs the robots replaying dudles, sharing a time budget per
+     * animation frame between them so long dudles never freeze the
+     * page.  Robots whose canvas is scrolled out of view wait until it
+     * comes into view.
+     */
+    var DudlrReplayScheduler = {
+        // milliseconds of replaying per frame, for all robots together
+        budget: 8,
+        _active: [],
+        _hidden: [],
+        _scheduled: false,
+        _watching: false,
+        _revealing: false,
+
+        add: function(robot) {
+            this.remove(robot);
+            if (this.isVisible(robot.domelement)) {
+                this._active.push(robot);
+                this._schedule();
+            } else {
+                this._hidden.push(robot);
+                this._watch();
+            }
+        },
+
+        remove: function(robot) {
+            var lists = [this._active, this._hidden];
+            for (var k = 0; k < lists.length; k++) {
+                for (var i = lists[k].length - 1; i >= 0; i--) {
+                    if (lists[k][i] === robot) {
+                        lists[k].splice(i, 1);
+                    }
+                }
+            }
+        },
+
+        isVisible: function(elm) {
+            if (!elm.getBoundingClientRect) {
+                return true;
+            }
+            var r = elm.getBoundingClientRect();
+            var root = document.documentElement;
+            var h = window.innerHeight || root.clientHeight;
+            var w = window.innerWidth || root.clientWidth;
+            return r.bottom > 0 && r.right > 0 && r.top < h && r.left < w;
+        },
+
+        _schedule: function() {
+            if (!this._scheduled) {
+                var o = this;
+                this._scheduled = true;
+                requestFrame(function() { o._frame(); });
+            }
+        },
+
+        _frame: function() {
+            this._scheduled = false;
+            var active = this._active.slice(0);
+            var deadline = now() + this.budget;
+            for (var i = 0; i < active.length; i++) {
+                // split what is left of the budget between the rest
+                var left = deadline - now();
+                if (left <= 0) {
+                    break;
+                }
+                var robot = active[i];
+                if (robot._step(now() + left / (active.length - i))) {
+                    this.remove(robot);
+                }
+            }
+            if (this._active.length) {
+                this._schedule();
+            }
+        },
+
+        _watch: function() {
+            if (this._watching) {
+                return;
+            }
+            var o = this;
+            var reveal = function() {
+                if (!o._revealing) {
+                    o._revealing = true;
+                    window.setTimeout(function() { o._reveal(); }, 100);
+                }
+            };
+            this._watching = true;
+            $(window).bind('scroll', reveal).bind('resize', reveal);
+        },
+
+        _reveal: function() {
+            this._revealing = false;
+            var hidden = this._hidden.slice(0);
+            for (var i = 0; i < hidden.length; i++) {
+                if (this.isVisible(hidden[i].domelement)) {
+                    this.add(hidden[i]);
+                }
+            }
+        }
+    };
 
     var DudlrRobot = function(domelement, recording) {
         return this.__init__(domelement, recording);
@@ -282,10 +937,10 @@
     DudlrRobot.prototype = {
 
         __init__: function(domelement, recording) {
-            this.recording = recording;
+            this.recording = DudlrStrokeCodec.load(recording);
+            this.commands = null;
             this.domelement = domelement;
             this.cvs_elm = $(domelement);
-            this._timer = false;
             this._locked = false;
             this.idx = 0;
             this.ctx = this.cvs_elm[0].getContext('2d');
@@ -297,65 +952,121 @@
             this.ctx.fillStyle = "rgba(0,0,0,0.5)";
         },
 
-        run: function() {
-            if (this._locked) return false; 
-            this.idx = 0;
-            this.clear();
-            this._locked = true;
-            this._run();
+        /*
+         * Replay the dudle as fast as the frame budget allows.
+         */
+        run: function(callback) {
+            return this._start(0, callback);
         },
 
-        _run: function() {
-            while (this.idx < this.recording.length) {
-                this._push();
-                if (this.idx && (this.idx % 750) == 0) {
-                    var o = this;
-                    window.setTimeout(function() { o._run() }, 1);
-                    break;
-                } 
-            }
+        /*
+         * Replay the dudle a command every interval milliseconds.
+         */
+        handDraw: function(interval, callback) {
+            return this._start(interval, callback);
         },
 
-        handDraw: function(interval) {
+        _start: function(interval, callback) {
             if (this._locked) return false;
+            if (!this.commands) {
+                this.commands = DudlrStrokeCodec.parse(this.recording);
+            }
             this.clear();
             this._locked = true;
-            var o = this;
             this.idx = 0;
-            this._timer = window.setInterval(function() { o._push(); }, interval);
-        },
-
-        _push: function() {
-            var x, y;
-            if (this.recording[this.idx] == 'm') {
-                this.idx++;
-                x = 1 * (this.recording[this.idx++] + this.recording[this.idx++] + this.recording[this.idx++]);
-                y = 1 * (this.recording[this.idx++] + this.recording[this.idx++] + this.recording[this.idx++]);
-                this.ctx.beginPath();
-                this.ctx.moveTo(x, y);
-                this.ctx.lineTo(x+1, y+1);
-                this.ctx.stroke();
-            } else if (this.recording[this.idx] == 'l') {
-                this.idx++;
-            } else if (this.recording[this.idx] == 's') {
-                this.idx++;
-                this.ctx.fillStyle = FILL_MODES[1 * this.recording[this.idx++]]; 
-            } else if (this.recording[this.idx] == 'f') {
-                this.idx++;
-                this.ctx.fill();
-            } else {
-                x = 1 * (this.recording[this.idx++] + this.recording[this.idx++] + this.recording[this.idx++]);
-                y = 1 * (this.recording[this.idx++] + this.recording[this.idx++] + this.recording[this.idx++]);
-                this.ctx.lineTo(x, y);
-                this.ctx.stroke();
-            }
-            if (this.idx >= this.recording.length) {
-                this._locked = false;
-                if (this._timer) {
-                    window.clearInterval(this._timer);
-                    this._timer = false;
+            this.interval = interval;
+            this.callback = callback || noop;
+            this._began = null;
+            this._path = [];
+            this._pending = false;
+            DudlrReplayScheduler.add(this);
+            return true;
+        },
+
+        /*
+         * Replay commands until done or the deadline passes.  Points of a
+         * stroke are added to one path which is stroked once per step
+         * rather than once per point.
+         *
+         * Returns true when the whole dudle has been replayed.
+         */
+        _step: function(deadline) {
+            var commands = this.commands;
+            var ctx = this.ctx;
+            var path = this._path;
+            var stop = commands.length;
+            if (this.interval) {
+                if (this._began === null) {
+                    this._began = now();
                 }
+                stop = Math.min(stop,
+                        Math.floor((now() - this._began) / this.interval) + 1);
             }
+            var n = 0;
+            while (this.idx < stop) {
+                var c = commands[this.idx++];
+                if (c[0] == 'p') {
+                    ctx.lineTo(c[1], c[2]);
+                    path.push(c[1], c[2]);
+                    this._pending = true;
+                } else if (c[0] == 'm') {
+                    this._stroke();
+                    ctx.beginPath();
+                    ctx.moveTo(c[1], c[2]);
+                    ctx.lineTo(c[1] + 1, c[2] + 1);
+                    path = this._path = [c[1], c[2], c[1] + 1, c[2] + 1];
+                    this._pending = true;
+                } else if (c[0] == 's') {
+                    ctx.fillStyle = FILL_MODES[c[1]];
+                } else if (c[0] == 'f') {
+                    this._stroke();
+                    this._fill();
+                }
+                if ((++n & 63) == 0 && now() >= deadline) {
+                    break;
+                }
+            }
+            this._stroke();
+            if (this.idx < commands.length) {
+                return false;
+            }
+            this._locked = false;
+            this.callback(this);
+            return true;
+        },
+
+        _stroke: function() {
+            if (!this._pending) {
+                return;
+            }
+            var path = this._path;
+            this.ctx.stroke();
+            this._pending = false;
+            // carry on from the pen without stroking these segments again
+            this.ctx.beginPath();
+            if (path.length) {
+                this.ctx.moveTo(path[path.length - 2], path[path.length - 1]);
+            }
+        },
+
+        /*
+         * Fill the whole stroke so far, which may have been stroked in
+         * several pieces.
+         */
+        _fill: function() {
+            var path = this._path;
+            var ctx = this.ctx;
+            if (!path.length) {
+                return;
+            }
+            ctx.beginPath();
+            ctx.moveTo(path[0], path[1]);
+            for (var i = 2; i < path.length; i += 2) {
+                ctx.lineTo(path[i], path[i + 1]);
+            }
+            ctx.fill();
+            ctx.beginPath();
+            ctx.moveTo(path[path.length - 2], path[path.length - 1]);
         }
     };
 
@@ -373,6 +1084,26 @@
         });
     };
 
+    $.dudlrStrokeCodec = DudlrStrokeCodec;
+
+    $.dudlrReplayScheduler = DudlrReplayScheduler;
+
+    $.dudlrStrokes = function(ids, callback) {
+        DudlrStrokeStore.get(ids, callback);
+    };
+
+    $.dudlrStrokes.preload = function(strokes) {
+        DudlrStrokeStore.preload(strokes);
+    };
+
+    $.dudlrStrokeUploader = function(id, token, opts) {
+        return new DudlrStrokeUploader(id, token, opts);
+    };
+
+    $.dudlrStrokeStream = function(recorder, open, opts) {
+        return new DudlrStrokeStream(recorder, open, opts);
+    };
+
     var _registeredBots = {};
 
     $.dudlrRobots = function() {
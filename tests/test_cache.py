@@ -0,0 +1,115 @@
+"""
+Tests for L{dudlr.cache}.
+"""
+
+import unittest
+
+from dudlr import cache
+
+
+class Clock(object):
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class ClockTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = Clock()
+        self.now = cache._now
+        cache._now = self.clock
+
+    def tearDown(self):
+        cache._now = self.now
+
+
+class LRUCacheTest(ClockTestCase):
+
+    def test_get_set(self):
+        lru = cache.LRUCache(3)
+        self.assertEqual(lru.get('a'), None)
+        lru.set('a', 1)
+        lru.set('a', 2)
+        self.assertEqual(lru.get('a'), 2)
+
+    def test_evicts_least_recently_used(self):
+        lru = cache.LRUCache(3)
+        for key in 'abc':
+            lru.set(key, key)
+        lru.get('a')
+        lru.set('b', 'B')
+        lru.set('d', 'd')
+        self.assertEqual(lru.get('c'), None)
+        self.assertEqual([ lru.get(key) for key in 'abd' ], ['a', 'B', 'd'])
+        lru.set('e', 'e')
+        self.assertEqual(lru.get('a'), None)
+
+    def test_expiry(self):
+        lru = cache.LRUCache(3)
+        lru.set('a', 1, time=10)
+        lru.set('b', 2)
+        self.clock.now += 9
+        self.assertEqual(lru.get('a'), 1)
+        self.clock.now += 1
+        self.assertEqual(lru.get('a'), None)
+        self.assertEqual(lru.get('b'), 2)
+        # an expired entry no longer takes up room
+        for key in 'cd':
+            lru.set(key, key)
+        self.assertEqual(lru.get('b'), 2)
+
+    def test_delete(self):
+        lru = cache.LRUCache(3)
+        lru.set('a', 1)
+        lru.delete('a')
+        lru.delete('missing')
+        self.assertEqual(lru.get('a'), None)
+        for key in 'bcd':
+            lru.set(key, key)
+        self.assertEqual([ lru.get(key) for key in 'bcd' ], ['b', 'c', 'd'])
+
+
+class OutputCacheTest(ClockTestCase):
+
+    def setUp(self):
+        ClockTestCase.setUp(self)
+        self.cache = cache.OutputCache(cache.LRUCache(), ttl=60)
+
+    def test_get_set(self):
+        self.assertEqual(self.cache.get('pages', 'a'), None)
+        self.cache.set('pages', 'a', 'A')
+        self.assertEqual(self.cache.get('pages', 'a'), 'A')
+        self.assertEqual(self.cache.get('other', 'a'), None)
+
+    def test_ttl(self):
+        self.cache.set('pages', 'a', 'A')
+        self.clock.now += 60
+        self.assertEqual(self.cache.get('pages', 'a'), None)
+
+    def test_invalidate(self):
+        self.cache.set('pages', 'a', 'A')
+        self.cache.set('pages', 'b', 'B')
+        self.cache.set('other', 'a', 'O')
+        self.clock.now += 1
+        version = self.cache.invalidate('pages')
+        self.assertEqual(self.cache._version('pages'), version)
+        self.assertEqual(self.cache.get('pages', 'a'), None)
+        self.assertEqual(self.cache.get('pages', 'b'), None)
+        self.assertEqual(self.cache.get('other', 'a'), 'O')
+        self.cache.set('pages', 'a', 'A2')
+        self.assertEqual(self.cache.get('pages', 'a'), 'A2')
+
+    def test_version_outlives_entries(self):
+        # versions are stored without a ttl
+        self.cache.set('pages', 'a', 'A')
+        version = self.cache._version('pages')
+        self.clock.now += 3600
+        self.assertEqual(self.cache._version('pages'), version)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,95 @@
+"""
+Round trip tests for L{dudlr.ext.png}: images written with every filter
+type, bit depth and a palette must read back unchanged with C{Reader}.
+"""
+
+import unittest
+from StringIO import StringIO
+from array import array
+
+from dudlr.ext import png
+
+
+FILTERS = [png.FILTER_NONE, png.FILTER_SUB, png.FILTER_UP,
+           png.FILTER_AVERAGE, png.FILTER_PAETH, png.FILTER_ADAPTIVE]
+
+# odd sizes so packed rows end in a partial byte
+WIDTH = 13
+HEIGHT = 7
+
+
+def pixels(levels):
+    return array('B', [ (x * 3 + y * 5 + x * y) % levels
+                        for y in range(HEIGHT) for x in range(WIDTH) ])
+
+
+def read(data):
+    return png.Reader(file=StringIO(data)).read()
+
+
+class WriterRoundTripTest(unittest.TestCase):
+
+    def assertRoundTrip(self, image, **options):
+        """
+        Check every filter and both write methods, return the metadata
+        read back.
+        """
+        found = []
+        for filter_type in FILTERS:
+            writer = png.Writer(WIDTH, HEIGHT, filter_type=filter_type,
+                                **options)
+            for write in ('buffer', 'array'):
+                fd = StringIO()
+                if write == 'buffer':
+                    writer.write_buffer(fd, image.tostring())
+                else:
+                    writer.write_array(fd, image)
+                width, height, decoded, meta = read(fd.getvalue())
+                self.assertEqual((width, height), (WIDTH, HEIGHT))
+                self.assertEqual(decoded.tolist(), image.tolist(),
+                                 '%r %s %r' % (filter_type, write, options))
+                found.append(meta)
+        return found
+
+    def test_greyscale(self):
+        for bitdepth in (1, 2, 4, 8):
+            image = pixels(2 ** bitdepth)
+            for meta in self.assertRoundTrip(image, greyscale=True,
+                                             bitdepth=bitdepth):
+                self.assertEqual(meta['bitdepth'], bitdepth)
+                self.assertTrue(meta['greyscale'])
+
+    def test_palette(self):
+        for bitdepth in (1, 2, 4, 8):
+            size = min(2 ** bitdepth, 5)
+            palette = [ (v * 50, v * 50, v * 50) for v in range(size) ]
+            image = pixels(size)
+            for meta in self.assertRoundTrip(image, palette=palette,
+                                             bitdepth=bitdepth):
+                self.assertEqual(meta['palette'], palette)
+
+    def test_palette_alpha(self):
+        palette = [(0, 0, 0, 0), (255, 255, 255)]
+        for meta in self.assertRoundTrip(pixels(2), palette=palette,
+                                         bitdepth=1):
+            self.assertEqual(meta['palette'],
+                             [(0, 0, 0, 0), (255, 255, 255, 255)])
+
+    def test_rgb(self):
+        image = array('B', [ v % 256 for v in range(WIDTH * HEIGHT * 3) ])
+        for meta in self.assertRoundTrip(image):
+            self.assertFalse(meta['greyscale'])
+
+
+class PurePythonWriterRoundTripTest(WriterRoundTripTest):
+
+    def setUp(self):
+        self.numpy = png.numpy
+        png.numpy = None
+
+    def tearDown(self):
+        png.numpy = self.numpy
+
+
+if __name__ == '__main__':
+    unittest.main()
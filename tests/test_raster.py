@@ -0,0 +1,128 @@
+"""
+Round trip tests for L{dudlr.raster}: every PNG written must decode to
+the exact grey levels it was given, at whatever bit depth or palette
+C{greyscale_png} picked.
+"""
+
+import struct
+import unittest
+import zlib
+from array import array
+
+from dudlr import raster
+from dudlr.ext import png
+
+
+def _paeth(a, b, c):
+    p = a + b - c
+    pa, pb, pc = abs(p - a), abs(p - b), abs(p - c)
+    if pa <= pb and pa <= pc:
+        return a
+    if pb <= pc:
+        return b
+    return c
+
+
+def decode_png(data):
+    """
+    Decode a non-interlaced greyscale or palette PNG to 8-bit grey levels.
+
+    The vendored reader only handles 8-bit greyscale and truecolour, so
+    low bit depths and palettes are unpacked here.
+    """
+    assert data[:8] == '\x89PNG\r\n\x1a\n'
+    i = 8
+    idat = []
+    palette = None
+    while i < len(data):
+        length, tag = struct.unpack('!I4s', data[i:i + 8])
+        chunk = data[i + 8:i + 8 + length]
+        i += 12 + length
+        if tag == 'IHDR':
+            width, height, bitdepth, colour_type = \
+                struct.unpack('!2I2B', chunk[:10])
+        elif tag == 'PLTE':
+            palette = [ ord(chunk[j]) for j in range(0, len(chunk), 3) ]
+        elif tag == 'IDAT':
+            idat.append(chunk)
+    assert colour_type in (0, 3)
+    raw = array('B', zlib.decompress(''.join(idat)))
+    row_bytes = (width * bitdepth + 7) // 8
+    prev = array('B', [0]) * row_bytes
+    pixels = []
+    for y in range(height):
+        offset = y * (row_bytes + 1)
+        filter_type = raw[offset]
+        line = raw[offset + 1:offset + 1 + row_bytes]
+        for x in range(row_bytes):
+            a = x and line[x - 1] or 0
+            b = prev[x]
+            c = x and prev[x - 1] or 0
+            if filter_type == 1:
+                line[x] = (line[x] + a) & 0xff
+            elif filter_type == 2:
+                line[x] = (line[x] + b) & 0xff
+            elif filter_type == 3:
+                line[x] = (line[x] + (a + b) // 2) & 0xff
+            elif filter_type == 4:
+                line[x] = (line[x] + _paeth(a, b, c)) & 0xff
+        prev = line
+        mask = 2 ** bitdepth - 1
+        for x in range(width):
+            bit = x * bitdepth
+            v = (line[bit // 8] >> (8 - bitdepth - bit % 8)) & mask
+            if palette is not None:
+                v = palette[v]
+            else:
+                v = v * 255 // mask
+            pixels.append(v)
+    return width, height, array('B', pixels)
+
+
+class GreyscalePngTest(unittest.TestCase):
+
+    def assertRoundTrip(self, canvas):
+        width, height, pixels = decode_png(canvas.to_png())
+        self.assertEqual((width, height), (canvas.width, canvas.height))
+        self.assertEqual(pixels.tolist(), canvas.pixels.tolist())
+
+    def test_levels(self):
+        for levels in [(255,), (0, 255), (0, 128, 255), (0, 51, 255),
+                       (0, 17, 255), (85, 170), (0, 85, 170, 255),
+                       (0, 17, 34, 51, 68, 255), tuple(range(0, 256, 15)),
+                       tuple(range(0, 256, 7)), tuple(range(256))]:
+            pixels = array('B', [ levels[i % len(levels)]
+                                  for i in range(13 * 7) ])
+            self.assertRoundTrip(raster.Canvas(13, 7, pixels))
+
+    def test_fill_modes(self):
+        # the pen and every pair of fill modes, overlapping so blended
+        # levels show up too
+        modes = range(1, len(raster.FILL_MODES))
+        for first in modes:
+            for second in modes:
+                commands = [
+                    ('s', first),
+                    ('m', 3, 3), ('l', [(40, 5), (30, 30), (5, 25)]), ('f',),
+                    ('s', second),
+                    ('m', 20, 10), ('l', [(60, 12), (55, 38), (22, 35)]),
+                    ('f',),
+                    ('m', 0, 39), ('l', [(63, 0)]),
+                ]
+                canvas = raster.render(commands, 64, 40)
+                self.assertRoundTrip(canvas)
+                self.assertRoundTrip(canvas.scaled(4))
+
+
+class PurePythonGreyscalePngTest(GreyscalePngTest):
+
+    def setUp(self):
+        self.numpy = raster.numpy, png.numpy
+        raster.numpy = png.numpy = None
+
+    def tearDown(self):
+        raster.numpy, png.numpy = self.numpy
+
+
+if __name__ == '__main__':
+    unittest.main()
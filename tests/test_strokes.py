@@ -0,0 +1,99 @@
+"""
+Tests for the stroke codecs in L{dudlr.strokes}.
+"""
+
+import unittest
+
+from dudlr import strokes
+
+
+TEXT = 'm010020l011021012022s2l010020f' \
+       'm499249l000000-99-99999999s4f'
+
+COMMANDS = [
+    ('m', 10, 20),
+    ('l', [(11, 21), (12, 22)]),
+    ('s', 2),
+    ('l', [(10, 20)]),
+    ('f',),
+    ('m', 499, 249),
+    ('l', [(0, 0), (-99, -99), (999, 999)]),
+    ('s', 4),
+    ('f',),
+]
+
+
+class TextTest(unittest.TestCase):
+
+    def test_parse(self):
+        self.assertEqual(strokes.parse_text(TEXT), COMMANDS)
+
+    def test_format(self):
+        self.assertEqual(strokes.format_text(COMMANDS), TEXT)
+
+    def test_points_without_line(self):
+        self.assertEqual(strokes.parse_text('m001002003004005006'),
+                         [('m', 1, 2), ('l', [(3, 4), (5, 6)])])
+
+    def test_clamped(self):
+        self.assertEqual(strokes.format_text([('m', -500, 5000)]),
+                         'm-99999')
+
+    def test_malformed(self):
+        for text in ('m01', 'mabcdef', 's', 'sx', 'm010020l01a021'):
+            self.assertRaises(strokes.StrokeFormatError,
+                              strokes.parse_text, text)
+
+    def test_unknown_command(self):
+        self.assertRaises(strokes.StrokeFormatError,
+                          strokes.format_text, [('x',)])
+
+
+class BinaryTest(unittest.TestCase):
+
+    def test_round_trip(self):
+        for compress in (False, True):
+            data = strokes.encode(COMMANDS, compress)
+            self.assertTrue(strokes.is_binary(data))
+            self.assertEqual(strokes.decode(data), COMMANDS)
+
+    def test_conversions(self):
+        for compress in (False, True):
+            data = strokes.to_binary(TEXT, compress)
+            self.assertEqual(strokes.to_text(data), TEXT)
+            self.assertEqual(strokes.to_binary(data),
+                             strokes.encode(COMMANDS))
+        self.assertEqual(strokes.to_text(TEXT), TEXT)
+        self.assertEqual(strokes.decode(TEXT), COMMANDS)
+
+    def test_smaller(self):
+        self.assertTrue(len(strokes.to_binary(TEXT)) < len(TEXT))
+
+    def test_large_deltas(self):
+        commands = [('m', 0, 0), ('l', [(999, -99), (-99, 999)])]
+        self.assertEqual(strokes.decode(strokes.encode(commands)), commands)
+
+    def test_truncated(self):
+        # every prefix either decodes or raises StrokeFormatError
+        data = strokes.encode(COMMANDS)
+        for end in range(len(strokes.MAGIC) + 2, len(data)):
+            try:
+                strokes.decode(data[:end])
+            except strokes.StrokeFormatError:
+                pass
+
+    def test_corrupt(self):
+        header = strokes.MAGIC + chr(strokes.VERSION)
+        for data in (strokes.MAGIC,
+                     strokes.MAGIC + chr(strokes.VERSION + 1) + '\0',
+                     header + '\0\x09',
+                     header + '\0\x02\x05\x01',
+                     header + chr(strokes.FLAG_ZLIB) + 'not zlib'):
+            self.assertRaises(strokes.StrokeFormatError,
+                              strokes.decode, data)
+        self.assertRaises(strokes.StrokeFormatError, strokes.to_binary,
+                          header + chr(strokes.FLAG_ZLIB) + 'not zlib')
+
+
+if __name__ == '__main__':
+    unittest.main()
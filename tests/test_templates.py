@@ -0,0 +1,160 @@
+"""
+Tests for the template optimizer and escaping in L{jinja2}: optimized
+templates must render exactly what unoptimized ones do.
+"""
+
+import unittest
+
+from jinja2 import Environment, Markup, nodes
+from jinja2.optimizer import optimize
+from jinja2.utils import escape
+
+
+TEMPLATES = [
+    u'a{% if x %}{{ x }}{% endif %}b',
+    u'a{% if x %}{{ x }}{% else %}<none>{% endif %}b',
+    u'{% if x %}<b>{% else %}<i>{% endif %}{{ y }}',
+    u'{% if x %}{{ x }}{{ y }}{% endif %}',
+    u'{% if x %}{% set z = 1 %}{{ z }}{% endif %}',
+    u'{% if 1 %}one{% else %}{{ x }}{% endif %}{% if 0 %}{{ x }}{% endif %}',
+    u'{{ "<a>" if x else y }}|{{ "<a>" if 1 else y }}',
+    u'{{ 4 is even }} {{ 3 is divisibleby 3 }} {{ x is defined }}',
+    u'{{ "a<b"|replace("<", "&") }} {{ "<ab>"|replace("b", y) }}',
+    u'{{ [1, 2, 3]|join("<") }} {{ ["<", ">"]|first }}',
+    u'{{ "%s-%s"|format(1, "<") }} {{ "abc"|upper|truncate(2, true, "") }}',
+    u'{% for i in [1, 2] %}{% if loop.first %}<{% endif %}{{ i }}'
+    u'{% endfor %}',
+    u'{% macro m(v) %}{% if v %}{{ v }}{% endif %}!{% endmacro %}'
+    u'{{ m(x) }}{{ m(0) }}',
+    u'{% filter upper %}{% if x %}{{ x }}{% endif %}<{{ y }}{% endfilter %}',
+]
+
+CONTEXTS = [
+    {},
+    {'x': 0, 'y': u''},
+    {'x': u'<x & "y">', 'y': Markup(u'<em>y</em>')},
+    {'x': 42, 'y': u"it's"},
+    {'x': Markup(u'<b>'), 'y': 3.5},
+]
+
+
+def environment(**options):
+    return Environment(cache_size=0, **options)
+
+
+class OptimizerTest(unittest.TestCase):
+
+    def test_same_output(self):
+        for autoescape in (False, True):
+            plain = environment(optimized=False, autoescape=autoescape)
+            optimized = environment(autoescape=autoescape)
+            for source in TEMPLATES:
+                expected = plain.from_string(source)
+                template = optimized.from_string(source)
+                for context in CONTEXTS:
+                    self.assertEqual(template.render(context),
+                                     expected.render(context),
+                                     '%r %r' % (source, context))
+
+    def test_finalize(self):
+        for autoescape in (False, True):
+            options = dict(autoescape=autoescape,
+                           finalize=lambda v: v is None and u'-' or v)
+            plain = environment(optimized=False, **options)
+            optimized = environment(**options)
+            for source in TEMPLATES:
+                for context in CONTEXTS:
+                    self.assertEqual(
+                        optimized.from_string(source).render(context),
+                        plain.from_string(source).render(context))
+
+    def parse(self, source, **options):
+        env = environment(**options)
+        return optimize(env.parse(source), env)
+
+    def test_filter_arguments(self):
+        # arguments used to be passed to the filter in the wrong order
+        for source, value in [(u'{{ "abc"|replace("b", "x") }}', u'axc'),
+                              (u'{{ [1, 2]|join("-") }}', u'1-2'),
+                              (u'{{ "a%sc"|format("b") }}', u'abc')]:
+            output = self.parse(source).body[0]
+            self.assertEqual(len(output.nodes), 1)
+            self.assertTrue(isinstance(output.nodes[0], nodes.Const))
+            self.assertEqual(output.nodes[0].value, value)
+
+    def test_impure_filter(self):
+        output = self.parse(u'{{ [1, 2]|random }}').body[0]
+        self.assertTrue(isinstance(output.nodes[0], nodes.Filter))
+
+    def test_test(self):
+        output = self.parse(u'{{ 4 is even }}{{ x is even }}').body[0]
+        self.assertTrue(isinstance(output.nodes[0], nodes.Const))
+        self.assertTrue(isinstance(output.nodes[1], nodes.Test))
+
+    def test_inline_if(self):
+        body = self.parse(u'a{% if x %}{{ x }}{% else %}b{% endif %}c').body
+        self.assertEqual(len(body), 1)
+        self.assertEqual([ type(node) for node in body[0].nodes ],
+                         [nodes.TemplateData, nodes.CondExpr,
+                          nodes.TemplateData])
+
+    def test_inline_if_keeps_statements(self):
+        for source in [u'{% if x %}{{ x }}{{ x }}{% endif %}',
+                       u'{% if x %}{% set y = x %}{% endif %}']:
+            body = self.parse(source).body
+            self.assertTrue(isinstance(body[0], nodes.If), source)
+        body = self.parse(u'{% if x %}{{ x }}{% endif %}',
+                          finalize=unicode).body
+        self.assertTrue(isinstance(body[0], nodes.If))
+
+    def test_dead_branch(self):
+        body = self.parse(u'{% if 0 %}{{ x }}{% else %}a{% endif %}b'
+                          u'{{ "c" if 1 else x }}').body
+        self.assertEqual(len(body), 1)
+        self.assertEqual([ type(node) for node in body[0].nodes ],
+                         [nodes.TemplateData, nodes.TemplateData,
+                          nodes.Const])
+
+    def test_merge_output(self):
+        body = self.parse(u'a{{ x }}{% if 1 %}b{% endif %}{{ y }}c').body
+        self.assertEqual(len(body), 1)
+        self.assertEqual(len(body[0].nodes), 5)
+
+
+class EscapeTest(unittest.TestCase):
+
+    def test_escape(self):
+        for value, expected in [
+                (u'', u''),
+                (u'plain', u'plain'),
+                ('bytes', u'bytes'),
+                (u'<a href="x">\'&\'</a>',
+                 u'&lt;a href=&#34;x&#34;&gt;&#39;&amp;&#39;&lt;/a&gt;'),
+                ('a&b', u'a&amp;b'),
+                (42, u'42'),
+                (-7L, u'-7'),
+                (True, u'True'),
+                (1.5, u'1.5'),
+                (None, u'None'),
+                ([u'<'], u"[u&#39;&lt;&#39;]")]:
+            result = escape(value)
+            self.assertEqual(result, expected)
+            self.assertTrue(type(result) is Markup, repr(value))
+
+    def test_markup(self):
+        markup = Markup(u'<b>')
+        self.assertTrue(escape(markup) is markup)
+
+        class Html(object):
+            def __html__(self):
+                return Markup(u'<i>')
+        self.assertEqual(escape(Html()), u'<i>')
+
+    def test_subclass(self):
+        class Text(unicode):
+            pass
+        self.assertEqual(escape(Text(u'<')), u'&lt;')
+
+
+if __name__ == '__main__':
+    unittest.main()
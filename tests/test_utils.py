@@ -0,0 +1,59 @@
+"""
+Tests for the page cursors in L{dudlr.utils}.
+"""
+
+import base64
+import datetime
+import unittest
+
+from dudlr.utils import encode_cursor, decode_cursor
+
+
+def token(raw):
+    return base64.urlsafe_b64encode(raw).rstrip('=')
+
+
+class CursorTest(unittest.TestCase):
+
+    def test_round_trip(self):
+        for value, id in [
+                (datetime.datetime(2009, 5, 17, 13, 4, 59, 123456), 42),
+                (datetime.datetime(1960, 1, 1), 1),
+                (1234.5678901234, 'd17'),
+                (-0.25, 'name:with:colons'),
+                (0, 7),
+                (2 ** 62, 2 ** 62)]:
+            cursor = encode_cursor(value, id)
+            self.assertEqual(decode_cursor(cursor), (value, id))
+            self.assertEqual(decode_cursor(unicode(cursor)), (value, id))
+            self.assertFalse([ c for c in cursor if c in '+/=' ])
+
+    def test_value_type(self):
+        now = datetime.datetime(2009, 5, 17)
+        self.assertEqual(decode_cursor(encode_cursor(now, 1),
+                                       datetime.datetime), (now, 1))
+        self.assertEqual(decode_cursor(encode_cursor(1.5, 1), float),
+                         (1.5, 1))
+        self.assertEqual(decode_cursor(encode_cursor(3, 1), int), (3, 1))
+        self.assertEqual(decode_cursor(encode_cursor(3, 1), long), (3, 1))
+        for value, value_type in [(now, float), (now, int), (1.5, int),
+                                  (1.5, datetime.datetime),
+                                  (3, datetime.datetime), (3, float)]:
+            self.assertRaises(ValueError, decode_cursor,
+                              encode_cursor(value, 1), value_type)
+
+    def test_malformed(self):
+        for cursor in ['', '!!!', 'abc', token('i1'), token(':1'),
+                       token('x1:1'), token('i:1'), token('ia:1'),
+                       token('fx:1'), token('fnan:1'), token('finf:1'),
+                       token('i1:'), token('i1:x'), token('i1:n'),
+                       token('i1:0'), token('i1:-5'),
+                       token('i1:%d' % 2 ** 63),
+                       token('i%d:1' % 2 ** 63),
+                       token('d%d:1' % (9 * 10 ** 18)),
+                       token('d%d:1' % (-9 * 10 ** 18)), u'\xe9']:
+            self.assertRaises(ValueError, decode_cursor, cursor)
+
+
+if __name__ == '__main__':
+    unittest.main()